@@ -0,0 +1,179 @@
+"""
+Batch scoring of arbitrary coordinate lists for the presence and activity models.
+
+Input is a JSON array of points (or {"points": [...]}, or column arrays), an Arrow IPC
+stream or a Parquet file. Latitude/longitude are required; any missing model feature
+is filled from the feature cube / reference CSV. Points are scored in fixed-size chunks
+and streamed back as NDJSON (or Arrow IPC record batches).
+"""
+import datetime
+import io
+import json
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from habitat_grid import ACTIVITY_CLASSES, ACTIVITY_FEATURES, PRESENCE_FEATURES, ocean_mask, wrap_lons
+from fast_predict import feature_matrix, get_predictor
+from metrics import span
+from ocean_utils import get_features_batch
+
+MAX_BATCH_POINTS = int(os.getenv("MAX_BATCH_POINTS", "500000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "50000"))
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+NDJSON = "application/x-ndjson"
+
+# Accepted spellings for each input column
+_ALIASES = {
+    "decimalLatitude": ("decimalLatitude", "lat", "latitude"),
+    "decimalLongitude": ("decimalLongitude", "lng", "lon", "longitude"),
+    "month": ("month",),
+    "bathymetry": ("bathymetry", "depth"),
+    "sst": ("sst", "temperature"),
+    "sss": ("sss", "salinity"),
+    "shoredistance": ("shoredistance",),
+}
+
+
+class BatchInputError(ValueError):
+    """Raised when an uploaded batch cannot be parsed."""
+
+
+class BatchTooLargeError(BatchInputError):
+    """Raised when an uploaded batch exceeds MAX_BATCH_POINTS."""
+
+
+def parse_points(body: bytes, content_type: str = "application/json") -> pd.DataFrame:
+    """Uploaded points as a DataFrame with model column names."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    try:
+        if content_type in (ARROW_STREAM, "application/vnd.apache.arrow.file"):
+            df = pa.ipc.open_stream(body).read_pandas() if content_type == ARROW_STREAM \
+                else pa.ipc.open_file(pa.BufferReader(body)).read_pandas()
+        elif content_type in (PARQUET, "application/x-parquet", "application/octet-stream"):
+            df = pq.read_table(io.BytesIO(body)).to_pandas()
+        else:
+            payload = json.loads(body or b"[]")
+            if isinstance(payload, dict) and "points" in payload:
+                payload = payload["points"]
+            df = pd.DataFrame(payload)
+    except (ValueError, pa.ArrowException) as e:
+        raise BatchInputError(f"Could not parse batch input: {e}")
+
+    out = pd.DataFrame(index=df.index)
+    for name, aliases in _ALIASES.items():
+        for alias in aliases:
+            if alias in df.columns:
+                out[name] = pd.to_numeric(df[alias], errors="coerce")
+                break
+    if "id" in df.columns:
+        out["id"] = df["id"]
+    if df.empty:
+        # Nothing to score: an empty stream, not a missing-column error
+        return pd.DataFrame({name: pd.Series(dtype=float) for name in ("decimalLatitude", "decimalLongitude")})
+    if "decimalLatitude" not in out or "decimalLongitude" not in out:
+        raise BatchInputError("Each point needs lat/latitude and lng/lon/longitude")
+    if len(out) > MAX_BATCH_POINTS:
+        raise BatchTooLargeError(f"Batch has {len(out)} points; the limit is {MAX_BATCH_POINTS}")
+    lat = out["decimalLatitude"]
+    if lat.isna().any() or out["decimalLongitude"].isna().any() or (lat.abs() > 90).any():
+        raise BatchInputError("Latitude/longitude must be numeric with |lat| <= 90")
+    if "month" in out:
+        months = out["month"].dropna()
+        if ((months < 1) | (months > 12) | (months != np.floor(months))).any():
+            raise BatchInputError("Point months must be integers in 1..12")
+    out["decimalLongitude"] = wrap_lons(out["decimalLongitude"].to_numpy())
+    return out.reset_index(drop=True)
+
+
+def fill_features(df: pd.DataFrame, month: Optional[int] = None) -> pd.DataFrame:
+    """Fill missing months and environmental features (bathymetry negative, as in the grid)."""
+    df = df.copy()
+    default_month = month if month is not None else datetime.datetime.now().month
+    if "month" not in df:
+        df["month"] = default_month
+    df["month"] = df["month"].fillna(default_month).astype(np.int64)
+    env = ["bathymetry", "sst", "sss", "shoredistance"]
+    for col in env:
+        if col not in df:
+            df[col] = np.nan
+    missing = df[env].isna().any(axis=1).to_numpy()
+    if missing.any():
+        # Months may differ per point; look up each month's points together
+        for m in np.unique(df.loc[missing, "month"]):
+            rows = np.flatnonzero(missing & (df["month"].to_numpy() == m))
+            feats = get_features_batch(df["decimalLatitude"].to_numpy()[rows],
+                                       df["decimalLongitude"].to_numpy()[rows], int(m))
+            feats["bathymetry"] = -np.abs(feats["bathymetry"])
+            for col in env:
+                current = df[col].to_numpy(dtype=float)
+                current[rows] = np.where(np.isnan(current[rows]), feats[col], current[rows])
+                df[col] = current
+    df["ocean"] = ocean_mask(df["decimalLatitude"].to_numpy(), df["decimalLongitude"].to_numpy())
+    return df
+
+
+def _score_chunk(layer: str, chunk: pd.DataFrame) -> pd.DataFrame:
+    out = pd.DataFrame({"lat": chunk["decimalLatitude"], "lng": chunk["decimalLongitude"]})
+    if "id" in chunk:
+        out.insert(0, "id", chunk["id"])
+    if layer == "presence":
+        with span("inference"):
+            probs = get_predictor("presence").predict_proba(feature_matrix(chunk, PRESENCE_FEATURES))[:, 1]
+        out["month"] = chunk["month"]
+        out["probability"] = probs
+        out["prediction"] = (probs > 0.5).astype(np.int64)
+    else:
+        X = feature_matrix(chunk, ACTIVITY_FEATURES)
+        depth = ACTIVITY_FEATURES.index("bathymetry")
+        X[:, depth] = np.abs(X[:, depth])
+        with span("inference"):
+            probs = get_predictor("activity").predict_proba(X)
+        # Same class names as /behaviour and the region summaries
+        for c, name in enumerate(ACTIVITY_CLASSES):
+            out[f"p_{name}"] = probs[:, c]
+        out["prediction"] = np.argmax(probs, axis=1)
+    for col in ("bathymetry", "sst", "sss", "shoredistance"):
+        out[col] = chunk[col]
+    out["ocean"] = chunk["ocean"]
+    return out
+
+
+def score_chunks(layer: str, df: pd.DataFrame, month: Optional[int] = None,
+                 chunk_size: int = BATCH_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Fill features and score one chunk at a time, so memory stays bounded by chunk_size."""
+    for start in range(0, len(df), chunk_size):
+        chunk = fill_features(df.iloc[start:start + chunk_size], month)
+        yield _score_chunk(layer, chunk)
+
+
+def stream_ndjson(chunks: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    for scored in chunks:
+        with span("serialize"):
+            text = scored.to_json(orient="records", lines=True)
+        # pandas already ends the records with a newline; a blank line is not valid NDJSON
+        yield (text if text.endswith("\n") else text + "\n").encode("utf-8")
+
+
+def stream_arrow(chunks: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """Arrow IPC stream; each scored chunk is flushed to the client as one record batch."""
+    buf = io.BytesIO()
+    writer = None
+    for scored in chunks:
+        with span("serialize"):
+            batch = pa.RecordBatch.from_pandas(scored, preserve_index=False)
+        if writer is None:
+            writer = pa.ipc.new_stream(buf, batch.schema)
+        writer.write_batch(batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+    if writer is not None:
+        writer.close()
+        yield buf.getvalue()
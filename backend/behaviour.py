@@ -0,0 +1,133 @@
+"""
+Global behaviour layer: activity model class probabilities for every ocean grid cell.
+
+    python behaviour.py --resolutions 2 1
+
+Every ocean cell between the polar circles is scored by shark_activity.pkl in one batch,
+with bathymetry and shore distance taken from the shared feature lookup (the feature cube
+when built, otherwise the nearest reference rows). The activity model has no month input,
+so there is one layer per resolution, written to
+backend/data/behaviour_store/res_{resolution}.parquet and tagged with the activity model
+version and the reference data version (see lineage.py). /behaviour serves it from memory
+after the first read and rebuilds it when either version changes.
+"""
+import argparse
+import os
+import time
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from habitat_grid import ACTIVITY_CLASSES, DEFAULT_RESOLUTION, activity_features, grid_mesh, ocean_mask, score_activity
+from lineage import data_version
+from model_registry import registry
+from precompute_habitats import read_table, write_table
+from singleflight import SingleFlight
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BEHAVIOUR_STORE_DIR = os.getenv("BEHAVIOUR_STORE_DIR", os.path.join(BACKEND_DIR, "data", "behaviour_store"))
+
+PROBABILITY_COLUMNS = [f"p_{name}" for name in ACTIVITY_CLASSES]
+
+
+def store_path(resolution: float, root: str = BEHAVIOUR_STORE_DIR) -> str:
+    return os.path.join(root, f"res_{float(resolution):g}.parquet")
+
+
+def compute_layer(resolution: float = DEFAULT_RESOLUTION) -> pd.DataFrame:
+    """Class probabilities (p_migrating, p_resting, p_eating) of every ocean cell."""
+    lats, lons = grid_mesh(resolution)
+    mask = ocean_mask(lats, lons)
+    features = activity_features(lats[mask], lons[mask])
+    probs = score_activity(features)
+    layer = pd.DataFrame({
+        "lat": lats[mask],
+        "lng": lons[mask],
+        "bathymetry": features["bathymetry"].to_numpy(),
+        "shoredistance": features["shoredistance"].to_numpy(),
+        **{column: probs[:, i] for i, column in enumerate(PROBABILITY_COLUMNS)},
+    })
+    return layer.astype(np.float32)
+
+
+def _versions() -> Dict[str, str]:
+    return {"model_version": registry.version("activity"), "data_version": data_version()}
+
+
+def write_layer(layer: pd.DataFrame, resolution: float, root: str = BEHAVIOUR_STORE_DIR) -> str:
+    return write_table(layer, store_path(resolution, root), {**_versions(), "resolution": str(float(resolution))})
+
+
+def read_layer(resolution: float, root: str = BEHAVIOUR_STORE_DIR) -> Optional[pd.DataFrame]:
+    """Stored layer for the current activity model and reference data, or None."""
+    return read_table(store_path(resolution, root), _versions())
+
+
+_layers: Dict[tuple, pd.DataFrame] = {}
+_flight = SingleFlight()
+
+
+def _load_layer(resolution: float) -> pd.DataFrame:
+    layer = read_layer(resolution)
+    if layer is None:
+        layer = compute_layer(resolution)
+        write_layer(layer, resolution)
+    return layer
+
+
+def _store_layer(key: tuple, layer: pd.DataFrame) -> None:
+    # Only the current versions are worth keeping
+    for stale in [k for k in _layers if k[1:] != key[1:]]:
+        del _layers[stale]
+    _layers[key] = layer
+
+
+def get_layer(resolution: float = DEFAULT_RESOLUTION) -> pd.DataFrame:
+    """Layer for a resolution: from memory, else the store, else computed and stored."""
+    key = (float(resolution), *_versions().values())
+    return _flight.get(key, _layers.get, lambda: _load_layer(resolution), _store_layer)
+
+
+def behaviour_payload(layer: pd.DataFrame, resolution: float, threshold: Optional[float] = None) -> Dict[str, Any]:
+    """
+    /sharkActivity-style points ({lat, lng, prediction}) with each cell's class probabilities.
+    threshold keeps only cells whose most likely class has at least that probability.
+    """
+    probs = layer[PROBABILITY_COLUMNS].to_numpy(dtype=np.float64)
+    prediction = probs.argmax(axis=1)
+    keep = np.ones(len(layer), dtype=bool) if threshold is None else probs.max(axis=1) >= threshold
+    lats, lngs = layer["lat"].to_numpy(dtype=np.float64)[keep], layer["lng"].to_numpy(dtype=np.float64)[keep]
+    probs, prediction = np.round(probs[keep], 4), prediction[keep]
+    activity = [
+        {"lat": float(lat), "lng": float(lng), "prediction": int(pred), "probabilities": p.tolist()}
+        for lat, lng, pred, p in zip(lats, lngs, prediction, probs)
+    ]
+    return {
+        "classes": ACTIVITY_CLASSES,
+        "resolution": resolution,
+        "cells": int(len(layer)),
+        "counts": {name: int(np.count_nonzero(prediction == i)) for i, name in enumerate(ACTIVITY_CLASSES)},
+        "activity": activity,
+    }
+
+
+def precompute(resolutions: Iterable[float], root: str = BEHAVIOUR_STORE_DIR) -> None:
+    for resolution in resolutions:
+        start = time.perf_counter()
+        layer = compute_layer(resolution)
+        path = write_layer(layer, resolution, root)
+        print(f"{resolution:g} deg: {len(layer)} cells in {time.perf_counter() - start:.1f}s -> {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the global behaviour layer of the activity model")
+    parser.add_argument("--resolutions", type=float, nargs="+", default=[DEFAULT_RESOLUTION],
+                        help="grid steps in degrees")
+    parser.add_argument("--out", default=BEHAVIOUR_STORE_DIR, help="store directory")
+    args = parser.parse_args()
+    precompute(args.resolutions, args.out)
+
+
+if __name__ == '__main__':
+    main()
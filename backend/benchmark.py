@@ -0,0 +1,279 @@
+"""
+Benchmarks for the backend hot paths.
+
+    python benchmark.py                          # full suite, 1e2..1e6 points
+    python benchmark.py --quick                  # smaller sizes, for a quick check
+    python benchmark.py --only nearest ocean     # benchmarks whose name contains a word
+    python benchmark.py --compare data/benchmarks/bench-20251004-120000.json
+
+Workloads are synthetic, seeded coordinates. Results (best/median seconds per run and
+microseconds per point) are written as JSON to backend/data/benchmarks/ together with the
+git revision and library versions, so runs before and after a change can be compared.
+With --compare, any benchmark slower than the earlier run by more than --tolerance is
+reported, and --fail-on-regression turns that into a non-zero exit code.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(BACKEND_DIR, "data", "benchmarks")
+
+SIZES = [100, 1_000, 10_000, 100_000, 1_000_000]
+QUICK_SIZES = [100, 1_000, 10_000]
+# Per-point (scalar) functions are only run up to this many calls
+SCALAR_MAX = 1_000
+RESOLUTIONS = [2.0, 1.0, 0.5]
+QUICK_RESOLUTIONS = [2.0]
+CONCURRENCY = [1, 4, 16]
+
+
+def random_points(n: int, seed: int = 0, lat_max: float = 66.5):
+    """Uniform-on-the-sphere points between +-lat_max."""
+    rng = np.random.default_rng(seed)
+    z_max = np.sin(np.radians(lat_max))
+    lats = np.degrees(np.arcsin(rng.uniform(-z_max, z_max, n)))
+    lons = rng.uniform(-180.0, 180.0, n)
+    return lats, lons
+
+
+def _selected(name: str, only: Optional[List[str]]) -> bool:
+    return not only or any(word in name for word in only)
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> List[float]:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def _label(result: Dict[str, Any]) -> str:
+    return f"{result['name']}[{result['size']}]" if result["size"] is not None else result["name"]
+
+
+def _record(name: str, size: Optional[int], runs: List[float], **extra) -> Dict[str, Any]:
+    best = min(runs)
+    result = {
+        "name": name,
+        "size": size,
+        "repeat": len(runs),
+        "best_s": best,
+        "median_s": statistics.median(runs),
+        **extra,
+    }
+    if size:
+        result["per_item_us"] = best / size * 1e6
+    print(f"{_label(result):<48} best {best * 1e3:10.2f} ms   median {result['median_s'] * 1e3:10.2f} ms")
+    return result
+
+
+def bench_functions(sizes: List[int], resolutions: List[float], repeat: int,
+                    only: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    import asyncio
+
+    import ocean_utils
+    from habitat_grid import build_grid_features, ocean_mask, predict_grid
+    from model_registry import ModelRegistry, registry
+    from server import generate_grid_points, is_ocean_location
+    from tiles import render_tile
+
+    results = []
+
+    def bench(name: str, size: Optional[int], fn: Callable[[], Any], **extra) -> None:
+        if _selected(name, only):
+            results.append(_record(name, size, _time(fn, repeat), **extra))
+
+    # Load indexes and models outside the timed regions
+    ocean_utils._load_reference_index()
+    registry.preload()
+
+    for n in sizes:
+        lats, lons = random_points(n)
+        if n <= SCALAR_MAX:
+            bench("nearest_row", n, lambda: [ocean_utils._nearest_row(a, b) for a, b in zip(lats, lons)])
+            bench("nearest_shore_distance_km", n,
+                  lambda: [ocean_utils.nearest_shore_distance_km(a, b) for a, b in zip(lats, lons)])
+            bench("is_ocean_location", n, lambda: [is_ocean_location(a, b) for a, b in zip(lats, lons)])
+        bench("nearest_rows_batch", n, lambda: ocean_utils.nearest_rows_batch(lats, lons))
+        bench("nearest_shore_distance_km_batch", n, lambda: ocean_utils.nearest_shore_distance_km_batch(lats, lons))
+        bench("ocean_mask", n, lambda: ocean_mask(lats, lons))
+        bench("get_features_batch", n, lambda: ocean_utils.get_features_batch(lats, lons, 6))
+
+    for res in resolutions:
+        bench(f"generate_grid_points@{res:g}", None, lambda: asyncio.run(generate_grid_points(res)), resolution=res)
+        if _selected(f"predict_grid@{res:g}", only):
+            cells = len(build_grid_features(res, 6))
+            bench(f"predict_grid@{res:g}", cells, lambda: predict_grid(registry.get("presence"), res, 6),
+                  resolution=res)
+
+    for layer in ("presence", "activity"):
+        bench(f"render_tile:{layer}", None, lambda: render_tile(layer, 2, 1, 1, 6))
+
+    for name in ("presence", "activity", "analysis"):
+        bench(f"model_load:{name}", None, lambda: ModelRegistry(hot_reload=False).get(name))
+    return results
+
+
+# (method, path, body, cache modes); "off" disables the response cache, "warm" pre-fills it.
+# Tiles always go through the tile cache (render cost is measured by render_tile above).
+ENDPOINTS = [
+    ("GET", "/get", None, ("off",)),
+    ("POST", "/predictionSighting", None, ("off", "warm")),
+    ("POST", "/sharkActivity", None, ("off", "warm")),
+    ("POST", "/getMigration?seed=1", None, ("off", "warm")),
+    ("GET", "/globalHabitats?resolution=2&month=6", None, ("off", "warm")),
+    ("GET", "/tiles/presence/2/1/1.png?month=6", None, ("warm",)),
+    ("POST", "/predict/presence/batch?month=6", "batch", ("off",)),
+]
+
+
+def bench_endpoints(concurrency: List[int], requests: int, batch_points: int,
+                    only: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Latency and throughput of each endpoint under concurrent load, with the response cache off and warm."""
+    from fastapi.testclient import TestClient
+
+    import server
+    from response_cache import MemoryBackend, response_cache
+
+    lats, lons = random_points(batch_points, seed=1)
+    batch_body = json.dumps([{"lat": float(a), "lng": float(b)} for a, b in zip(lats, lons)])
+
+    results = []
+    original_backend = response_cache.backend
+    with TestClient(server.app) as client:
+        for method, path, body, caches in ENDPOINTS:
+            data = batch_body if body == "batch" else None
+            for cache in caches:
+                response_cache.backend = None if cache == "off" else MemoryBackend()
+                for workers in concurrency:
+                    name = f"endpoint:{method} {path.split('?')[0]}:cache={cache}:c={workers}"
+                    if not _selected(name, only):
+                        continue
+                    if cache == "warm":
+                        client.request(method, path, content=data)
+
+                    def call(_):
+                        start = time.perf_counter()
+                        r = client.request(method, path, content=data)
+                        return time.perf_counter() - start, r.status_code
+
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        samples = list(pool.map(call, range(requests)))
+                    wall = time.perf_counter() - start
+                    latencies = sorted(s for s, _ in samples)
+                    errors = sum(1 for _, status in samples if status >= 400)
+                    results.append(_record(name, None, latencies, requests=requests,
+                                           p50_s=latencies[len(latencies) // 2],
+                                           p95_s=latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                                           throughput_rps=requests / wall, errors=errors))
+    response_cache.backend = original_backend
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    import pandas as pd
+    import xgboost
+
+    from feature_cube import get_cube
+    from land_raster import get_raster
+
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_rev": rev,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "xgboost": xgboost.__version__,
+        "land_raster": get_raster() is not None,
+        "feature_cube": get_cube() is not None,
+    }
+
+
+def compare(current: List[Dict[str, Any]], baseline_path: str, tolerance: float,
+            min_delta_s: float = 0.001) -> List[str]:
+    """
+    Benchmarks slower than the baseline by more than tolerance (best time). Differences
+    under min_delta_s are treated as timer noise.
+    """
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for r in current:
+        old = baseline.get((r["name"], r["size"]))
+        if old is None or not old["best_s"]:
+            continue
+        ratio = r["best_s"] / old["best_s"]
+        flag = ""
+        if ratio > 1 + tolerance and r["best_s"] - old["best_s"] > min_delta_s:
+            flag = "  REGRESSION"
+            regressions.append(_label(r))
+        print(f"{_label(r):<48} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend hot paths")
+    parser.add_argument("--quick", action="store_true", help="small sizes and one grid resolution")
+    parser.add_argument("--sizes", type=int, nargs="*", help="point counts (default 1e2..1e6)")
+    parser.add_argument("--resolutions", type=float, nargs="*", help="grid resolutions in degrees")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=CONCURRENCY, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=32, help="requests per endpoint and concurrency level")
+    parser.add_argument("--batch-points", type=int, default=10_000, help="points per batch request")
+    parser.add_argument("--skip-endpoints", action="store_true", help="only benchmark functions")
+    parser.add_argument("--only", nargs="*", help="keep benchmarks whose name contains any of these")
+    parser.add_argument("--out", default=None, help="output JSON (default: data/benchmarks/bench-<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging, e.g. 0.2 = 20%%")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore slowdowns smaller than this")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if a regression is found")
+    args = parser.parse_args()
+
+    # Benchmarks import the backend modules by their flat names
+    sys.path.insert(0, BACKEND_DIR)
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    resolutions = args.resolutions or (QUICK_RESOLUTIONS if args.quick else RESOLUTIONS)
+
+    results = bench_functions(sizes, resolutions, args.repeat, args.only)
+    if not args.skip_endpoints:
+        concurrency = [1, 4] if args.quick else args.concurrency
+        results += bench_endpoints(concurrency, 8 if args.quick else args.requests, args.batch_points, args.only)
+
+    out = args.out or os.path.join(BENCHMARK_DIR, f"bench-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"\nWrote {len(results)} results to {out}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, args.min_delta_ms / 1e3)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""
+Least-cost migration corridors over the presence probability surface.
+
+    python corridors.py --pairs 300 --resolution 0.25 --month 6   # timing on random pairs
+
+Every ocean cell of the habitat surface (precompute_habitats.py) costs
+
+    step length (km) * (1 + weight * (1 - P(presence)))
+
+to cross and land cells are not in the graph at all, so a corridor is the shortest route
+weighted towards suitable water. Pairs are solved coarse to fine with scipy's Dijkstra on
+a pyramid of graphs: grid cells, then blocks LEVEL_RATIO times larger at each level up to
+about CORRIDOR_COARSE_DEG degrees. A block level has one node per connected patch of water
+in each block, linked only where grid cells are, so routes never jump across land.
+
+    coarsest  one run per distinct source patch gives every pair's route
+    finer     each pair's route widened by one block and expanded to the next level's
+              nodes; all pairs' corridors are laid side by side in one block-diagonal
+              graph and solved by a single multi-source run (no corridor reaches another's
+              source), down to the grid cells
+
+A finer level only searches a band around the coarser route, so a path can differ from the
+global optimum where a better route lies more than a block away.
+
+Paths use the /get "migration" format, one [[lat, lng], ...] per pair. Points where a path
+keeps its direction are dropped and longitudes are unwrapped across the antimeridian, so
+polylines stay continuous (lng may leave [-180, 180]).
+"""
+import argparse
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+from habitat_grid import GRID_LAT_MIN, grid_lats, wrap_lons
+from lineage import data_version
+from metrics import span
+from ocean_utils import KM_PER_DEG, haversine_km, unit_xyz
+from model_registry import registry
+from singleflight import SingleFlight
+
+CORRIDOR_WEIGHT = float(os.getenv("CORRIDOR_WEIGHT", "9"))
+CORRIDOR_RESOLUTION = float(os.getenv("CORRIDOR_RESOLUTION", "0.25"))
+# Finest resolution a request may ask for; a graph's size grows with 1 / resolution^2
+CORRIDOR_MIN_RESOLUTION = float(os.getenv("CORRIDOR_MIN_RESOLUTION", "0.25"))
+CORRIDOR_COARSE_DEG = float(os.getenv("CORRIDOR_COARSE_DEG", "4.0"))
+CORRIDOR_MAX_PAIRS = int(os.getenv("CORRIDOR_MAX_PAIRS", "1000"))
+# Block size ratio between consecutive levels of the graph pyramid
+LEVEL_RATIO = 4
+# Coarsest-level sources per Dijkstra call, bounds the (sources, nodes) result matrices
+_COARSE_BATCH = 64
+
+# Forward neighbour offsets (rows, columns); with their reverses they make 8-connectivity
+_STEPS = ((0, 1), (1, -1), (1, 0), (1, 1))
+# Block offsets of a block and its eight neighbours
+_AROUND_ROWS = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+_AROUND_COLS = np.array([-1, 0, 1] * 3)
+
+
+def _grid_edges(node: np.ndarray, cost: np.ndarray, row_lats: np.ndarray, step_deg: float):
+    """Forward edges (a, b, weight) of an (rows, cols) raster of node ids (-1 = no node), per step."""
+    n_rows, n_cols = node.shape
+    for dr, dc in _STEPS:
+        a = node[:n_rows - dr]
+        b = np.roll(node[dr:], -dc, axis=1)
+        keep = (a >= 0) & (b >= 0)
+        rows = np.nonzero(keep)[0]
+        a, b = a[keep], b[keep]
+        mid_lat = np.radians(row_lats[rows] + dr * step_deg / 2)
+        km = np.hypot(dc * step_deg * KM_PER_DEG * np.cos(mid_lat), dr * step_deg * KM_PER_DEG)
+        yield a, b, km * (cost[a] + cost[b]) / 2
+
+
+def _undirected(a: np.ndarray, b: np.ndarray, w: np.ndarray, n: int) -> csr_matrix:
+    """Symmetric adjacency matrix of edges a-b (searched with directed=True, which skips a CSC copy per call)."""
+    return csr_matrix((np.concatenate([w, w]), (np.concatenate([a, b]), np.concatenate([b, a]))), shape=(n, n))
+
+
+class _Level:
+    """One level of the pyramid: a graph whose nodes are patches of cells in factor x factor blocks."""
+
+    def __init__(self, factor: int, node_of: np.ndarray, graph: csr_matrix, rows: np.ndarray, cols: np.ndarray,
+                 n_cols: int):
+        self.factor = factor
+        self.node_of = node_of
+        self.graph = graph
+        self.n_bcols = -(-n_cols // factor)
+        # Block row and column of every node (all cells of a node share its block)
+        self.block_row = np.zeros(graph.shape[0], dtype=np.int64)
+        self.block_col = np.zeros(graph.shape[0], dtype=np.int64)
+        self.block_row[node_of] = rows // factor
+        self.block_col[node_of] = cols // factor
+
+    def group_by(self, coarser: "_Level") -> None:
+        """Index this level's nodes by the block of the next coarser level they fall in."""
+        ratio = coarser.factor // self.factor
+        self.parent = (self.block_row // ratio) * coarser.n_bcols + self.block_col // ratio
+        self.by_parent = np.argsort(self.parent, kind="stable")
+        self.parents, self.parent_start = np.unique(self.parent[self.by_parent], return_index=True)
+        self.parent_start = np.append(self.parent_start, len(self.parent))
+
+
+class CorridorGraph:
+    """Cost graph pyramid of one habitat surface at one resolution."""
+
+    def __init__(self, surface, resolution: float, weight: float = CORRIDOR_WEIGHT,
+                 coarse_deg: float = CORRIDOR_COARSE_DEG):
+        self.resolution = float(resolution)
+        self.lat = surface["lat"].to_numpy(dtype=np.float64)
+        self.lng = surface["lng"].to_numpy(dtype=np.float64)
+        self.probability = np.clip(surface["probability"].to_numpy(dtype=np.float64), 0.0, 1.0)
+        self.cost = 1.0 + weight * (1.0 - self.probability)
+        n = len(self.lat)
+
+        row_lats = grid_lats(self.resolution)
+        n_cols = int(round(360 / self.resolution))
+        rows = np.rint((self.lat - GRID_LAT_MIN) / self.resolution).astype(np.int64)
+        cols = np.rint((self.lng + 180) / self.resolution).astype(np.int64) % n_cols
+        node = np.full((len(row_lats), n_cols), -1, dtype=np.int64)
+        node[rows, cols] = np.arange(n)
+        a, b, w = (np.concatenate(parts) for parts in zip(*_grid_edges(node, self.cost, row_lats, self.resolution)))
+
+        self.levels = [_Level(1, np.arange(n), _undirected(a, b, w, n), rows, cols, n_cols)]
+        factor = LEVEL_RATIO
+        while factor * self.resolution <= coarse_deg:
+            self.levels.append(self._block_level(factor, a, b, rows, cols, n_cols))
+            self.levels[-2].group_by(self.levels[-1])
+            factor *= LEVEL_RATIO
+        self._tree = None
+
+    def _block_level(self, factor: int, a: np.ndarray, b: np.ndarray, rows: np.ndarray, cols: np.ndarray,
+                     n_cols: int) -> _Level:
+        block = (rows // factor) * -(-n_cols // factor) + cols // factor
+        inner = block[a] == block[b]
+        n_patches, patch_of = connected_components(
+            _undirected(a[inner], b[inner], np.ones(np.count_nonzero(inner)), len(block)), directed=True)
+        size = np.bincount(patch_of)
+        patch_cost = np.bincount(patch_of, weights=self.cost) / size
+        patch_lat = np.bincount(patch_of, weights=self.lat) / size
+        patch_lng = np.bincount(patch_of, weights=self.lng) / size
+
+        # Patches joined by at least one cell edge, weighted centroid to centroid
+        pa, pb = patch_of[a[~inner]], patch_of[b[~inner]]
+        pairs = np.unique(np.minimum(pa, pb) * n_patches + np.maximum(pa, pb))
+        pa, pb = pairs // n_patches, pairs % n_patches
+        km = haversine_km(patch_lat[pa], patch_lng[pa], patch_lat[pb], patch_lng[pb])
+        graph = _undirected(pa, pb, km * (patch_cost[pa] + patch_cost[pb]) / 2, n_patches)
+        return _Level(factor, patch_of, graph, rows, cols, n_cols)
+
+    def snap(self, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+        """Nearest ocean cell of each point."""
+        from scipy.spatial import cKDTree
+
+        if self._tree is None:
+            self._tree = cKDTree(unit_xyz(self.lat, self.lng))
+        _, cells = self._tree.query(unit_xyz(np.asarray(lats, dtype=float), wrap_lons(lngs)))
+        return cells.astype(np.int64)
+
+    def _routes(self, level: _Level, src: np.ndarray, dst: np.ndarray) -> List[Optional[np.ndarray]]:
+        """Node path from each src node to its dst node on the whole level, one run per distinct src."""
+        unique = np.unique(src)
+        routes: List[Optional[np.ndarray]] = [None] * len(src)
+        for start in range(0, len(unique), _COARSE_BATCH):
+            batch = unique[start:start + _COARSE_BATCH]
+            dist, pred = dijkstra(level.graph, directed=True, indices=batch, return_predecessors=True)
+            for j, s in enumerate(batch):
+                for i in np.nonzero(src == s)[0]:
+                    if np.isfinite(dist[j, dst[i]]):
+                        routes[i] = _walk(pred[j], s, dst[i])
+        return routes
+
+    def _corridor(self, level: _Level, coarser: _Level, route: np.ndarray) -> np.ndarray:
+        """Sorted nodes of level in the blocks of a coarser route and their eight neighbours."""
+        rows = (coarser.block_row[route][:, None] + _AROUND_ROWS).ravel()
+        cols = ((coarser.block_col[route][:, None] + _AROUND_COLS) % coarser.n_bcols).ravel()
+        blocks = np.unique(rows * coarser.n_bcols + cols)
+        pos = np.minimum(np.searchsorted(level.parents, blocks), len(level.parents) - 1)
+        pos = pos[level.parents[pos] == blocks]
+        return np.sort(level.by_parent[_ranges(level.parent_start[pos], level.parent_start[pos + 1])])
+
+    def _corridor_routes(self, level: _Level, coarser: _Level, src: np.ndarray, dst: np.ndarray,
+                         coarse_routes: List[Optional[np.ndarray]]) -> List[Optional[np.ndarray]]:
+        """Node paths inside each pair's corridor, all pairs in one multi-source run."""
+        solved = np.array([i for i, route in enumerate(coarse_routes) if route is not None], dtype=np.int64)
+        routes: List[Optional[np.ndarray]] = [None] * len(src)
+        if not len(solved):
+            return routes
+        n = level.graph.shape[0]
+        indptr, indices, data = level.graph.indptr, level.graph.indices, level.graph.data
+        # Position of each node in the corridor being built, -1 outside it
+        local = np.full(n, -1, dtype=np.int64)
+        parts, rows, cols, weights = [], [], [], []
+        sources, targets = np.empty(len(solved), dtype=np.int64), np.empty(len(solved), dtype=np.int64)
+        offset = 0
+        for j, i in enumerate(solved):
+            nodes = self._corridor(level, coarser, coarse_routes[i])
+            local[nodes] = np.arange(offset, offset + len(nodes))
+            edge = _ranges(indptr[nodes], indptr[nodes + 1])
+            ends = local[indices[edge]]
+            keep = ends >= 0
+            rows.append(np.repeat(local[nodes], indptr[nodes + 1] - indptr[nodes])[keep])
+            cols.append(ends[keep])
+            weights.append(data[edge[keep]])
+            sources[j], targets[j] = local[src[i]], local[dst[i]]
+            local[nodes] = -1
+            parts.append(nodes)
+            offset += len(nodes)
+        nodes = np.concatenate(parts)
+        graph = csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                           shape=(offset, offset))
+
+        dist, pred, _ = dijkstra(graph, directed=True, indices=sources, min_only=True, return_predecessors=True)
+        for j, i in enumerate(solved):
+            if np.isfinite(dist[targets[j]]):
+                routes[i] = nodes[_walk(pred, sources[j], targets[j])]
+        return routes
+
+    def solve(self, src: np.ndarray, dst: np.ndarray) -> List[Optional[np.ndarray]]:
+        """Least-cost cell path from each src cell to its dst cell (None if unreachable)."""
+        src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+        # The graph is undirected: root each pair at its more frequent endpoint so fewer
+        # distinct sources are searched, then reverse those paths at the end
+        counts = np.bincount(np.concatenate([src, dst]), minlength=len(self.lat))
+        flip = counts[dst] > counts[src]
+        roots, others = np.where(flip, dst, src), np.where(flip, src, dst)
+
+        top = self.levels[-1]
+        routes = self._routes(top, top.node_of[roots], top.node_of[others])
+        for level, coarser in zip(self.levels[-2::-1], self.levels[:0:-1]):
+            routes = self._corridor_routes(level, coarser, level.node_of[roots], level.node_of[others], routes)
+        return [p[::-1] if p is not None and f else p for p, f in zip(routes, flip)]
+
+    def describe(self, path: Optional[np.ndarray]) -> Tuple[List[List[float]], Dict[str, Any]]:
+        """(migration path, stats) of a cell path."""
+        if path is None:
+            return [], {"reachable": False}
+        lat, lng = self.lat[path], self.lng[path]
+        step = (np.diff(lng) + 180) % 360 - 180
+        lng = lng[0] + np.concatenate([[0.0], np.cumsum(step)])
+        km = haversine_km(lat[:-1], lng[:-1], lat[1:], lng[1:])
+        # Keep the ends and every turn
+        direction = np.stack([np.sign(np.diff(lat)), np.sign(step)], axis=1)
+        turns = np.nonzero(np.any(direction[1:] != direction[:-1], axis=1))[0] + 1
+        keep = np.unique(np.concatenate([[0], turns, [len(path) - 1]]))
+        points = [[round(float(a), 4), round(float(b), 4)] for a, b in zip(lat[keep], lng[keep])]
+        stats = {
+            "reachable": True,
+            "cells": int(len(path)),
+            "length_km": round(float(km.sum()), 1),
+            "cost": round(float(np.sum(km * (self.cost[path[:-1]] + self.cost[path[1:]]) / 2)), 1),
+            "mean_probability": round(float(self.probability[path].mean()), 4),
+        }
+        return points, stats
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of range(starts[i], ends[i]) for all i."""
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(lengths.sum()) + offsets
+
+
+def _walk(pred: np.ndarray, source: int, target: int) -> np.ndarray:
+    """Node path source -> target from a Dijkstra predecessor array."""
+    path = [target]
+    while path[-1] != source:
+        path.append(pred[path[-1]])
+    return np.array(path[::-1], dtype=np.int64)
+
+
+_graphs: "OrderedDict[tuple, CorridorGraph]" = OrderedDict()
+_flight = SingleFlight()
+# Graphs kept in memory; one 0.25 deg graph is about 60 MB
+_MAX_GRAPHS = 2
+
+
+def _cached_graph(key: tuple) -> Optional[CorridorGraph]:
+    if key in _graphs:
+        _graphs.move_to_end(key)
+    return _graphs.get(key)
+
+
+def _store_graph(key: tuple, graph: CorridorGraph) -> None:
+    _graphs[key] = graph
+    while len(_graphs) > _MAX_GRAPHS:
+        _graphs.popitem(last=False)
+
+
+def get_graph(resolution: float, month: int, weight: float = CORRIDOR_WEIGHT) -> CorridorGraph:
+    """Cost graph for the current presence model's surface, built from the habitat store."""
+    from precompute_habitats import load_month
+
+    key = (float(resolution), int(month), float(weight), registry.version("presence"), data_version(month))
+    return _flight.get(key, _cached_graph,
+                       lambda: CorridorGraph(load_month(resolution, month), resolution, weight), _store_graph)
+
+
+def site_pairs(sites: Sequence[Sequence[float]]) -> List[Tuple[Sequence[float], Sequence[float]]]:
+    """Every unordered pair of sites."""
+    return [(sites[i], sites[j]) for i in range(len(sites)) for j in range(i + 1, len(sites))]
+
+
+def corridors(pairs: Sequence[Tuple[Sequence[float], Sequence[float]]], month: int,
+              resolution: float = CORRIDOR_RESOLUTION, weight: float = CORRIDOR_WEIGHT) -> Dict[str, Any]:
+    """
+    Least-cost corridors between ([lat, lng], [lat, lng]) pairs; endpoints snap to the
+    nearest ocean cell. Unreachable pairs get an empty path.
+    """
+    if not pairs:
+        raise ValueError("No pairs given")
+    if len(pairs) > CORRIDOR_MAX_PAIRS:
+        raise ValueError(f"At most {CORRIDOR_MAX_PAIRS} pairs per request")
+    if resolution < CORRIDOR_MIN_RESOLUTION or weight < 0:
+        raise ValueError(f"resolution must be at least {CORRIDOR_MIN_RESOLUTION} and weight non-negative")
+    ends = np.array([[p[0][0], p[0][1], p[1][0], p[1][1]] for p in pairs], dtype=float)
+    if not np.all(np.isfinite(ends)) or np.any(np.abs(ends[:, [0, 2]]) > 90):
+        raise ValueError("Pair endpoints must be [lat, lng] with |lat| <= 90")
+
+    graph = get_graph(resolution, month, weight)
+    with span("corridors"):
+        cells = graph.snap(np.concatenate([ends[:, 0], ends[:, 2]]), np.concatenate([ends[:, 1], ends[:, 3]]))
+        src, dst = cells[:len(pairs)], cells[len(pairs):]
+        paths = graph.solve(src, dst)
+    migration, details = [], []
+    for s, d, path in zip(src, dst, paths):
+        points, stats = graph.describe(path)
+        migration.append(points)
+        details.append({"from": [float(graph.lat[s]), float(graph.lng[s])],
+                        "to": [float(graph.lat[d]), float(graph.lng[d])], **stats})
+    return {"migration": migration, "corridors": details, "month": month,
+            "resolution": resolution, "weight": weight}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time least-cost corridors between random ocean points")
+    parser.add_argument("--pairs", type=int, default=300)
+    parser.add_argument("--sites", type=int, default=0, help="use all pairs among this many random sites instead")
+    parser.add_argument("--resolution", type=float, default=CORRIDOR_RESOLUTION)
+    parser.add_argument("--month", type=int, default=6)
+    parser.add_argument("--weight", type=float, default=CORRIDOR_WEIGHT)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = get_graph(args.resolution, args.month, args.weight)
+    sizes = ", ".join(f"{level.graph.shape[0]} x {level.factor * args.resolution:g} deg" for level in graph.levels)
+    print(f"Graph levels: {sizes}; built in {time.perf_counter() - start:.1f}s")
+    rng = np.random.default_rng(args.seed)
+    points = lambda k: np.stack([graph.lat, graph.lng], axis=1)[rng.integers(0, len(graph.lat), k)].tolist()  # noqa: E731
+    pairs = site_pairs(points(args.sites)) if args.sites else list(zip(points(args.pairs), points(args.pairs)))
+    start = time.perf_counter()
+    result = corridors(pairs, args.month, args.resolution, args.weight)
+    reachable = sum(c["reachable"] for c in result["corridors"])
+    print(f"{len(pairs)} pairs ({reachable} reachable) in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
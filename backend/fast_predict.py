@@ -0,0 +1,179 @@
+"""
+Fast inference path for the XGBoost models.
+
+The sklearn wrapper validates and converts a pandas DataFrame on every call, which costs
+as much as the prediction itself for the small batches the endpoints send. A Predictor
+unwraps the model once into its native Booster and calls inplace_predict on contiguous
+float32 arrays in the model's feature order (no DMatrix, no pandas).
+
+Every predictor is checked against the wrapper on a probe sample when it is built and
+falls back to the wrapper if the outputs differ. tests/test_fast_predict.py asserts parity
+on fixed reference rows of both models; to check parity and timing by hand:
+
+    python fast_predict.py --points 100000
+"""
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from typing import Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from model_registry import registry
+
+# Largest allowed |fast - wrapper| probability difference
+PARITY_TOLERANCE = 1e-6
+PROBE_POINTS = 256
+
+
+def feature_matrix(columns: Mapping[str, object], features: Sequence[str], n: Optional[int] = None) -> np.ndarray:
+    """C-contiguous float32 matrix from a DataFrame or dict of columns (scalars are broadcast)."""
+    if n is None:
+        n = len(columns) if isinstance(columns, pd.DataFrame) else \
+            max(np.size(columns[f]) for f in features)
+    X = np.empty((n, len(features)), dtype=np.float32)
+    for j, name in enumerate(features):
+        col = columns[name]
+        X[:, j] = col.to_numpy(dtype=np.float32) if isinstance(col, pd.Series) else col
+    return X
+
+
+class Predictor:
+    """predict_proba / predict for one loaded model over float32 arrays in `features` order."""
+
+    def __init__(self, model, features: Optional[Sequence[str]] = None):
+        self.model = model
+        self.booster = None
+        self.iteration_range: Tuple[int, int] = (0, 0)
+        self.n_classes = int(getattr(model, "n_classes_", 2))
+        booster_features = None
+        try:
+            self.booster = model.get_booster()
+            booster_features = self.booster.feature_names
+            # Same trees as the wrapper: stop at best_iteration when early stopping was used
+            best = getattr(model, "best_iteration", None)
+            if best is not None:
+                self.iteration_range = (0, int(best) + 1)
+        except (AttributeError, ValueError):
+            self.booster = None
+        self.features = list(features or booster_features or [])
+
+    def _wrapper_proba(self, X: np.ndarray) -> np.ndarray:
+        # The endpoints used to pass float64 DataFrames; keep that as the reference
+        return np.asarray(self.model.predict_proba(pd.DataFrame(X, columns=self.features)))
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Class probabilities, shape (n, n_classes), like the sklearn wrapper."""
+        if X.shape[0] == 0:
+            return np.empty((0, self.n_classes), dtype=np.float32)
+        if self.booster is None:
+            return self._wrapper_proba(X)
+        out = self.booster.inplace_predict(np.ascontiguousarray(X, dtype=np.float32),
+                                           iteration_range=self.iteration_range, validate_features=False)
+        if out.ndim == 1:
+            # binary:logistic returns P(class 1) only
+            return np.column_stack([1.0 - out, out])
+        return out
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Labels: P > 0.5 for binary models, argmax otherwise (as XGBClassifier.predict)."""
+        probs = self.predict_proba(X)
+        if probs.shape[1] == 2:
+            return (probs[:, 1] > 0.5).astype(np.int64)
+        return np.argmax(probs, axis=1)
+
+    def parity(self, X: np.ndarray) -> float:
+        """Max |fast - wrapper| probability over X."""
+        if self.booster is None or X.shape[0] == 0:
+            return 0.0
+        return float(np.max(np.abs(self.predict_proba(X) - self._wrapper_proba(X))))
+
+
+def probe_sample(features: Sequence[str], n: int = PROBE_POINTS, seed: int = 0) -> np.ndarray:
+    """Plausible inputs for a parity check, drawn per feature."""
+    rng = np.random.default_rng(seed)
+    ranges = {
+        "decimalLatitude": (-66.5, 66.5),
+        "decimalLongitude": (-180.0, 180.0),
+        "month": (1, 12),
+        "bathymetry": (-6000.0, 6000.0),
+        "sst": (-2.0, 32.0),
+        "sss": (30.0, 40.0),
+        "shoredistance": (0.0, 3_000_000.0),
+    }
+    cols = []
+    for name in features:
+        lo, hi = ranges.get(name, (0.0, 1.0))
+        col = rng.integers(lo, hi + 1, n) if name == "month" else rng.uniform(lo, hi, n)
+        cols.append(col)
+    return np.column_stack(cols).astype(float)
+
+
+# Predictors by model object; a hot reload brings a new object, old ones age out
+_predictors: "OrderedDict[int, Predictor]" = OrderedDict()
+_MAX_PREDICTORS = 8
+_lock = threading.Lock()
+
+
+def predictor_for(model) -> Predictor:
+    """Cached, parity-checked Predictor for a loaded model."""
+    with _lock:
+        predictor = _predictors.get(id(model))
+        if predictor is not None and predictor.model is model:
+            return predictor
+        predictor = Predictor(model)
+        diff = predictor.parity(probe_sample(predictor.features))
+        if diff > PARITY_TOLERANCE:
+            print(f"Fast path differs from predict_proba by {diff:.2e}; using the sklearn wrapper")
+            predictor.booster = None
+        _predictors[id(model)] = predictor
+        while len(_predictors) > _MAX_PREDICTORS:
+            _predictors.popitem(last=False)
+        return predictor
+
+
+def get_predictor(name: str) -> Predictor:
+    """Predictor for a registry model ("presence", "activity")."""
+    return predictor_for(registry.get(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the fast inference path against the sklearn wrapper")
+    parser.add_argument("--points", type=int, default=100_000, help="random probe points per model")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failed = False
+    for name in ("presence", "activity"):
+        predictor = Predictor(registry.get(name))
+        X = probe_sample(predictor.features, args.points, args.seed)
+        diff = predictor.parity(X)
+        labels_fast = predictor.predict(X)
+        labels_wrapper = np.asarray(predictor.model.predict(pd.DataFrame(X, columns=predictor.features)))
+        mismatched = int(np.count_nonzero(labels_fast != labels_wrapper))
+        ok = diff <= PARITY_TOLERANCE and mismatched == 0
+        failed |= not ok
+
+        timings = []
+        for n in (1, 10, 100, 1000):
+            sample = X[:n]
+            frame = pd.DataFrame(sample, columns=predictor.features)
+            start = time.perf_counter()
+            for _ in range(50):
+                predictor.model.predict_proba(frame)
+            wrapper_ms = (time.perf_counter() - start) / 50 * 1e3
+            start = time.perf_counter()
+            for _ in range(50):
+                predictor.predict_proba(sample)
+            fast_ms = (time.perf_counter() - start) / 50 * 1e3
+            timings.append(f"n={n}: {wrapper_ms:.2f} -> {fast_ms:.2f} ms")
+        print(f"{name}: max |dp| {diff:.2e}, label mismatches {mismatched}/{len(X)} "
+              f"[{'OK' if ok else 'FAIL'}]; {'; '.join(timings)}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Gridded environmental feature cube (sst, sss, bathymetry, shoredistance).
+
+Build once (offline) from the reference CSV the nearest-row lookups use (see
+reference_store.reference_csv_path), optionally overlaying gridded NetCDF products:
+    python feature_cube.py --resolution 1.0
+    python feature_cube.py --netcdf /data/sst_clim.nc:analysed_sst=sst
+
+The cube is an xarray Dataset stored as zarr (backend/data/feature_cube.zarr).
+sst and sss are indexed by (month, lat, lon); bathymetry and shoredistance by (lat, lon).
+Values keep the CSV units the presence model was trained on (bathymetry positive metres,
+shoredistance metres). Lookups interpolate thousands of points at once with NumPy.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from reference_store import read_frame, reference_csv_path
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CUBE_PATH = os.getenv("FEATURE_CUBE_PATH", os.path.join(BACKEND_DIR, "data", "feature_cube.zarr"))
+DEFAULT_RESOLUTION = 1.0
+MONTHLY_VARS = ("sst", "sss")
+STATIC_VARS = ("bathymetry", "shoredistance")
+CUBE_VARS = MONTHLY_VARS + STATIC_VARS
+
+
+def _axes(resolution: float):
+    lat = -90.0 + resolution / 2 + np.arange(int(round(180.0 / resolution))) * resolution
+    lon = -180.0 + resolution / 2 + np.arange(int(round(360.0 / resolution))) * resolution
+    return lat, lon
+
+
+def _nearest_fill(field: np.ndarray, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Fill NaN cells of a (lat, lon) field from the great-circle nearest valid cell."""
+    from scipy.spatial import cKDTree
+
+    # ocean_utils imports this module, so its helpers are imported here
+    from ocean_utils import unit_xyz
+
+    missing = np.isnan(field)
+    if not missing.any() or missing.all():
+        return field
+    lat_grid, lon_grid = np.meshgrid(lat, lon, indexing="ij")
+    tree = cKDTree(unit_xyz(lat_grid[~missing], lon_grid[~missing]))
+    _, idx = tree.query(unit_xyz(lat_grid[missing], lon_grid[missing]), k=1, workers=-1)
+    out = field.copy()
+    out[missing] = field[~missing][idx]
+    return out
+
+
+def _read_csvs(paths: Sequence[str], include_absences: bool) -> pd.DataFrame:
+    usecols = ["decimalLatitude", "decimalLongitude", "month", "presence", *CUBE_VARS]
+    frames = []
+    for path in paths:
+        df = read_frame(path, usecols)
+        # Absence rows in the refined CSVs carry synthetic environment values
+        if not include_absences and "presence" in df:
+            df = df[df["presence"] == 1]
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    return df.dropna(subset=["decimalLatitude", "decimalLongitude"])
+
+
+def build_from_csv(paths: Optional[Sequence[str]] = None, resolution: float = DEFAULT_RESOLUTION,
+                   include_absences: bool = False) -> xr.Dataset:
+    """
+    Bin CSV observations onto the grid (cell means), then gap-fill from the nearest observed cell.
+    paths defaults to the reference CSV the nearest-row lookups use.
+    """
+    paths = list(paths or [reference_csv_path()])
+    df = _read_csvs(paths, include_absences)
+    lat, lon = _axes(resolution)
+    rows = np.clip(np.floor((df["decimalLatitude"].to_numpy() + 90.0) / resolution).astype(np.int64), 0, lat.size - 1)
+    cols = np.floor(((df["decimalLongitude"].to_numpy() + 180.0) % 360.0) / resolution).astype(np.int64)
+    cols = np.clip(cols, 0, lon.size - 1)
+    cell = rows * lon.size + cols
+    n_cells = lat.size * lon.size
+
+    def cell_mean(values: np.ndarray, keys: np.ndarray, size: int) -> np.ndarray:
+        ok = ~np.isnan(values)
+        sums = np.bincount(keys[ok], weights=values[ok], minlength=size)
+        counts = np.bincount(keys[ok], minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    data_vars = {}
+    for var in STATIC_VARS:
+        field = cell_mean(df[var].to_numpy(dtype=float), cell, n_cells).reshape(lat.size, lon.size)
+        data_vars[var] = (("lat", "lon"), _nearest_fill(field, lat, lon).astype(np.float32))
+
+    month = df["month"].to_numpy(dtype=float)
+    has_month = ~np.isnan(month)
+    months = np.arange(1, 13)
+    for var in MONTHLY_VARS:
+        values = df[var].to_numpy(dtype=float)
+        # Annual climatology is the fallback for months with no nearby observation
+        annual = _nearest_fill(cell_mean(values, cell, n_cells).reshape(lat.size, lon.size), lat, lon)
+        keys = (month[has_month].astype(np.int64) - 1) * n_cells + cell[has_month]
+        monthly = cell_mean(values[has_month], keys, 12 * n_cells).reshape(12, lat.size, lon.size)
+        monthly = np.where(np.isnan(monthly), annual[None, :, :], monthly)
+        data_vars[var] = (("month", "lat", "lon"), monthly.astype(np.float32))
+
+    return xr.Dataset(
+        data_vars,
+        coords={"month": months, "lat": lat, "lon": lon},
+        attrs={"resolution": resolution, "sources": ",".join(os.path.basename(p) for p in paths),
+               "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               # Everything needed to rebuild the cube the same way (see rebuild)
+               "inputs": json.dumps({"csv": [os.path.abspath(p) for p in paths],
+                                     "include_absences": include_absences, "netcdf": []})},
+    )
+
+
+def overlay_netcdf(cube: xr.Dataset, path: str, variable: str, feature: str) -> xr.Dataset:
+    """
+    Overlay a gridded NetCDF variable (already in model units) onto a cube feature.
+    Accepts lat/latitude and lon/longitude coordinates and an optional time axis,
+    which is reduced to a monthly climatology.
+    """
+    src = xr.open_dataset(path)[variable]
+    src = src.rename({k: v for k, v in {"latitude": "lat", "longitude": "lon"}.items() if k in src.dims})
+    if "time" in src.dims:
+        src = src.groupby("time.month").mean("time")
+    extra = [d for d in src.dims if d not in ("month", "lat", "lon")]
+    if extra:
+        # e.g. a depth axis: keep the surface level
+        src = src.isel({d: 0 for d in extra})
+    src = src.assign_coords(lon=((src["lon"] + 180.0) % 360.0) - 180.0).sortby("lon")
+    on_grid = src.interp(lat=cube["lat"], lon=cube["lon"], method="linear")
+    if "month" in cube[feature].dims and "month" not in on_grid.dims:
+        on_grid = on_grid.expand_dims(month=cube["month"])
+    elif "month" not in cube[feature].dims and "month" in on_grid.dims:
+        on_grid = on_grid.mean("month")
+    cube[feature] = on_grid.transpose(*cube[feature].dims).fillna(cube[feature]).astype(np.float32)
+    return cube
+
+
+def apply_overlays(cube: xr.Dataset, specs: Sequence[str]) -> xr.Dataset:
+    """Overlay each PATH:VARIABLE=FEATURE spec, recording them in the cube's inputs."""
+    for spec in specs:
+        path, _, mapping = spec.rpartition(":")
+        variable, _, feature = mapping.partition("=")
+        if feature not in CUBE_VARS:
+            raise ValueError(f"Unknown feature '{feature}', expected one of {', '.join(CUBE_VARS)}")
+        cube = overlay_netcdf(cube, path, variable, feature)
+    inputs = json.loads(cube.attrs.get("inputs", "{}"))
+    inputs["netcdf"] = inputs.get("netcdf", []) + list(specs)
+    cube.attrs["inputs"] = json.dumps(inputs)
+    return cube
+
+
+def cube_inputs(path: str = DEFAULT_CUBE_PATH) -> Optional[Dict[str, object]]:
+    """CSV paths, include_absences and overlays a stored cube was built from (None if unknown)."""
+    try:
+        with xr.open_zarr(path, consolidated=False) as ds:
+            inputs = ds.attrs.get("inputs")
+            resolution = float(ds.attrs.get("resolution", DEFAULT_RESOLUTION))
+    except Exception:
+        return None
+    if not inputs:
+        return None
+    return {**json.loads(inputs), "resolution": resolution}
+
+
+def rebuild(path: str = DEFAULT_CUBE_PATH) -> bool:
+    """Rebuild a stored cube from its recorded inputs (e.g. after the CSVs changed). False if it cannot be."""
+    inputs = cube_inputs(path)
+    if inputs is None:
+        print(f"Feature cube {path} does not record its inputs; rebuild it with feature_cube.py")
+        return False
+    cube = build_from_csv(inputs["csv"], inputs["resolution"], inputs["include_absences"])
+    cube = apply_overlays(cube, inputs["netcdf"])
+    cube.to_zarr(path, mode="w", consolidated=False)
+    reset_cube()
+    return True
+
+
+class FeatureCube:
+    """In-memory NumPy view of the cube with vectorized nearest/bilinear lookups."""
+
+    def __init__(self, ds: xr.Dataset):
+        self.lat = ds["lat"].to_numpy()
+        self.lon = ds["lon"].to_numpy()
+        self.resolution = float(self.lat[1] - self.lat[0])
+        self.fields = {var: ds[var].to_numpy() for var in CUBE_VARS}
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CUBE_PATH) -> "FeatureCube":
+        with xr.open_zarr(path, consolidated=False) as ds:
+            return cls(ds.load())
+
+    def _sample(self, field: np.ndarray, rows: np.ndarray, cols: np.ndarray, month_idx: Optional[np.ndarray]):
+        if field.ndim == 3:
+            return field[month_idx, rows, cols]
+        return field[rows, cols]
+
+    def lookup(self, lats, lons, months, method: str = "linear") -> Dict[str, np.ndarray]:
+        """
+        Features for many points at once. months may be a scalar or an array (1-12).
+        method is "nearest" or "linear" (bilinear, wrapping in longitude).
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        month_idx = np.broadcast_to(np.asarray(months, dtype=np.int64) - 1, lats.shape) % 12
+        n_lat, n_lon = self.lat.size, self.lon.size
+        # Fractional cell coordinates relative to the first cell centre
+        fy = (lats - self.lat[0]) / self.resolution
+        fx = (((lons + 180.0) % 360.0) - 180.0 - self.lon[0]) / self.resolution
+        out = {}
+        if method == "nearest":
+            rows = np.clip(np.rint(fy).astype(np.int64), 0, n_lat - 1)
+            cols = np.rint(fx).astype(np.int64) % n_lon
+            for var, field in self.fields.items():
+                out[var] = self._sample(field, rows, cols, month_idx).astype(float)
+            return out
+        if method != "linear":
+            raise ValueError(f"Unknown interpolation method: {method}")
+        fy = np.clip(fy, 0, n_lat - 1)
+        y0 = np.clip(np.floor(fy).astype(np.int64), 0, n_lat - 2)
+        wy = fy - y0
+        x0f = np.floor(fx)
+        wx = fx - x0f
+        x0 = x0f.astype(np.int64) % n_lon
+        x1 = (x0 + 1) % n_lon
+        for var, field in self.fields.items():
+            v00 = self._sample(field, y0, x0, month_idx)
+            v01 = self._sample(field, y0, x1, month_idx)
+            v10 = self._sample(field, y0 + 1, x0, month_idx)
+            v11 = self._sample(field, y0 + 1, x1, month_idx)
+            out[var] = ((v00 * (1 - wx) + v01 * wx) * (1 - wy) + (v10 * (1 - wx) + v11 * wx) * wy).astype(float)
+        return out
+
+
+_CUBE: Optional[FeatureCube] = None
+_CUBE_CHECKED = False
+
+
+def get_cube() -> Optional[FeatureCube]:
+    """The on-disk cube if it has been built, else None (callers fall back to nearest CSV rows)."""
+    global _CUBE, _CUBE_CHECKED
+    if not _CUBE_CHECKED:
+        _CUBE_CHECKED = True
+        if os.path.exists(DEFAULT_CUBE_PATH):
+            try:
+                _CUBE = FeatureCube.load(DEFAULT_CUBE_PATH)
+            except Exception as e:
+                print(f"Failed to load feature cube from {DEFAULT_CUBE_PATH}: {str(e)}")
+    return _CUBE
+
+
+def reset_cube() -> None:
+    """Forget the loaded cube; the next get_cube reads it from disk again."""
+    global _CUBE, _CUBE_CHECKED
+    _CUBE = None
+    _CUBE_CHECKED = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the gridded environmental feature cube")
+    parser.add_argument("--csv", action="append", help="input CSV (repeatable); defaults to the reference CSV")
+    parser.add_argument("--netcdf", action="append", default=[],
+                        help="overlay PATH:VARIABLE=FEATURE from a local NetCDF file (repeatable)")
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION, help="cell size in degrees")
+    parser.add_argument("--include-absences", action="store_true", help="also bin presence == 0 rows")
+    parser.add_argument("--out", default=DEFAULT_CUBE_PATH, help="output zarr store")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cube = build_from_csv(args.csv, args.resolution, args.include_absences)
+    try:
+        cube = apply_overlays(cube, args.netcdf)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    cube.to_zarr(args.out, mode="w", consolidated=False)
+    print(f"Built feature cube {dict(cube.sizes)} in {time.perf_counter() - start:.1f}s -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import datetime
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from fast_predict import feature_matrix, get_predictor, predictor_for
+from land_raster import is_land
+from metrics import inc, span
+from ocean_utils import get_features_batch
+
+# Feature order expected by presence_model.pkl
+PRESENCE_FEATURES = [
+    "decimalLatitude",
+    "decimalLongitude",
+    "month",
+    "bathymetry",
+    "sst",
+    "sss",
+    "shoredistance",
+]
+
+# Feature order expected by shark_activity.pkl
+ACTIVITY_FEATURES = ["bathymetry", "decimalLatitude", "decimalLongitude", "shoredistance"]
+# Behaviour classes of shark_activity.pkl in predict_proba column order (checked against the
+# one-hot Behavior_filled_* labels of models/Shark activity/ready_to_run.csv)
+ACTIVITY_CLASSES = ["migrating", "resting", "eating"]
+
+# Arctic / Antarctic circles
+GRID_LAT_MIN = -66.5
+GRID_LAT_MAX = 66.5
+DEFAULT_RESOLUTION = 2.0
+# Finest grid built whole for one response; finer grids are only served band by band
+# (stream=true) or as background jobs, down to GLOBAL_BANDED_MIN_RESOLUTION
+GLOBAL_MIN_RESOLUTION = float(os.getenv("GLOBAL_MIN_RESOLUTION", "0.25"))
+GLOBAL_BANDED_MIN_RESOLUTION = float(os.getenv("GLOBAL_BANDED_MIN_RESOLUTION", "0.1"))
+# Target number of grid cells per streamed latitude band
+BAND_CELLS = 50000
+
+
+def wrap_lons(lons: np.ndarray) -> np.ndarray:
+    """Vectorized _wrap_lon: wrap longitudes to [-180, 180]."""
+    lons = np.asarray(lons, dtype=float)
+    return np.where(lons > 180, lons - 360, np.where(lons < -180, lons + 360, lons))
+
+
+def ocean_mask(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Boolean mask, True where the point is over the ocean."""
+    with span("land_mask"):
+        mask = ~is_land(lats, wrap_lons(lons))
+    inc("sharkapi_land_filtered_points_total", int(mask.size - np.count_nonzero(mask)))
+    return mask
+
+
+def grid_lats(resolution: float = DEFAULT_RESOLUTION,
+              lat_min: float = GRID_LAT_MIN,
+              lat_max: float = GRID_LAT_MAX) -> np.ndarray:
+    """Latitude rows of the global grid."""
+    if resolution <= 0:
+        raise ValueError("resolution must be positive")
+    return np.arange(lat_min, lat_max, resolution)
+
+
+def grid_mesh(resolution: float = DEFAULT_RESOLUTION,
+              lat_min: float = GRID_LAT_MIN,
+              lat_max: float = GRID_LAT_MAX,
+              lats: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Flattened lat/lon mesh in row-major (latitude band) order. lats restricts it to some rows."""
+    if resolution <= 0:
+        raise ValueError("resolution must be positive")
+    if lats is None:
+        lats = grid_lats(resolution, lat_min, lat_max)
+    lons = np.arange(-180, 180, resolution)
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing="ij")
+    return lat_grid.ravel(), lon_grid.ravel()
+
+
+def build_grid_features(resolution: float = DEFAULT_RESOLUTION,
+                        month: Optional[int] = None,
+                        lats: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Build the model input table for every ocean cell of the global grid
+    (or of the latitude rows in lats).
+    Columns follow PRESENCE_FEATURES; bathymetry is negative (model convention).
+    """
+    if month is None:
+        month = datetime.datetime.now().month
+    lats, lons = grid_mesh(resolution, lats=lats)
+    mask = ocean_mask(lats, lons)
+    return grid_features(lats[mask], lons[mask], month)
+
+
+def grid_features(lats: np.ndarray, lons: np.ndarray, month: int) -> pd.DataFrame:
+    """
+    Model input table (PRESENCE_FEATURES order) for given ocean cells. Feature lookup
+    errors propagate: an empty table would pass for a valid, cacheable surface.
+    """
+    feats = get_features_batch(lats, lons, month)
+    return pd.DataFrame({
+        "decimalLatitude": lats,
+        "decimalLongitude": lons,
+        "month": np.full(lats.shape[0], month, dtype=np.int64),
+        # Bathymetry in model is expected negative; features are positive meters
+        "bathymetry": -np.abs(feats["bathymetry"]),
+        "sst": feats["sst"],
+        "sss": feats["sss"],
+        "shoredistance": feats["shoredistance"],
+    }, columns=PRESENCE_FEATURES)
+
+
+def activity_features(lats: np.ndarray, lons: np.ndarray) -> pd.DataFrame:
+    """Activity model input table (ACTIVITY_FEATURES order) for given ocean cells."""
+    # Bathymetry and shore distance are static, any month gives the same values
+    feats = get_features_batch(lats, lons, 1)
+    return pd.DataFrame({
+        # The activity model was trained on positive depths
+        "bathymetry": np.abs(feats["bathymetry"]),
+        "decimalLatitude": lats,
+        "decimalLongitude": lons,
+        "shoredistance": feats["shoredistance"],
+    }, columns=ACTIVITY_FEATURES)
+
+
+def score_activity(features: pd.DataFrame) -> np.ndarray:
+    """(n, len(ACTIVITY_CLASSES)) class probabilities for all rows in one call."""
+    if features.empty:
+        return np.empty((0, len(ACTIVITY_CLASSES)), dtype=np.float32)
+    with span("inference"):
+        predictor = get_predictor("activity")
+        return predictor.predict_proba(feature_matrix(features, predictor.features))
+
+
+def score_presence(model, features: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Score all rows in one call. Returns (labels, probability of presence)."""
+    if features.empty:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    with span("inference"):
+        try:
+            predictor = predictor_for(model)
+            probs = predictor.predict_proba(feature_matrix(features, predictor.features))[:, 1]
+            labels = (probs > 0.5).astype(np.int64)
+        except Exception:
+            labels = np.asarray(model.predict(features[PRESENCE_FEATURES]), dtype=np.int64)
+            probs = labels.astype(float)
+    return labels, probs
+
+
+# Columns of a scored surface, named as in the /predictionSighting habitat payload
+SURFACE_COLUMNS = ["lat", "lng", "bathymetry", "temperature", "salinity", "shoredistance", "probability"]
+
+
+def uncertainty_column(method: str) -> str:
+    """Surface column holding the spread of the probability for an uncertainty method (see uncertainty.py)."""
+    return f"probability_std_{method}"
+
+
+def surface_frame(features: pd.DataFrame, probs: np.ndarray) -> pd.DataFrame:
+    """Scored grid cells in payload naming (lat, lng, temperature, ...)."""
+    return pd.DataFrame({
+        "lat": features["decimalLatitude"].to_numpy(dtype=float),
+        "lng": features["decimalLongitude"].to_numpy(dtype=float),
+        "bathymetry": features["bathymetry"].to_numpy(dtype=float),
+        "temperature": features["sst"].to_numpy(dtype=float),
+        "salinity": features["sss"].to_numpy(dtype=float),
+        "shoredistance": features["shoredistance"].to_numpy(dtype=float),
+        "probability": np.asarray(probs, dtype=float),
+    }, columns=SURFACE_COLUMNS)
+
+
+def _clean(values: np.ndarray) -> List[Any]:
+    """Array to JSON-safe list (NaN -> None)."""
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def habitats_payload(surface: pd.DataFrame, selected: np.ndarray, uncertainty: Optional[str] = None,
+                     columnar: bool = False) -> Union[List[Dict[str, Any]], Dict[str, np.ndarray]]:
+    """
+    Selected cells in the /predictionSighting habitat format, with probability_std if asked
+    for. columnar returns the same fields as arrays (NaN kept) for the binary formats of wire.py.
+    """
+    hits = surface[selected]
+    columns = {col: hits[col].to_numpy(dtype=float) for col in SURFACE_COLUMNS}
+    if uncertainty is not None:
+        columns["probability_std"] = hits[uncertainty_column(uncertainty)].to_numpy(dtype=float)
+    if columnar:
+        return columns
+    columns = {col: _clean(values) for col, values in columns.items()}
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def summarize_surface(surface: pd.DataFrame, month: int, threshold: Optional[float] = None,
+                      uncertainty: Optional[str] = None, columnar: bool = False) -> Dict[str, Any]:
+    """
+    Global habitat response for a scored surface. Without a threshold the model's own
+    decision (probability > 0.5) is used. With an uncertainty method, each habitat carries
+    probability_std from that method's column.
+    """
+    probs = surface["probability"].to_numpy(dtype=float)
+    selected = probs >= threshold if threshold is not None else probs > 0.5
+    possible_habitats = habitats_payload(surface, selected, uncertainty, columnar)
+    summary = {
+        "total_points_checked": int(len(surface)),
+        "possible_habitats": possible_habitats,
+        "points_count": int(selected.sum()),
+        "month": int(month),
+    }
+    if uncertainty is not None:
+        summary["uncertainty"] = uncertainty
+    return summary
+
+
+def predict_grid(model, resolution: float = DEFAULT_RESOLUTION, month: Optional[int] = None,
+                 threshold: Optional[float] = None, columnar: bool = False) -> Dict[str, Any]:
+    """Full global habitat prediction: mesh -> land mask -> features -> one batch predict."""
+    if month is None:
+        month = datetime.datetime.now().month
+    features = build_grid_features(resolution, month)
+    _, probs = score_presence(model, features)
+    return summarize_surface(surface_frame(features, probs), month, threshold, columnar=columnar)
+
+
+def band_rows(resolution: float = DEFAULT_RESOLUTION) -> int:
+    """Latitude rows per band, so a band holds about BAND_CELLS cells."""
+    n_lons = np.arange(-180, 180, resolution).size
+    return max(1, BAND_CELLS // max(1, n_lons))
+
+
+def band_count(resolution: float = DEFAULT_RESOLUTION) -> int:
+    rows = band_rows(resolution)
+    return -(-grid_lats(resolution).size // rows)
+
+
+def grid_bands(model, resolution: float = DEFAULT_RESOLUTION,
+               month: Optional[int] = None) -> Iterator[Tuple[np.ndarray, pd.DataFrame]]:
+    """Score the grid one latitude band at a time; yields (band latitudes, scored surface)."""
+    if month is None:
+        month = datetime.datetime.now().month
+    lats = grid_lats(resolution)
+    rows = band_rows(resolution)
+    for start in range(0, lats.size, rows):
+        band = lats[start:start + rows]
+        features = build_grid_features(resolution, month, lats=band)
+        _, probs = score_presence(model, features)
+        yield band, surface_frame(features, probs)
+
+
+def surface_bands(surface: pd.DataFrame, resolution: float) -> Iterator[Tuple[np.ndarray, pd.DataFrame]]:
+    """Split a stored surface into the same latitude bands as grid_bands."""
+    lats = grid_lats(resolution)
+    rows = band_rows(resolution)
+    # Stored surfaces are in row-major (latitude) order, so bands are contiguous slices
+    cell_lats = surface["lat"].to_numpy(dtype=float)
+    for start in range(0, lats.size, rows):
+        band = lats[start:start + rows]
+        lo = np.searchsorted(cell_lats, band[0] - resolution / 2, side="left")
+        hi = np.searchsorted(cell_lats, band[-1] + resolution / 2, side="right")
+        yield band, surface.iloc[lo:hi]
+
+
+def stream_bands(bands: Iterator[Tuple[np.ndarray, pd.DataFrame]], month: int,
+                 threshold: Optional[float] = None, uncertainty: Optional[str] = None) -> Iterator[bytes]:
+    """
+    NDJSON stream of a global habitat run: one line per latitude band
+    ({"lat_range", "points_checked", "possible_habitats"}), then a summary line with "done": true.
+    """
+    total = 0
+    count = 0
+    for band, surface in bands:
+        chunk = summarize_surface(surface, month, threshold, uncertainty)
+        total += chunk["total_points_checked"]
+        count += chunk["points_count"]
+        yield json.dumps({
+            "lat_range": [float(band[0]), float(band[-1])],
+            "points_checked": chunk["total_points_checked"],
+            "possible_habitats": chunk["possible_habitats"],
+        }, separators=(",", ":")).encode("utf-8") + b"\n"
+    yield json.dumps({"done": True, "total_points_checked": total, "points_count": count,
+                      "month": int(month)}).encode("utf-8") + b"\n"
@@ -0,0 +1,214 @@
+"""
+Background jobs for computations that outlive an HTTP request (fine global grids,
+multi-month migration runs).
+
+Jobs are recorded in SQLite (JOB_STORE_PATH) and their results written as JSON files
+next to it, so status and results survive a restart. Each job records the pid of the
+process running it, so serve.py can fail the jobs of a worker that died. Work runs on a small dedicated
+thread pool (JOB_WORKERS) separate from the interactive inference executor.
+
+A job's key is its kind, normalized parameters, the versions of the models it uses and
+the reference data version (see lineage.py).
+Submitting a key that is already queued, running or done returns the existing job, so ten
+dashboard users asking for the same month trigger one computation, whichever server
+process they reach.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from lineage import data_version
+from model_registry import registry
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(BACKEND_DIR, "data", "jobs", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);
+"""
+
+
+class JobError(ValueError):
+    """Raised for an unknown job kind or invalid parameters."""
+
+
+class _Kind:
+    def __init__(self, run: Callable, normalize: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 models: Iterable[str]):
+        self.run = run
+        self.normalize = normalize
+        self.models = tuple(models)
+
+
+class JobQueue:
+    def __init__(self, path: str = JOB_STORE_PATH, workers: int = JOB_WORKERS):
+        self.path = path
+        self.result_dir = os.path.join(os.path.dirname(path), "results")
+        self.workers = workers
+        self._kinds: Dict[str, _Kind] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+    def register(self, kind: str, run: Callable, normalize: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 models: Iterable[str] = ()) -> None:
+        """
+        Add a job kind. normalize(params) validates and canonicalizes the parameters (raising
+        ValueError); run(params, progress) computes the JSON result and may call
+        progress(fraction, message) as it goes.
+        """
+        self._kinds[kind] = _Kind(run, normalize, models)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.result_dir, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.row_factory = sqlite3.Row
+            self._db.executescript(_SCHEMA)
+            # Stores created before jobs recorded the process running them
+            if "owner" not in {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+        return self._db
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="jobs")
+        return self._pool
+
+    def _execute(self, sql: str, args: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def _result_path(self, job_id: str) -> str:
+        return os.path.join(self.result_dir, f"{job_id}.json")
+
+    def recover(self, owner: Optional[int] = None) -> None:
+        """
+        Jobs interrupted by a restart are marked failed so they can be resubmitted. With an
+        owner, only the jobs of that (exited) process are.
+        """
+        if owner is None:
+            self._execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)",
+                          (FAILED, "interrupted by server restart", time.time(), QUEUED, RUNNING))
+        else:
+            self._execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?) AND owner = ?",
+                          (FAILED, "interrupted by worker exit", time.time(), QUEUED, RUNNING, owner))
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Queue a job, or return the live or finished job with the same key."""
+        spec = self._kinds.get(kind)
+        if spec is None:
+            raise JobError(f"Unknown job kind '{kind}'; expected one of {sorted(self._kinds)}")
+        try:
+            params = spec.normalize(dict(params or {}))
+        except (TypeError, ValueError) as e:
+            raise JobError(str(e))
+        material = {"kind": kind, "params": jsonable_encoder(params),
+                    "models": {name: registry.version(name) for name in spec.models},
+                    "data": data_version()}
+        key = hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+        created = False
+        with self._lock:
+            # Lookup and insert in one write transaction: other server processes share the
+            # database, and the write lock keeps two of them from queuing the same key
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT id, status FROM jobs WHERE key = ? AND status IN (?, ?, ?) ORDER BY created_at DESC LIMIT 1",
+                    (key, QUEUED, RUNNING, DONE),
+                ).fetchone()
+                if row is not None and (row["status"] != DONE or os.path.exists(self._result_path(row["id"]))):
+                    job_id = row["id"]
+                else:
+                    job_id = uuid.uuid4().hex
+                    self.db.execute(
+                        "INSERT INTO jobs (id, key, kind, params, status, created_at, owner) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, key, kind, json.dumps(material["params"]), QUEUED, time.time(), os.getpid()),
+                    )
+                    created = True
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        if created:
+            self.pool.submit(self._run, job_id, spec, params)
+        return self.get(job_id)
+
+    def _progress(self, job_id: str, fraction: float, message: Optional[str] = None) -> None:
+        self._execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                      (float(min(1.0, max(0.0, fraction))), message, job_id))
+
+    def _run(self, job_id: str, spec: _Kind, params: Dict[str, Any]) -> None:
+        self._execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (RUNNING, time.time(), job_id))
+        try:
+            result = spec.run(params, lambda fraction, message=None: self._progress(job_id, fraction, message))
+            path = self._result_path(job_id)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(jsonable_encoder(result), f, separators=(",", ":"), allow_nan=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                          (FAILED, str(e), time.time(), job_id))
+            return
+        self._execute("UPDATE jobs SET status = ?, progress = 1, finished_at = ? WHERE id = ?",
+                      (DONE, time.time(), job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        row = dict(rows[0])
+        row["params"] = json.loads(row["params"])
+        del row["key"], row["owner"]
+        return row
+
+    def result_path(self, job_id: str) -> Optional[str]:
+        """Path of a finished job's JSON result, or None."""
+        path = self._result_path(job_id)
+        return path if os.path.exists(path) else None
+
+    def close(self) -> None:
+        """Close the SQLite connection (it is reopened on next use; never share one across fork)."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self.close()
+
+
+jobs = JobQueue()
@@ -0,0 +1,168 @@
+"""
+Precomputed land mask and distance-to-shore raster.
+
+Build once (offline):
+    python land_raster.py --resolution 0.1
+
+The raster is a directory of memory-mapped .npy files (land_mask.npy, shore_km.npy)
+plus meta.json. Lookups are plain array indexing over whole coordinate batches. Once it is
+built, every land/ocean check of the API (is_land below) reads the raster's mask instead
+of calling global_land_mask per batch, so the mask and the shore distances always agree.
+Points are classified by the cell they fall in: build a finer raster for sharper coasts.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RASTER_DIR = os.getenv("LAND_RASTER_DIR", os.path.join(BACKEND_DIR, "data", "land_raster"))
+DEFAULT_RESOLUTION = 0.1
+
+
+class LandRaster:
+    """Global cell-centred raster: land mask (bool) and distance to nearest land cell (km)."""
+
+    def __init__(self, land_mask: np.ndarray, shore_km: np.ndarray, resolution: float):
+        self.land_mask = land_mask
+        self.shore_km = shore_km
+        self.resolution = float(resolution)
+        self.n_lat, self.n_lon = land_mask.shape
+
+    @classmethod
+    def load(cls, raster_dir: str = DEFAULT_RASTER_DIR) -> "LandRaster":
+        with open(os.path.join(raster_dir, "meta.json")) as f:
+            meta = json.load(f)
+        land_mask = np.load(os.path.join(raster_dir, "land_mask.npy"), mmap_mode="r")
+        shore_km = np.load(os.path.join(raster_dir, "shore_km.npy"), mmap_mode="r")
+        # save() replaces the files one by one; a load in between mixes two builds
+        if land_mask.shape != shore_km.shape or list(land_mask.shape) != list(meta["shape"]):
+            raise ValueError("raster files are from different builds (rebuild in progress?)")
+        return cls(land_mask, shore_km, meta["resolution"])
+
+    def cell_index(self, lats, lons):
+        """Row/column of the cell containing each point. Longitudes are wrapped."""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        rows = np.floor((lats + 90.0) / self.resolution).astype(np.int64)
+        cols = np.floor(((lons + 180.0) % 360.0) / self.resolution).astype(np.int64)
+        return np.clip(rows, 0, self.n_lat - 1), np.clip(cols, 0, self.n_lon - 1)
+
+    def is_land(self, lats, lons) -> np.ndarray:
+        rows, cols = self.cell_index(lats, lons)
+        return np.asarray(self.land_mask[rows, cols], dtype=bool)
+
+    def is_ocean(self, lats, lons) -> np.ndarray:
+        return ~self.is_land(lats, lons)
+
+    def shore_distance_km(self, lats, lons) -> np.ndarray:
+        rows, cols = self.cell_index(lats, lons)
+        return np.asarray(self.shore_km[rows, cols], dtype=float)
+
+
+def build(resolution: float = DEFAULT_RESOLUTION) -> LandRaster:
+    """Sample the global_land_mask at cell centres and compute great-circle shore distance."""
+    from global_land_mask import globe
+    from scipy.ndimage import binary_erosion
+    from scipy.spatial import cKDTree
+
+    # ocean_utils imports this module, so its helpers are imported here
+    from ocean_utils import chord_km, unit_xyz
+
+    lat_centres = -90.0 + resolution / 2 + np.arange(int(round(180.0 / resolution))) * resolution
+    lon_centres = -180.0 + resolution / 2 + np.arange(int(round(360.0 / resolution))) * resolution
+    lat_grid, lon_grid = np.meshgrid(lat_centres, lon_centres, indexing="ij")
+    land_mask = globe.is_land(np.clip(lat_grid, -90, 90), lon_grid)
+
+    # Only land cells touching the ocean can be the nearest shore
+    # (pad in longitude so coasts across the dateline are kept)
+    padded = np.pad(land_mask, ((0, 0), (1, 1)), mode="wrap")
+    coast = land_mask & ~binary_erosion(padded, border_value=1)[:, 1:-1]
+    shore_km = np.zeros(land_mask.shape, dtype=np.float32)
+    ocean = ~land_mask
+    if coast.any():
+        tree = cKDTree(unit_xyz(lat_grid[coast], lon_grid[coast]))
+        chord, _ = tree.query(unit_xyz(lat_grid[ocean], lon_grid[ocean]), k=1, workers=-1)
+        shore_km[ocean] = chord_km(chord)
+    else:
+        shore_km[ocean] = np.nan
+    return LandRaster(land_mask, shore_km, resolution)
+
+
+def _replace(path: str, write) -> None:
+    """Write a file through a temp file in its directory, then swap it in."""
+    # Running servers have the old file mapped; writing it in place would truncate it under them
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def save(raster: LandRaster, raster_dir: str = DEFAULT_RASTER_DIR) -> None:
+    os.makedirs(raster_dir, exist_ok=True)
+    _replace(os.path.join(raster_dir, "land_mask.npy"),
+             lambda f: np.save(f, np.asarray(raster.land_mask, dtype=bool)))
+    _replace(os.path.join(raster_dir, "shore_km.npy"),
+             lambda f: np.save(f, np.asarray(raster.shore_km, dtype=np.float32)))
+    meta = {
+        "resolution": raster.resolution,
+        "shape": [raster.n_lat, raster.n_lon],
+        "origin": [-90.0, -180.0],
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    _replace(os.path.join(raster_dir, "meta.json"), lambda f: f.write(json.dumps(meta, indent=2).encode()))
+
+
+_RASTER: Optional[LandRaster] = None
+_RASTER_CHECKED = False
+
+
+def get_raster() -> Optional[LandRaster]:
+    """The on-disk raster if it has been built, else None (callers fall back to globe)."""
+    global _RASTER, _RASTER_CHECKED
+    if not _RASTER_CHECKED:
+        _RASTER_CHECKED = True
+        if os.path.exists(os.path.join(DEFAULT_RASTER_DIR, "meta.json")):
+            try:
+                _RASTER = LandRaster.load(DEFAULT_RASTER_DIR)
+            except Exception as e:
+                print(f"Failed to load land raster from {DEFAULT_RASTER_DIR}: {str(e)}")
+    return _RASTER
+
+
+def is_land(lats, lons) -> np.ndarray:
+    """Land mask of points: the raster when built, else global_land_mask. Longitudes are wrapped."""
+    raster = get_raster()
+    if raster is not None:
+        return raster.is_land(lats, lons)
+    from global_land_mask import globe
+
+    lons = np.asarray(lons, dtype=float)
+    wrapped = np.where(lons > 180, lons - 360, np.where(lons < -180, lons + 360, lons))
+    return np.asarray(globe.is_land(np.asarray(lats, dtype=float), wrapped), dtype=bool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the land mask / shore distance raster")
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION, help="cell size in degrees")
+    parser.add_argument("--out", default=DEFAULT_RASTER_DIR, help="output directory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    raster = build(args.resolution)
+    save(raster, args.out)
+    print(f"Built {raster.n_lat}x{raster.n_lon} raster at {args.resolution} deg "
+          f"in {time.perf_counter() - start:.1f}s -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
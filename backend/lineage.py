@@ -0,0 +1,468 @@
+"""
+Incremental recomputation of derived data after the reference CSVs change.
+
+    python lineage.py                          # bring stored grids and tiles up to date
+    python lineage.py --dry-run                # only report what is stale
+    python lineage.py --resolutions 1 --months 6 7
+
+The pipeline is reference CSVs -> reference store / feature cube -> habitat store grids
+(precompute_habitats.py) -> tiles. Every stage is split into BLOCK_DEG x BLOCK_DEG lat/lon
+blocks and content-hashed; the hashes of the last run are kept in backend/data/lineage.json.
+A run re-ingests stale reference stores, rebuilds the feature cube if its CSVs changed, then:
+
+  * finds the blocks whose features may have changed: with the feature cube, blocks whose
+    cube values (plus the one-cell margin that bilinear lookups read) hash differently for
+    that month; without it, blocks within nearest-row reach of a changed reference block,
+  * recomputes the features of those blocks' grid cells and rescores only the blocks whose
+    features actually differ from the stored month, splicing them into the store,
+  * deletes cached tiles that overlap those blocks.
+
+The first run only records a baseline (grids are still checked cell by cell). A new model
+version invalidates its whole layer: the habitat store and tiles are keyed by it. Response
+cache and job keys include data_version(month), so the API stops serving results computed
+from the old data without clearing anything else.
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+LINEAGE_PATH = os.getenv("LINEAGE_PATH", os.path.join(BACKEND_DIR, "data", "lineage.json"))
+BLOCK_DEG = float(os.getenv("LINEAGE_BLOCK_DEG", "10"))
+# How often a serving process looks for a new lineage run
+CHECK_INTERVAL_S = float(os.getenv("LINEAGE_CHECK_INTERVAL", "1.0"))
+# Probe spacing used to bound each block's nearest-row distance
+REACH_PROBE_DEG = 0.5
+MONTHS = range(1, 13)
+
+# Reference columns any stage reads (the index uses the features, the cube also month/presence)
+REFERENCE_COLUMNS = ("decimalLatitude", "decimalLongitude", "month", "presence",
+                     "bathymetry", "sst", "sss", "shoredistance")
+
+
+def _shape(block_deg: float = BLOCK_DEG) -> Tuple[int, int]:
+    return int(round(180.0 / block_deg)), int(round(360.0 / block_deg))
+
+
+def block_ids(lats, lons, block_deg: float = BLOCK_DEG) -> np.ndarray:
+    """Block index of each point (row-major from the south-west corner)."""
+    n_rows, n_cols = _shape(block_deg)
+    rows = np.floor((np.asarray(lats, dtype=float) + 90.0) / block_deg).astype(np.int64)
+    cols = np.floor(((np.asarray(lons, dtype=float) + 180.0) % 360.0) / block_deg).astype(np.int64)
+    return np.clip(rows, 0, n_rows - 1) * n_cols + np.clip(cols, 0, n_cols - 1)
+
+
+def block_bounds(block: int, block_deg: float = BLOCK_DEG) -> Tuple[float, float, float, float]:
+    """(lat_min, lat_max, lon_min, lon_max) of a block."""
+    row, col = divmod(int(block), _shape(block_deg)[1])
+    return (-90.0 + row * block_deg, -90.0 + (row + 1) * block_deg,
+            -180.0 + col * block_deg, -180.0 + (col + 1) * block_deg)
+
+
+def _digest(*arrays: np.ndarray) -> str:
+    h = hashlib.sha256()
+    for a in arrays:
+        h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _group(blocks: np.ndarray) -> Iterable[Tuple[int, np.ndarray]]:
+    """(block, row indices in their original order) for every block present."""
+    order = np.argsort(blocks, kind="stable")
+    sorted_blocks = blocks[order]
+    starts = np.flatnonzero(np.r_[True, sorted_blocks[1:] != sorted_blocks[:-1]]) if len(order) else []
+    ends = list(starts[1:]) + [len(order)]
+    for start, end in zip(starts, ends):
+        yield int(sorted_blocks[start]), order[start:end]
+
+
+def block_digests(blocks: np.ndarray, matrix: np.ndarray, ordered: bool = True) -> Dict[str, str]:
+    """
+    Hash of the rows of matrix falling in each block. With ordered=False rows are sorted
+    first, so appending or reordering CSV rows elsewhere does not change a block's hash.
+    """
+    out = {}
+    for block, rows in _group(blocks):
+        part = matrix[rows]
+        if not ordered:
+            part = part[np.lexsort(part.T[::-1])]
+        out[str(block)] = _digest(part)
+    return out
+
+
+def _changed(old: Dict[str, str], new: Dict[str, str]) -> Set[str]:
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+
+def reference_hashes(source: str) -> Dict[str, str]:
+    """Per-block hashes of a reference CSV (read from its store when current)."""
+    from reference_store import read_frame
+
+    df = read_frame(source, REFERENCE_COLUMNS).dropna(subset=["decimalLatitude", "decimalLongitude"])
+    matrix = np.column_stack([df[c].to_numpy(dtype=float) for c in REFERENCE_COLUMNS if c in df])
+    return block_digests(block_ids(df["decimalLatitude"], df["decimalLongitude"]), matrix, ordered=False)
+
+
+def cube_hashes(cube) -> Dict[str, str]:
+    """Per-(month, block) hashes of the cube cells a lookup inside the block can read."""
+    from feature_cube import MONTHLY_VARS, STATIC_VARS
+
+    n_lat, n_lon = cube.lat.size, cube.lon.size
+    out = {}
+    for block in range(np.prod(_shape())):
+        lat0, lat1, lon0, lon1 = block_bounds(block)
+        # floor/ceil of the fractional cell index plus one cell for the bilinear neighbour
+        rows = np.arange(max(int(np.floor((lat0 - cube.lat[0]) / cube.resolution)), 0),
+                         min(int(np.ceil((lat1 - cube.lat[0]) / cube.resolution)) + 1, n_lat))
+        cols = np.arange(int(np.floor((lon0 - cube.lon[0]) / cube.resolution)),
+                         int(np.ceil((lon1 - cube.lon[0]) / cube.resolution)) + 1) % n_lon
+        cells = np.ix_(rows, cols)
+        static = [cube.fields[var][cells] for var in STATIC_VARS]
+        for month in MONTHS:
+            monthly = [cube.fields[var][month - 1][cells] for var in MONTHLY_VARS]
+            out[f"{month}:{block}"] = _digest(*static, *monthly)
+    return out
+
+
+def _circumradius_km(block_deg: float = BLOCK_DEG) -> np.ndarray:
+    """Upper bound on the distance from each block's centre to any point in it."""
+    from ocean_utils import KM_PER_DEG
+
+    lat0 = -90.0 + np.arange(_shape(block_deg)[0]) * block_deg
+    equatorward = np.where((lat0 < 0) & (lat0 + block_deg > 0), 0.0,
+                           np.minimum(np.abs(lat0), np.abs(lat0 + block_deg)))
+    # Half the meridian plus half the widest parallel: a path, so no shorter than the geodesic
+    radius = (block_deg / 2 + block_deg / 2 * np.cos(np.radians(equatorward))) * KM_PER_DEG
+    return np.repeat(radius, _shape(block_deg)[1])
+
+
+def _block_centres() -> Tuple[np.ndarray, np.ndarray]:
+    bounds = np.array([block_bounds(b) for b in range(np.prod(_shape()))])
+    return (bounds[:, 0] + bounds[:, 1]) / 2, (bounds[:, 2] + bounds[:, 3]) / 2
+
+
+def reach_km() -> Dict[str, float]:
+    """
+    Per block, an upper bound on the distance from any point in it to its nearest reference
+    row. A changed row farther away than that cannot change the block's features.
+    """
+    from ocean_utils import KM_PER_DEG, _load_reference_index
+
+    index = _load_reference_index()
+    # A probe step that divides the block size keeps every probe cell inside one block
+    step = BLOCK_DEG / np.ceil(BLOCK_DEG / REACH_PROBE_DEG)
+    lat, lon = np.meshgrid(np.arange(-90 + step / 2, 90, step), np.arange(-180 + step / 2, 180, step), indexing="ij")
+    dist, _ = index.query(lat.ravel(), lon.ravel(), k=1)
+    worst = np.zeros(np.prod(_shape()))
+    np.maximum.at(worst, block_ids(lat.ravel(), lon.ravel()), dist[:, 0])
+    # Any point is within step degrees (half a meridian plus half a parallel) of a probe
+    return {str(b): float(d + step * KM_PER_DEG) for b, d in enumerate(worst)}
+
+
+def blocks_within_reach(dirty: Set[int], reach: Dict[str, float]) -> Set[int]:
+    """Blocks whose nearest-row features a change in the dirty blocks can affect."""
+    from ocean_utils import haversine_km
+
+    if not dirty:
+        return set()
+    lat, lon = _block_centres()
+    d = np.array(sorted(dirty))
+    # Distance between every block centre and every dirty block centre
+    centre_km = haversine_km(lat[:, None], lon[:, None], lat[d][None, :], lon[d][None, :])
+    radius = _circumradius_km()
+    lower = centre_km - radius[:, None] - radius[d][None, :]
+    limit = np.array([reach.get(str(b), np.inf) for b in range(lat.size)])
+    return {int(b) for b in np.flatnonzero((lower <= limit[:, None]).any(axis=1))}
+
+
+def update_grid(resolution: float, month: int, blocks: Optional[Set[int]], dry_run: bool = False) -> Dict[str, object]:
+    """
+    Bring one stored (resolution, month) surface up to date. blocks limits the check to
+    those blocks (None checks all); only blocks whose features differ are rescored.
+    """
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    from habitat_grid import (
+        SURFACE_COLUMNS, grid_features, grid_mesh, ocean_mask, score_presence, surface_frame, uncertainty_column,
+    )
+    from model_registry import registry
+    from precompute_habitats import compute_month, read_month, store_path, write_month
+    from uncertainty import UncertaintyError, add_uncertainty
+
+    version = registry.version("presence")
+    schema = pq.read_schema(store_path(resolution, month))
+    stored_version = (schema.metadata or {}).get(b"model_version", b"").decode()
+    if stored_version != version:
+        if not dry_run:
+            prefix = uncertainty_column("")
+            methods = [name[len(prefix):] for name in schema.names if name.startswith(prefix)]
+            write_month(compute_month(resolution, month, methods), resolution, month, version)
+        return {"model_changed": True, "checked": None, "changed": None, "cells": None}
+    if blocks is not None and not blocks:
+        return {"model_changed": False, "checked": 0, "changed": [], "cells": 0}
+
+    lats, lons = grid_mesh(resolution)
+    # Blocks are assigned from the float32 coordinates the store keeps, on both sides
+    cell_blocks = block_ids(lats.astype(np.float32), lons.astype(np.float32))
+    if blocks is not None:
+        keep = np.isin(cell_blocks, list(blocks))
+        lats, lons = lats[keep], lons[keep]
+    ocean = ocean_mask(lats, lons)
+    features = grid_features(lats[ocean], lons[ocean], month).reset_index(drop=True)
+    fresh = surface_frame(features, np.zeros(len(features))).astype(np.float32)
+    stored = read_month(resolution, month)
+
+    feature_columns = SURFACE_COLUMNS[:-1]
+    fresh_blocks = block_ids(fresh["lat"], fresh["lng"])
+    stored_blocks = block_ids(stored["lat"], stored["lng"])
+    fresh_hashes = block_digests(fresh_blocks, fresh[feature_columns].to_numpy())
+    stored_hashes = block_digests(stored_blocks, stored[feature_columns].to_numpy())
+    checked = set(fresh_hashes) | ({str(b) for b in blocks} if blocks is not None else set(stored_hashes))
+    changed = sorted(int(b) for b in checked if fresh_hashes.get(b) != stored_hashes.get(b))
+
+    rescored = np.isin(fresh_blocks, changed)
+    if changed and not dry_run:
+        part = features[rescored].reset_index(drop=True)
+        _, probs = score_presence(registry.get("presence"), part)
+        new = surface_frame(part, probs).astype(np.float32)
+        # Stored uncertainty columns are recomputed for the rescored cells too
+        for column in [c for c in stored.columns if c not in SURFACE_COLUMNS]:
+            method = column[len(uncertainty_column("")):]
+            try:
+                new = add_uncertainty(new, month, method)
+            except UncertaintyError as e:
+                print(f"Dropping {column} from month {month:02d}: {e}")
+                stored = stored.drop(columns=[column])
+        surface = pd.concat([stored[~np.isin(stored_blocks, changed)], new], ignore_index=True)
+        # Back to grid (latitude band) order
+        surface = surface.iloc[np.lexsort((surface["lng"].to_numpy(), surface["lat"].to_numpy()))]
+        write_month(surface.reset_index(drop=True), resolution, month, version)
+    return {"model_changed": False, "checked": len(checked), "changed": changed, "cells": int(rescored.sum())}
+
+
+def _tile_blocks(z: int, x: int, y: int) -> Set[int]:
+    """Blocks overlapping a slippy-map tile."""
+    n = 2 ** z
+    lon0, lon1 = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+    lat1 = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    lat0 = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    n_rows, n_cols = _shape()
+    rows = range(max(int((lat0 + 90.0) // BLOCK_DEG), 0), min(int((lat1 + 90.0) // BLOCK_DEG), n_rows - 1) + 1)
+    cols = range(max(int((lon0 + 180.0) // BLOCK_DEG), 0), min(int((lon1 + 180.0) // BLOCK_DEG), n_cols - 1) + 1)
+    return {r * n_cols + c for r in rows for c in cols}
+
+
+def invalidate_tiles(month: int, blocks: Set[int], dry_run: bool = False) -> int:
+    """Delete cached tiles of the current model versions that overlap any of the blocks."""
+    from model_registry import registry
+    from tiles import LAYERS, TILE_CACHE_DIR
+
+    removed = 0
+    for layer in LAYERS:
+        root = os.path.join(TILE_CACHE_DIR, layer, registry.version(layer), f"{month:02d}")
+        for dirpath, _, filenames in os.walk(root):
+            parts = os.path.relpath(dirpath, root).split(os.sep)
+            if len(parts) != 2:
+                continue
+            z, x = int(parts[0]), int(parts[1])
+            for name in filenames:
+                y = name.split(".")[0]
+                if y.isdigit() and _tile_blocks(z, x, int(y)) & blocks:
+                    if not dry_run:
+                        os.remove(os.path.join(dirpath, name))
+                    removed += 1
+    return removed
+
+
+def stored_grids(resolutions: Optional[List[float]] = None, months: Iterable[int] = MONTHS) -> List[Tuple[float, int]]:
+    """(resolution, month) of every surface in the habitat store."""
+    from precompute_habitats import HABITAT_STORE_DIR, store_path
+
+    found = []
+    if not os.path.isdir(HABITAT_STORE_DIR):
+        return found
+    for entry in sorted(os.listdir(HABITAT_STORE_DIR)):
+        if not entry.startswith("res_"):
+            continue
+        resolution = float(entry[len("res_"):])
+        if resolutions and not any(np.isclose(resolution, r) for r in resolutions):
+            continue
+        found += [(resolution, m) for m in months if os.path.exists(store_path(resolution, m))]
+    return found
+
+
+def read_manifest(path: str = LINEAGE_PATH) -> Dict[str, object]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(manifest: Dict[str, object], path: str = LINEAGE_PATH) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, sort_keys=True)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _versions(reference: Dict[str, Dict[str, str]], cube: Dict[str, str]) -> Tuple[str, Dict[str, str]]:
+    overall = hashlib.sha256(json.dumps([reference, cube], sort_keys=True).encode()).hexdigest()[:12]
+    reference_part = json.dumps(reference, sort_keys=True)
+    by_month = {}
+    for month in MONTHS:
+        material = [reference_part, sorted((k, v) for k, v in cube.items() if k.startswith(f"{month}:"))]
+        by_month[str(month)] = hashlib.sha256(json.dumps(material).encode()).hexdigest()[:12]
+    return overall, by_month
+
+
+def update(resolutions: Optional[List[float]] = None, months: Iterable[int] = MONTHS,
+           dry_run: bool = False) -> Dict[str, object]:
+    """Run every stage; returns the new manifest (not written with dry_run)."""
+    import feature_cube
+    import ocean_utils
+    import reference_store
+
+    months = list(months)
+    previous = read_manifest()
+    baseline = previous.get("block_deg") == BLOCK_DEG
+
+    # Reference data: re-ingest stale stores, then hash every tracked CSV by block
+    index_source = os.path.abspath(reference_store.reference_csv_path())
+    cube_exists = os.path.exists(feature_cube.DEFAULT_CUBE_PATH)
+    inputs = feature_cube.cube_inputs() if cube_exists else None
+    cube_sources = [os.path.abspath(p) for p in (inputs["csv"] if inputs else [index_source])]
+    reference, dirty = {}, {}
+    for source in dict.fromkeys([index_source] + (cube_sources if cube_exists else [])):
+        if not os.path.exists(source):
+            continue
+        if not dry_run and reference_store.refresh(source):
+            print(f"Re-ingested {os.path.basename(source)} into the reference store")
+        reference[source] = reference_hashes(source)
+        dirty[source] = {int(b) for b in _changed(previous.get("reference", {}).get(source, {}), reference[source])}
+        if baseline:
+            print(f"reference {os.path.basename(source)}: {len(dirty[source])} of {len(reference[source])} blocks changed")
+
+    # Feature cube: rebuilt when its CSVs changed, then hashed by month and block
+    if baseline and cube_exists and any(dirty.get(s) for s in cube_sources):
+        if dry_run:
+            print("feature cube: inputs changed, would be rebuilt")
+        elif feature_cube.rebuild():
+            print("feature cube: rebuilt from changed inputs")
+    ocean_utils.reset_reference()
+    cube = feature_cube.get_cube()
+    cube_now = cube_hashes(cube) if cube is not None else {}
+
+    # Blocks whose features may have changed, per month (None = unknown, check everything)
+    candidates: Dict[int, Optional[Set[int]]] = {}
+    if cube is not None and baseline and previous.get("cube"):
+        changed = _changed(previous["cube"], cube_now)
+        for month in months:
+            candidates[month] = {int(k.split(":")[1]) for k in changed if k.split(":")[0] == str(month)}
+    elif cube is None and baseline and previous.get("reach"):
+        near = blocks_within_reach(dirty.get(index_source, set()), previous["reach"])
+        candidates = {month: near for month in months}
+    else:
+        candidates = {month: None for month in months}
+        print("No lineage baseline for these inputs; checking every block and recording one")
+
+    for resolution, month in stored_grids(resolutions, months):
+        start = time.perf_counter()
+        result = update_grid(resolution, month, candidates[month], dry_run)
+        if result["model_changed"]:
+            print(f"month {month:02d} @ {resolution:g} deg: model changed, full recompute")
+        else:
+            print(f"month {month:02d} @ {resolution:g} deg: checked {result['checked']} blocks, "
+                  f"{len(result['changed'])} changed, {result['cells']} cells rescored "
+                  f"in {time.perf_counter() - start:.1f}s")
+
+    for month in months:
+        if candidates[month]:
+            removed = invalidate_tiles(month, candidates[month], dry_run)
+            if removed:
+                print(f"month {month:02d}: {'would remove' if dry_run else 'removed'} {removed} cached tiles")
+
+    manifest = {
+        "block_deg": BLOCK_DEG,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "reference": reference,
+        "cube": cube_now,
+        "reach": reach_km(),
+    }
+    manifest["version"], manifest["versions"] = _versions(reference, cube_now)
+    if not dry_run:
+        _write_manifest(manifest)
+    return manifest
+
+
+# What this process last saw of the manifest (see data_version)
+_seen = {"mtime": None, "checked": None, "manifest": {}}
+_seen_lock = threading.Lock()
+
+
+def _reload_inputs() -> None:
+    import feature_cube
+    import ocean_utils
+    import reference_store
+    from tiles import tile_cache
+
+    print("Reference data changed (new lineage run); reloading")
+    reference_store.reset()
+    ocean_utils.reset_reference()
+    feature_cube.reset_cube()
+    tile_cache.clear_memory()
+
+
+def data_version(month: Optional[int] = None) -> str:
+    """
+    Version of the reference data behind results for a month, or across all months
+    ("" before the first lineage run). When a new run is noticed, this process's loaded
+    reference index, feature cube and in-memory tiles are dropped and reloaded lazily.
+    """
+    now = time.monotonic()
+    with _seen_lock:
+        if _seen["checked"] is None or now - _seen["checked"] >= CHECK_INTERVAL_S:
+            try:
+                mtime = os.path.getmtime(LINEAGE_PATH)
+            except OSError:
+                mtime = None
+            if _seen["checked"] is not None and mtime != _seen["mtime"]:
+                _reload_inputs()
+            if _seen["checked"] is None or mtime != _seen["mtime"]:
+                _seen["manifest"] = read_manifest()
+            _seen["mtime"], _seen["checked"] = mtime, now
+        manifest = _seen["manifest"]
+    if month is None:
+        return manifest.get("version", "")
+    return manifest.get("versions", {}).get(str(month), "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute only what changed in the reference data")
+    parser.add_argument("--resolutions", type=float, nargs="*", help="stored grid resolutions to update (default all)")
+    parser.add_argument("--months", type=int, nargs="*", default=list(MONTHS), help="months to update")
+    parser.add_argument("--dry-run", action="store_true", help="report what is stale without writing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manifest = update(args.resolutions, args.months, args.dry_run)
+    print(f"Data version {manifest['version']} in {time.perf_counter() - start:.1f}s"
+          f"{' (dry run)' if args.dry_run else ''}")
+
+
+if __name__ == '__main__':
+    main()
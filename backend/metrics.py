@@ -0,0 +1,206 @@
+"""
+In-process instrumentation: timing spans, counters and a Prometheus text exposition.
+
+    with span("inference"):
+        probs = model.predict_proba(X)
+    inc("sharkapi_land_filtered_points_total", n_land)
+
+Span durations feed the sharkapi_span_seconds histogram and, while a request is being
+served, that request's Server-Timing header (enabled with SERVER_TIMING=1). Other
+modules' own statistics (response cache, tile cache, executor, models) are read at scrape
+time through register_collector.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") not in ("0", "false", "False", "")
+
+# Prometheus client default buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help)
+METRICS = {
+    "sharkapi_requests_total": ("counter", "HTTP requests by route, method and status."),
+    "sharkapi_request_duration_seconds": ("histogram", "Time to response headers by route."),
+    "sharkapi_span_seconds": ("histogram", "Time spent in instrumented stages (features, land_mask, inference, uncertainty, serialize)."),
+    "sharkapi_land_filtered_points_total": ("counter", "Points dropped by the land mask."),
+    "sharkapi_fallbacks_total": ("counter", "Heuristic fallbacks used when reference data has no value."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+# A collector returns (name, type, help, labels, value) samples
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = \
+    contextvars.ContextVar("request_timings", default=None)
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self.buckets)
+            hist.observe(value)
+
+    @contextmanager
+    def span(self, name: str):
+        """Time a block into sharkapi_span_seconds and the current request's Server-Timing."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("sharkapi_span_seconds", elapsed, span=name)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings.append((name, elapsed))
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def begin_request(self) -> Tuple[List[Tuple[str, float]], contextvars.Token]:
+        """Start collecting span timings for the request running in this context."""
+        timings: List[Tuple[str, float]] = []
+        return timings, _request_timings.set(timings)
+
+    def end_request(self, token: contextvars.Token) -> None:
+        _request_timings.reset(token)
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {k: (list(h.counts), h.total, h.count) for k, h in series.items()}
+                          for name, series in self._histograms.items()}
+
+        for name, series in sorted(counters.items()):
+            kind, help_text = METRICS.get(name, ("counter", name))
+            header(name, kind, help_text)
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name, series in sorted(histograms.items()):
+            kind, help_text = METRICS.get(name, ("histogram", name))
+            header(name, kind, help_text)
+            for labels, (counts, total, count) in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        collected: Dict[str, Tuple[str, str, List[Tuple[Labels, float]]]] = {}
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"Metrics collector {collector.__name__} failed: {e}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                if value is None:
+                    continue
+                collected.setdefault(name, (kind, help_text, []))[2].append((_labels(labels), value))
+        for name, (kind, help_text, samples) in sorted(collected.items()):
+            header(name, kind, help_text)
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def process_memory(pid: object = "self") -> Dict[str, int]:
+    """
+    Memory of a process in bytes from /proc/<pid>/smaps_rollup (Linux): rss, pss (shared pages
+    split between the processes mapping them), shared and private. Empty where unavailable.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    out: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in fields:
+                    out[fields[key]] = out.get(fields[key], 0) + int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return out
+
+
+def server_timing(timings: List[Tuple[str, float]], total_s: Optional[float] = None) -> str:
+    """Server-Timing header value; repeated spans are summed (dur in ms, count in desc)."""
+    totals: Dict[str, List[float]] = {}
+    for name, elapsed in timings:
+        entry = totals.setdefault(name, [0.0, 0])
+        entry[0] += elapsed
+        entry[1] += 1
+    parts = [f'{name};dur={dur * 1e3:.1f};desc="x{n}"' if n > 1 else f"{name};dur={dur * 1e3:.1f}"
+             for name, (dur, n) in totals.items()]
+    if total_s is not None:
+        parts.append(f"total;dur={total_s * 1e3:.1f}")
+    return ", ".join(parts)
+
+
+metrics = Metrics()
+span = metrics.span
+inc = metrics.inc
@@ -0,0 +1,90 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from habitat_grid import PRESENCE_FEATURES, ocean_mask, score_presence, wrap_lons
+from ocean_utils import EARTH_RADIUS_KM, get_features_batch
+
+# Upper bound on samples_per_base a request may ask for: every source scores that many
+# candidates (times the oversampling) per month
+MAX_SAMPLES_PER_BASE = int(os.getenv("MAX_SAMPLES_PER_BASE", "50"))
+
+
+def destination_points(lats, lons, bearings_deg, dists_km):
+    """
+    Vectorized spherical forward formula: points reached from (lats, lons) after travelling
+    dists_km along the initial bearings. Within ~0.5% of the geodesic (ellipsoidal) result.
+    """
+    lat1 = np.radians(np.asarray(lats, dtype=float))
+    lon1 = np.radians(np.asarray(lons, dtype=float))
+    brg = np.radians(np.asarray(bearings_deg, dtype=float))
+    delta = np.asarray(dists_km, dtype=float) / EARTH_RADIUS_KM
+    sin_lat2 = np.sin(lat1) * np.cos(delta) + np.cos(lat1) * np.sin(delta) * np.cos(brg)
+    lat2 = np.arcsin(np.clip(sin_lat2, -1.0, 1.0))
+    lon2 = lon1 + np.arctan2(np.sin(brg) * np.sin(delta) * np.cos(lat1),
+                             np.cos(delta) - np.sin(lat1) * sin_lat2)
+    return np.degrees(lat2), wrap_lons(np.degrees(lon2))
+
+
+def sample_candidates(src_lats, src_lons, samples_per_base: int = 5, min_km: float = 30.0,
+                      max_km: float = 200.0, rng: Optional[np.random.Generator] = None,
+                      oversample: int = 4) -> pd.DataFrame:
+    """
+    Draw up to samples_per_base ocean points around every source at once.
+    samples_per_base * oversample draws are made per source (the old per-point attempt cap);
+    the first samples_per_base that land in the ocean are kept.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    src_lats = np.asarray(src_lats, dtype=float)
+    src_lons = np.asarray(src_lons, dtype=float)
+    draws = samples_per_base * oversample
+    base = np.repeat(np.arange(src_lats.size), draws)
+    dists = rng.uniform(min_km, max_km, base.size)
+    bearings = rng.uniform(0.0, 360.0, base.size)
+    lats, lons = destination_points(src_lats[base], src_lons[base], bearings, dists)
+
+    ocean = ocean_mask(lats, lons)
+    # Rank of each ocean draw within its source; keep the first samples_per_base
+    rank = (np.cumsum(ocean.reshape(-1, draws), axis=1) - 1).ravel()
+    keep = ocean & (rank < samples_per_base)
+    return pd.DataFrame({"base": base[keep], "lat": lats[keep], "lon": lons[keep]})
+
+
+def best_candidates(model, src_lats, src_lons, month: int, samples_per_base: int = 5,
+                    min_km: float = 30.0, max_km: float = 200.0,
+                    seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Sample, land-filter, featurize and score every candidate in one batch; best one per source."""
+    src_lats = np.asarray(src_lats, dtype=float)
+    src_lons = np.asarray(src_lons, dtype=float)
+    cands = sample_candidates(src_lats, src_lons, samples_per_base, min_km, max_km,
+                              np.random.default_rng(seed))
+    if cands.empty:
+        return []
+    feats = get_features_batch(cands["lat"].to_numpy(), cands["lon"].to_numpy(), month)
+    X = pd.DataFrame({
+        "decimalLatitude": cands["lat"].to_numpy(),
+        "decimalLongitude": cands["lon"].to_numpy(),
+        "month": np.full(len(cands), month, dtype=np.int64),
+        "bathymetry": -np.abs(feats["bathymetry"]),
+        "sst": feats["sst"],
+        "sss": feats["sss"],
+        "shoredistance": feats["shoredistance"],
+    }, columns=PRESENCE_FEATURES)
+    valid = X.notna().all(axis=1).to_numpy()
+    X, cands = X[valid], cands[valid]
+    if X.empty:
+        return []
+    _, probs = score_presence(model, X)
+    scored = cands.assign(prob=probs).reset_index(drop=True)
+    best = scored.loc[scored.groupby("base", sort=True)["prob"].idxmax()]
+    return [
+        {
+            "lat": float(row.lat),
+            "lng": float(row.lon),
+            "prob": float(row.prob),
+            "src": {"lat": float(src_lats[row.base]), "lng": float(src_lons[row.base])},
+        }
+        for row in best.itertuples(index=False)
+    ]
@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import joblib
+
+# Model files live next to this module, not in the process CWD
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODEL_FILES = {
+    "presence": "presence_model.pkl",
+    "activity": "shark_activity.pkl",
+    "analysis": "shark_analysis.pkl",
+}
+
+# MODEL_PRELOAD=1 loads every model at startup; otherwise on first use
+PRELOAD = os.getenv("MODEL_PRELOAD", "1") not in ("0", "false", "False", "")
+# MODEL_HOT_RELOAD=1 re-checks the file mtime on each get() and reloads on change
+HOT_RELOAD = os.getenv("MODEL_HOT_RELOAD", "1") not in ("0", "false", "False", "")
+
+
+def _rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Entry:
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.obj: Any = None
+        self.mtime: Optional[float] = None
+        self.sha256: Optional[str] = None
+        self.load_time_s: Optional[float] = None
+        self.rss_delta_bytes: Optional[int] = None
+        self.loads = 0
+        self.loaded_at: Optional[float] = None
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of the pickled models.
+    Each model is unpickled once and reloaded only when its file mtime changes.
+    """
+
+    def __init__(self, files: Dict[str, str] = MODEL_FILES, base_dir: str = BACKEND_DIR,
+                 hot_reload: bool = HOT_RELOAD):
+        self._entries = {name: _Entry(name, os.path.join(base_dir, fname)) for name, fname in files.items()}
+        self._lock = threading.Lock()
+        self.hot_reload = hot_reload
+
+    def _load(self, entry: _Entry) -> None:
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        # One read: the hash (the model's version) is of exactly the bytes that were unpickled
+        with open(entry.path, "rb") as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            data = f.read()
+        obj = joblib.load(io.BytesIO(data))
+        entry.load_time_s = time.perf_counter() - start
+        rss_after = _rss_bytes()
+        entry.rss_delta_bytes = (rss_after - rss_before) if rss_before is not None and rss_after is not None else None
+        entry.sha256 = hashlib.sha256(data).hexdigest()
+        entry.obj = obj
+        entry.mtime = mtime
+        entry.loads += 1
+        entry.loaded_at = time.time()
+
+    def get(self, name: str) -> Any:
+        """Return the loaded model, loading or hot-reloading it if needed."""
+        entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f"Unknown model: {name}")
+        if entry.obj is not None:
+            if not self.hot_reload or os.path.getmtime(entry.path) == entry.mtime:
+                return entry.obj
+        with self._lock:
+            if entry.obj is None:
+                self._load(entry)
+            elif self.hot_reload and os.path.getmtime(entry.path) != entry.mtime:
+                self._load(entry)
+            return entry.obj
+
+    def path(self, name: str) -> str:
+        return self._entries[name].path
+
+    def version(self, name: str) -> str:
+        """Content hash of the currently loaded model file (short form)."""
+        self.get(name)
+        return self._entries[name].sha256[:12]
+
+    def preload(self) -> None:
+        for name in self._entries:
+            self.get(name)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Load-time, memory and version info for every registered model."""
+        out = {}
+        for name, entry in self._entries.items():
+            out[name] = {
+                "path": entry.path,
+                "loaded": entry.obj is not None,
+                "loads": entry.loads,
+                "load_time_s": entry.load_time_s,
+                "rss_delta_bytes": entry.rss_delta_bytes,
+                "file_size_bytes": os.path.getsize(entry.path) if os.path.exists(entry.path) else None,
+                "sha256": entry.sha256,
+                "mtime": entry.mtime,
+                "loaded_at": entry.loaded_at,
+            }
+        return out
+
+
+registry = ModelRegistry()
+
+
+def get_model(name: str) -> Any:
+    return registry.get(name)
@@ -3,7 +3,10 @@ from geopy.distance import geodesic
 import os
 from typing import Dict, Any
 import numpy as np
-import pandas as pd
+from land_raster import get_raster, is_land
+from feature_cube import get_cube
+from metrics import inc, span
+from reference_store import load_columns, reference_csv_path
 
 # Force-set environment variables to avoid interactive prompts in the client
 
@@ -23,6 +26,7 @@ def estimate_ocean_params(lat: float, lon: float, depth: float = 0.0) -> Dict[st
     Estimate ocean parameters when API fails.
     Uses basic physical models for temperature and salinity.
     """
+    inc("sharkapi_fallbacks_total", kind="estimate_ocean_params")
     # Estimate temperature based on latitude (warmer at equator, colder at poles)
     base_temp = 30 * (1 - abs(lat) / 90)  # 30°C at equator, 0°C at poles
     
@@ -46,9 +50,13 @@ def estimate_ocean_params(lat: float, lon: float, depth: float = 0.0) -> Dict[st
     }
 
 def nearest_shore_distance_km(lat: float, lon: float, step: float = 0.25, max_radius: float = 3.0) -> float:
-    """Approximate nearest shore distance using globe.is_land. Searches outward rings up to max_radius degrees."""
-    if globe.is_land(lat, lon):
+    """Approximate nearest shore distance using globe.is_land. Searches outward rings up to max_radius degrees.
+    Uses the precomputed land raster (see land_raster.py) when it has been built."""
+    if is_land(lat, lon):
         return 0.0
+    raster = get_raster()
+    if raster is not None:
+        return float(raster.shore_distance_km(lat, lon))
     found = None
     r = step
     while r <= max_radius and not found:
@@ -68,37 +76,176 @@ def nearest_shore_distance_km(lat: float, lon: float, step: float = 0.25, max_ra
         return geodesic((lat, lon), found).km
     return float('nan')
 
-_SHARK_DF: pd.DataFrame | None = None
+def nearest_shore_distance_km_batch(lats, lons) -> np.ndarray:
+    """Vectorized nearest_shore_distance_km (raster lookup, ring search if no raster is built)."""
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    raster = get_raster()
+    if raster is None:
+        return np.array([nearest_shore_distance_km(float(a), float(b)) for a, b in zip(lats, lons)], dtype=float)
+    dist = raster.shore_distance_km(lats, lons)
+    dist[raster.is_land(lats, lons)] = 0.0
+    return dist
 
-def _load_shark_df() -> pd.DataFrame:
-    global _SHARK_DF
-    if _SHARK_DF is None:
-        csv_path = os.path.join(os.path.dirname(__file__), "shark_subset_250_rows_till_K.csv")
-        _SHARK_DF = pd.read_csv(csv_path)
-    return _SHARK_DF
+_SHARK_COLUMNS: Dict[str, np.ndarray] | None = None
+_SHARK_INDEX: "_ReferenceIndex | None" = None
 
-def _nearest_row(lat: float, lon: float) -> Dict[str, Any]:
+_FEATURE_COLUMNS = ("bathymetry", "sst", "sss", "shoredistance")
+# Mean earth radius; every great-circle distance in the backend uses it
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = EARTH_RADIUS_KM * np.pi / 180
+
+def _load_shark_columns() -> Dict[str, np.ndarray]:
+    """Coordinate and feature columns of the reference table (memory-mapped store if ingested, else CSV)."""
+    global _SHARK_COLUMNS
+    if _SHARK_COLUMNS is None:
+        _SHARK_COLUMNS = load_columns(reference_csv_path(),
+                                      ["decimalLatitude", "decimalLongitude", *_FEATURE_COLUMNS])
+    return _SHARK_COLUMNS
+
+def reset_reference() -> None:
+    """Drop the loaded reference table and index; the next lookup reloads them."""
+    global _SHARK_COLUMNS, _SHARK_INDEX
+    _SHARK_COLUMNS = None
+    _SHARK_INDEX = None
+
+def unit_xyz(lats, lons) -> np.ndarray:
+    """Lat/lon degrees to points on the unit sphere (chord distance is monotonic in haversine distance)."""
+    lat_r = np.radians(np.asarray(lats, dtype=float))
+    lon_r = np.radians(np.asarray(lons, dtype=float))
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+def chord_km(chord) -> np.ndarray:
+    """Great-circle km of chord lengths between unit_xyz points."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord, dtype=float) / 2, 0.0, 1.0))
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle km between points given in degrees (arrays broadcast)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+class _ReferenceIndex:
+    """
+    Haversine spatial index over the reference feature table, built once at load.
+
+    Rows with missing coordinates are dropped. Queries use a KD-tree on unit-sphere
+    coordinates, so the nearest row is the great-circle (haversine) nearest one. The old
+    scan ranked rows by WGS84 geodesic distance; the two agree except when two rows are
+    within ~0.5% of each other in distance (sphere vs ellipsoid). _nearest_row re-ranks the
+    k closest candidates by geodesic distance to close that gap for single-point lookups.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        from scipy.spatial import cKDTree
+
+        lat = np.asarray(columns["decimalLatitude"], dtype=float)
+        lon = np.asarray(columns["decimalLongitude"], dtype=float)
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        # The columnar store already drops rows without coordinates; keep its mapped arrays as-is
+        select = (lambda a: a) if valid.all() else (lambda a: a[valid])
+        self.latitude = select(lat)
+        self.longitude = select(lon)
+        self.columns = {col: select(np.asarray(columns[col], dtype=float)) for col in _FEATURE_COLUMNS}
+        self.size = int(valid.sum())
+        self.tree = cKDTree(unit_xyz(self.latitude, self.longitude)) if self.size else None
+
+    def query(self, lats, lons, k: int = 1):
+        """k-nearest rows for a batch of points. Returns (haversine km, row indices), shape (n, k)."""
+        if self.tree is None:
+            raise ValueError("No data rows found in shark subset CSV")
+        k = min(k, self.size)
+        chord, idx = self.tree.query(unit_xyz(lats, lons), k=k)
+        chord = np.asarray(chord, dtype=float).reshape(-1, k)
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1, k)
+        return chord_km(chord), idx
+
+def _load_reference_index() -> _ReferenceIndex:
+    global _SHARK_INDEX
+    if _SHARK_INDEX is None:
+        _SHARK_INDEX = _ReferenceIndex(_load_shark_columns())
+    return _SHARK_INDEX
+
+def _nearest_row(lat: float, lon: float, candidates: int = 4) -> Dict[str, Any]:
     """Return the nearest row from the shark subset CSV to the input lat/lon."""
-    df = _load_shark_df()
-    # Iterate to find minimal geodesic distance (250 rows => fast enough)
+    index = _load_reference_index()
+    # Spatial index narrows to a few candidates; geodesic picks the final one
+    _, idx = index.query([lat], [lon], k=candidates)
     min_dist = float("inf")
     best = None
-    for _, row in df.iterrows():
-        d = geodesic((lat, lon), (row["decimalLatitude"], row["decimalLongitude"]))
-        if d.km < min_dist:
-            min_dist = d.km
-            best = row
+    for i in idx[0]:
+        d = geodesic((lat, lon), (index.latitude[i], index.longitude[i])).km
+        if d < min_dist:
+            min_dist = d
+            best = i
     if best is None:
         raise ValueError("No data rows found in shark subset CSV")
-    return {
-        "latitude": float(best["decimalLatitude"]),
-        "longitude": float(best["decimalLongitude"]),
-        "bathymetry": float(best["bathymetry"]) if not pd.isna(best["bathymetry"]) else np.nan,
-        "sst": float(best["sst"]) if not pd.isna(best["sst"]) else np.nan,
-        "sss": float(best["sss"]) if not pd.isna(best["sss"]) else np.nan,
-        "shoredistance": float(best["shoredistance"]) if not pd.isna(best["shoredistance"]) else np.nan,
-        "nearest_distance_km": float(min_dist)
+    row = {
+        "latitude": float(index.latitude[best]),
+        "longitude": float(index.longitude[best]),
     }
+    for col in _FEATURE_COLUMNS:
+        row[col] = float(index.columns[col][best])
+    row["nearest_distance_km"] = float(min_dist)
+    return row
+
+def nearest_rows_batch(lats, lons) -> Dict[str, np.ndarray]:
+    """Vectorized _nearest_row for many points at once (haversine distance, see _ReferenceIndex).
+
+    Returns a dict of arrays aligned with the inputs: latitude, longitude, the
+    feature columns and nearest_distance_km.
+    """
+    index = _load_reference_index()
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    dist, idx = index.query(lats, lons, k=1)
+    idx = idx[:, 0]
+    out = {
+        "latitude": index.latitude[idx],
+        "longitude": index.longitude[idx],
+    }
+    for col in _FEATURE_COLUMNS:
+        out[col] = index.columns[col][idx]
+    out["nearest_distance_km"] = dist[:, 0]
+    return out
+
+def get_bathymetry_batch(lats, lons, rows: Dict[str, np.ndarray] | None = None) -> np.ndarray:
+    """Vectorized get_bathymetry. Pass rows from nearest_rows_batch to skip a second lookup."""
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    try:
+        if rows is None:
+            rows = nearest_rows_batch(lats, lons)
+        bathy = np.abs(rows["bathymetry"])
+    except Exception:
+        bathy = np.full(lats.shape[0], np.nan)
+    # Heuristic fallback only for points the CSV cannot answer
+    missing = np.isnan(bathy)
+    if missing.any():
+        inc("sharkapi_fallbacks_total", int(missing.sum()), kind="bathymetry_from_shore")
+        bathy[missing] = _bathymetry_from_shore_km(nearest_shore_distance_km_batch(lats[missing], lons[missing]))
+    return bathy
+
+def get_features_batch(lats, lons, month) -> Dict[str, np.ndarray]:
+    """
+    Model features for many points: bathymetry (positive meters), sst, sss, shoredistance.
+    Interpolated from the gridded feature cube when it has been built (see feature_cube.py),
+    otherwise taken from the nearest reference CSV rows.
+    """
+    with span("features"):
+        cube = get_cube()
+        if cube is not None:
+            feats = cube.lookup(lats, lons, month)
+            feats["bathymetry"] = np.abs(feats["bathymetry"])
+            return feats
+        rows = nearest_rows_batch(lats, lons)
+        return {
+            "bathymetry": get_bathymetry_batch(lats, lons, rows),
+            "sst": rows["sst"],
+            "sss": rows["sss"],
+            "shoredistance": rows["shoredistance"],
+        }
 
 def get_nearest_csv_features(lat: float, lon: float) -> Dict[str, float]:
     """Return only the feature columns from the nearest CSV row for model input."""
@@ -120,7 +267,20 @@ def get_bathymetry(lat: float, lon: float) -> float:
             return abs(bathy_val)
     except Exception:
         pass
-    # Heuristic fallback based on distance to shore
+    return _bathymetry_from_shore(lat, lon)
+
+def _bathymetry_from_shore_km(dist_km: np.ndarray) -> np.ndarray:
+    """Vectorized _bathymetry_from_shore for precomputed shore distances."""
+    dist_km = np.asarray(dist_km, dtype=float)
+    return np.select(
+        [np.isnan(dist_km), dist_km < 20, dist_km < 200, dist_km < 600],
+        [4000.0, 50.0, 200.0, 1000.0],
+        default=4000.0,
+    )
+
+def _bathymetry_from_shore(lat: float, lon: float) -> float:
+    """Heuristic bathymetry fallback based on distance to shore."""
+    inc("sharkapi_fallbacks_total", kind="bathymetry_from_shore")
     dist_km = nearest_shore_distance_km(lat, lon)
     if np.isnan(dist_km):
         return 4000.0
@@ -134,11 +294,12 @@ def get_bathymetry(lat: float, lon: float) -> float:
 
 def get_ocean_params(lat: float, lon: float, depth: float = 0.0, time: str = "latest"):
     """
-    CSV-backed parameters from nearest row in shark_subset_250_rows_till_K.csv.
+    CSV-backed parameters from nearest row of the reference CSV (see reference_store.reference_csv_path).
     Returns: { latitude, longitude, depth_m (negative), salinity_psu, temperature_C, shore_distance_km, time_used }
     """
     row = _nearest_row(lat, lon)
-    depth_m = get_bathymetry(lat, lon)
+    # Reuse the row instead of a second nearest lookup inside get_bathymetry
+    depth_m = abs(row["bathymetry"]) if not np.isnan(row["bathymetry"]) else _bathymetry_from_shore(lat, lon)
     # Salinity direct
     salinity = row["sss"] if not np.isnan(row["sss"]) else estimate_ocean_params(lat, lon, depth)["salinity_psu"]
     # Temperature direct from CSV if present
@@ -148,8 +309,8 @@ def get_ocean_params(lat: float, lon: float, depth: float = 0.0, time: str = "la
     if not np.isnan(row["shoredistance"]):
         shore_km = row["shoredistance"] / 1000.0
     return {
-        "latitude": float(row.get("latitude", row["decimalLatitude"])),
-        "longitude": float(row.get("longitude", row["decimalLongitude"])),
+        "latitude": float(row["latitude"]),
+        "longitude": float(row["longitude"]),
         "depth_m": float(depth_m),
         "salinity_psu": float(salinity),
         "temperature_C": float(temperature) if temperature is not None else np.nan,
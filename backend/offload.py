@@ -0,0 +1,253 @@
+"""
+Bounded executor for the CPU-bound parts of the API (feature generation, model inference).
+
+Handlers stay async and only await here, so /get, tile hits and cached responses are
+served while a grid job runs. Each endpoint has its own concurrency limit and a bounded
+wait queue; a request that finds the queue full gets a 503 with Retry-After.
+
+Cancellation: a request whose client disconnects while queued never starts. Work that is
+already running finishes (threads cannot be interrupted) and keeps its slot until it does;
+its result still lands in the response cache. Streams stop at the next chunk boundary.
+Streaming handlers take their slot with acquire() before returning the StreamingResponse,
+since once its 200 headers are out a busy queue can no longer be reported.
+
+    INFERENCE_WORKERS      thread pool size (default: CPU count, at most 4)
+    ENDPOINT_CONCURRENCY   overrides, e.g. "globalHabitats=1,batch=2"
+    OFFLOAD_QUEUE_SIZE     waiting requests per endpoint before 503 (default 16)
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+from fastapi import HTTPException, Request
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+OFFLOAD_QUEUE_SIZE = int(os.getenv("OFFLOAD_QUEUE_SIZE", "16"))
+# Seconds between client disconnect checks while a request waits
+DISCONNECT_POLL_S = 0.25
+
+# Running jobs allowed per endpoint; the global grid is the heaviest
+DEFAULT_CONCURRENCY = {
+    "globalHabitats": 1,
+    "getMigration": 2,
+    "corridors": 1,
+    "batch": 2,
+    "predictionSighting": 2,
+    "sharkActivity": 2,
+}
+FALLBACK_CONCURRENCY = 4
+
+
+def _parse_concurrency(spec: str) -> Dict[str, int]:
+    limits = dict(DEFAULT_CONCURRENCY)
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, value = item.partition("=")
+        try:
+            limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            print(f"Ignoring bad ENDPOINT_CONCURRENCY entry '{item}'")
+    return limits
+
+
+class ClientDisconnected(HTTPException):
+    """Raised when the client went away before its job started."""
+
+    def __init__(self):
+        # 499: client closed request (nginx convention); nobody reads it
+        super().__init__(status_code=499, detail="Client disconnected")
+
+
+class _EndpointLimit:
+    def __init__(self, concurrency: int, queue_size: int):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+
+class _Slot:
+    """
+    A running slot taken ahead of a stream, so a full queue is still a 503 before any
+    response header is sent. Released once: by the stream when it ends, or when the
+    stream was never iterated and the slot is dropped.
+    """
+
+    def __init__(self, executor: "InferenceExecutor", limit: _EndpointLimit):
+        self._executor = executor
+        self._limit = limit
+        self._loop = asyncio.get_running_loop()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self._executor._release(self._limit)
+
+    def __del__(self):
+        if not self.released:
+            self.released = True
+            try:
+                self._loop.call_soon_threadsafe(self._executor._release, self._limit)
+            except RuntimeError:
+                pass  # loop already closed
+
+
+class InferenceExecutor:
+    def __init__(self, workers: int = INFERENCE_WORKERS, queue_size: int = OFFLOAD_QUEUE_SIZE,
+                 concurrency: Optional[Dict[str, int]] = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.concurrency = concurrency if concurrency is not None else \
+            _parse_concurrency(os.getenv("ENDPOINT_CONCURRENCY", ""))
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._limits: Dict[str, _EndpointLimit] = {}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        return self._pool
+
+    def _limit(self, endpoint: str) -> _EndpointLimit:
+        limit = self._limits.get(endpoint)
+        if limit is None:
+            limit = _EndpointLimit(self.concurrency.get(endpoint, FALLBACK_CONCURRENCY), self.queue_size)
+            self._limits[endpoint] = limit
+        return limit
+
+    async def _acquire(self, limit: _EndpointLimit, request: Optional[Request]) -> None:
+        """Wait for a slot, giving up if the queue is full or the client disconnects."""
+        if limit.semaphore.locked() and limit.waiting >= limit.queue_size:
+            limit.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, retry shortly",
+                                headers={"Retry-After": "5"})
+        limit.waiting += 1
+        acquire = asyncio.ensure_future(limit.semaphore.acquire())
+        try:
+            while True:
+                done, _ = await asyncio.wait({acquire}, timeout=DISCONNECT_POLL_S)
+                if done:
+                    break
+                if request is not None and await request.is_disconnected():
+                    raise ClientDisconnected()
+        except BaseException:
+            # Disconnected, or the waiting task itself was cancelled: never leave the
+            # acquire pending, or it takes the slot later with nobody to release it
+            if acquire.done() and not acquire.cancelled():
+                limit.semaphore.release()
+            else:
+                acquire.cancel()
+            limit.cancelled += 1
+            raise
+        finally:
+            limit.waiting -= 1
+        limit.running += 1
+
+    def _release(self, limit: _EndpointLimit) -> None:
+        limit.running -= 1
+        limit.completed += 1
+        limit.semaphore.release()
+
+    def _submit(self, fn: Callable[..., Any], *args,
+                on_done: Optional[Callable[[], None]] = None) -> "asyncio.Future":
+        """
+        Start fn on the pool. If on_done is given it runs when fn finishes, even if the awaiting
+        request was cancelled first, so a slot is never freed while its thread is still busy.
+        """
+        # Copy the request context so spans recorded on the pool reach its Server-Timing
+        ctx = contextvars.copy_context()
+        future = asyncio.get_running_loop().run_in_executor(self.pool, ctx.run, fn, *args)
+
+        def finished(f: "asyncio.Future") -> None:
+            if not f.cancelled():
+                f.exception()  # mark retrieved; the awaiting side re-raises it
+            if on_done is not None:
+                on_done()
+
+        future.add_done_callback(finished)
+        return future
+
+    async def run(self, endpoint: str, request: Optional[Request], fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the pool under the endpoint's concurrency limit."""
+        limit = self._limit(endpoint)
+        await self._acquire(limit, request)
+        future = self._submit(lambda: fn(*args, **kwargs), on_done=lambda: self._release(limit))
+        return await asyncio.shield(future)
+
+    async def call(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Run a blocking step that is not inference (serializing a result, cache file I/O) on
+        the pool, outside the endpoint limits, so it does not stall the event loop.
+        """
+        return await self._submit(fn, *args)
+
+    async def acquire(self, endpoint: str, request: Optional[Request]) -> _Slot:
+        """
+        Take a slot for a later stream(). Call it in the handler, before building the
+        StreamingResponse: a full queue raises the 503 while the status can still be sent.
+        """
+        limit = self._limit(endpoint)
+        await self._acquire(limit, request)
+        return _Slot(self, limit)
+
+    async def stream(self, endpoint: str, request: Optional[Request], items: Iterator[bytes],
+                     slot: Optional[_Slot] = None) -> AsyncIterator[bytes]:
+        """
+        Drive a blocking chunk iterator on the pool, one next() per chunk, holding one slot
+        (slot from acquire(), else taken here) for the whole stream. Stops early when the
+        client disconnects.
+        """
+        if slot is None:
+            slot = await self.acquire(endpoint, request)
+        limit = slot._limit
+        end = object()
+        pending: Optional[asyncio.Future] = None
+
+        def finish() -> None:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+            slot.release()
+
+        try:
+            while True:
+                pending = self._submit(next, items, end)
+                chunk = await asyncio.shield(pending)
+                pending = None
+                if chunk is end:
+                    break
+                yield chunk
+                if request is not None and await request.is_disconnected():
+                    limit.cancelled += 1
+                    break
+        finally:
+            if pending is not None and not pending.done():
+                # Cancelled mid-chunk: close the iterator once its thread returns
+                limit.cancelled += 1
+                pending.add_done_callback(lambda _: finish())
+            else:
+                finish()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "endpoints": {
+                name: {"concurrency": lim.concurrency, "running": lim.running, "waiting": lim.waiting,
+                       "completed": lim.completed, "rejected": lim.rejected, "cancelled": lim.cancelled}
+                for name, lim in self._limits.items()
+            },
+        }
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+executor = InferenceExecutor()
@@ -0,0 +1,144 @@
+"""
+Precompute the global presence probability surface for all 12 months.
+
+    python precompute_habitats.py --resolution 0.5 --workers 4
+    python precompute_habitats.py --resolution 0.5 --uncertainty perturbation bootstrap
+
+Each month is scored in its own worker process and written to
+backend/data/habitat_store/res_{resolution}/month_{MM}.parquet, tagged with the
+presence model version. predict_global_habitats serves from these files when they
+match the requested resolution and the currently loaded model. With --uncertainty, each
+method's per-cell spread is stored as an extra column (see uncertainty.py).
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from habitat_grid import DEFAULT_RESOLUTION, build_grid_features, score_presence, surface_frame
+from model_registry import registry
+from uncertainty import add_uncertainty
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+HABITAT_STORE_DIR = os.getenv("HABITAT_STORE_DIR", os.path.join(BACKEND_DIR, "data", "habitat_store"))
+
+
+def store_path(resolution: float, month: int, root: str = HABITAT_STORE_DIR) -> str:
+    return os.path.join(root, f"res_{float(resolution):g}", f"month_{int(month):02d}.parquet")
+
+
+def compute_month(resolution: float, month: int, uncertainty: Iterable[str] = ()) -> pd.DataFrame:
+    """Score every ocean cell of the grid for one month, with the spread of each uncertainty method."""
+    features = build_grid_features(resolution, month)
+    _, probs = score_presence(registry.get("presence"), features)
+    surface = surface_frame(features, probs).astype(np.float32)
+    for method in uncertainty:
+        surface = add_uncertainty(surface, month, method)
+    return surface
+
+
+def write_table(df: pd.DataFrame, path: str, metadata: Dict[str, str]) -> str:
+    """Write a frame as zstd Parquet with string metadata in the schema, atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        **{key.encode(): value.encode() for key, value in metadata.items()},
+    })
+    # Unique per writer: concurrent load_month calls for the same month must not share it
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pq.write_table(table, f, compression="zstd")
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def read_table(path: str, expected: Dict[str, Optional[str]]) -> Optional[pd.DataFrame]:
+    """Frame written by write_table, or None if missing or its metadata differs from expected (None = any)."""
+    if not os.path.exists(path):
+        return None
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    for key, value in expected.items():
+        stored = metadata.get(key.encode(), b"").decode()
+        if value is not None and stored != value:
+            print(f"Ignoring stale {path} ({key} {stored} != {value})")
+            return None
+    return table.to_pandas()
+
+
+def write_month(df: pd.DataFrame, resolution: float, month: int, model_version: str,
+                root: str = HABITAT_STORE_DIR) -> str:
+    # Every grid has ocean cells; an empty surface means scoring failed and must not be served
+    if df.empty:
+        raise ValueError(f"Refusing to store an empty surface for {resolution:g} deg month {month}")
+    return write_table(df, store_path(resolution, month, root), {
+        "model_version": model_version,
+        "resolution": str(float(resolution)),
+        "month": str(int(month)),
+    })
+
+
+def read_month(resolution: float, month: int, model_version: Optional[str] = None,
+               root: str = HABITAT_STORE_DIR) -> Optional[pd.DataFrame]:
+    """Stored surface for (resolution, month), or None if missing or built with another model."""
+    return read_table(store_path(resolution, month, root), {"model_version": model_version})
+
+
+def load_month(resolution: float, month: int) -> pd.DataFrame:
+    """Stored surface for the current presence model, computed and stored first if missing."""
+    version = registry.version("presence")
+    surface = read_month(resolution, month, version)
+    if surface is None:
+        surface = compute_month(resolution, month)
+        write_month(surface, resolution, month, version)
+    return surface
+
+
+def _run_month(resolution: float, month: int, root: str, uncertainty: Iterable[str] = ()) -> str:
+    start = time.perf_counter()
+    df = compute_month(resolution, month, uncertainty)
+    path = write_month(df, resolution, month, registry.version("presence"), root)
+    print(f"month {month:02d}: {len(df)} cells in {time.perf_counter() - start:.1f}s -> {path}")
+    return path
+
+
+def precompute(resolution: float = DEFAULT_RESOLUTION, months: Iterable[int] = range(1, 13),
+               workers: Optional[int] = None, root: str = HABITAT_STORE_DIR, uncertainty: Iterable[str] = ()) -> None:
+    months = list(months)
+    uncertainty = list(uncertainty)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_month, resolution, m, root, uncertainty) for m in months]
+        for fut in as_completed(futures):
+            fut.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute monthly global habitat probabilities")
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION, help="grid step in degrees")
+    parser.add_argument("--months", type=int, nargs="*", default=list(range(1, 13)), help="months to compute")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--out", default=HABITAT_STORE_DIR, help="store directory")
+    parser.add_argument("--uncertainty", nargs="*", default=[], choices=["perturbation", "bootstrap"],
+                        help="also store the per-cell spread of these methods")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    precompute(args.resolution, args.months, args.workers, args.out, args.uncertainty)
+    print(f"Precomputed {len(args.months)} months at {args.resolution} deg in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
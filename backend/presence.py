@@ -1,9 +1,10 @@
-import pickle
 import os
 import numpy as np
 import traceback
 
-filename = os.path.join(os.path.dirname(__file__), 'presence_model.pkl')
+from model_registry import registry
+
+filename = registry.path("presence")
 
 def predict(data : list):
     if not os.path.exists(filename):
@@ -11,8 +12,8 @@ def predict(data : list):
         return
 
     try:
-        with open(filename, 'rb') as file:
-            loaded_model = pickle.load(file)
+        # Cached by the model registry; only unpickled on first use or when the file changes
+        loaded_model = registry.get("presence")
     except Exception as e:
         print("Failed to load pickle file:")
         traceback.print_exc()
@@ -24,12 +25,14 @@ def predict(data : list):
     # Prepare a single sample for prediction
 
     # Ensure sample is 2D
+    data = np.asarray(data, dtype=float)
     if data.ndim == 1:
         data = data.reshape(1, -1)
 
     try:
         ans = loaded_model.predict(data)
         print("Prediction:", ans)
+        return ans
     except Exception as e:
         print("Failed to run predict() on the loaded model:")
         traceback.print_exc()
@@ -0,0 +1,252 @@
+"""
+Columnar reference data store (typed, column-pruned, memory-mapped).
+
+Converts the training/reference CSVs under models/ into uncompressed Arrow IPC files that
+keep only the columns used at serve time:
+
+    python reference_store.py                      # all known CSVs
+    python reference_store.py --src path/to/file.csv --out data/reference
+
+Files are written to backend/data/reference/{csv name}.arrow with a manifest.json recording
+each source's size and mtime. The backend memory-maps them: numeric columns come back
+as NumPy views on the mapped file (no parse, no copy), so cold start is fast and the pages
+are shared by every uvicorn worker through the OS page cache. A CSV that changed since it
+was ingested, or was never ingested, is read with pandas as before.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BACKEND_DIR, "..", "models")
+REFERENCE_STORE_DIR = os.getenv("REFERENCE_STORE_DIR", os.path.join(BACKEND_DIR, "data", "reference"))
+MANIFEST = "manifest.json"
+
+# Feature table behind both the nearest-row lookups (ocean_utils) and the feature cube.
+# SHARK_REFERENCE_CSV overrides the search order. Only real presences: the absence rows of
+# the refined CSVs carry synthetic environment values.
+REFERENCE_CSV_CANDIDATES = (
+    os.path.join(BACKEND_DIR, "shark_subset_250_rows_till_K.csv"),
+    os.path.join(MODELS_DIR, "Shark Presence", "presence_dataset_real_presences.csv"),
+)
+
+DEFAULT_SOURCES = [
+    os.path.join(MODELS_DIR, "Shark Presence", "presence_dataset_real_presences.csv"),
+    os.path.join(MODELS_DIR, "Shark Presence", "shark_presence_absence_refined.csv"),
+    os.path.join(MODELS_DIR, "Shark Presence", "shark_presence_absence_refined_v2.csv"),
+    os.path.join(MODELS_DIR, "Shark activity", "All_data_behavior_restored_v2.csv"),
+    os.path.join(MODELS_DIR, "Shark activity", "ready_to_run.csv"),
+]
+
+# Serve-time columns and their stored types. Coordinates and features stay float64 so
+# the index and lookups use the mapped buffers without an upcast copy.
+COLUMN_TYPES = {
+    "decimalLatitude": "float64",
+    "decimalLongitude": "float64",
+    "eventDate": "timestamp",
+    "month": "float32",
+    "date_year": "float32",
+    "bathymetry": "float64",
+    "sst": "float64",
+    "sss": "float64",
+    "shoredistance": "float64",
+    "presence": "int8",
+    "behavior": "category",
+    "Behavior_filled": "category",
+}
+# One-hot behaviour columns in ready_to_run.csv
+ONE_HOT_PREFIX = "Behavior_filled_"
+
+
+def reference_csv_path() -> str:
+    override = os.getenv("SHARK_REFERENCE_CSV")
+    if override:
+        return override
+    for path in REFERENCE_CSV_CANDIDATES:
+        if os.path.exists(path):
+            return path
+    return REFERENCE_CSV_CANDIDATES[0]
+
+
+def store_path(source: str, root: str = REFERENCE_STORE_DIR) -> str:
+    return os.path.join(root, os.path.splitext(os.path.basename(source))[0] + ".arrow")
+
+
+def _source_stamp(source: str) -> Dict[str, float]:
+    st = os.stat(source)
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def _kept_columns(header: Iterable[str]) -> List[str]:
+    return [c for c in header if c in COLUMN_TYPES or c.startswith(ONE_HOT_PREFIX)]
+
+
+def _to_arrow(name: str, series: pd.Series) -> pa.Array:
+    kind = COLUMN_TYPES.get(name, "int8")
+    if kind == "timestamp":
+        return pa.array(pd.to_datetime(series, errors="coerce", utc=True), type=pa.timestamp("s", tz="UTC"))
+    if kind == "category":
+        return pa.array(series.astype("string")).dictionary_encode()
+    values = pd.to_numeric(series, errors="coerce")
+    if kind == "int8":
+        return pa.array(values.fillna(-1).to_numpy(dtype=np.int8))
+    # NaN stays NaN (not null) so the column maps straight to a NumPy view
+    return pa.array(values.to_numpy(dtype=kind))
+
+
+def ingest(source: str, root: str = REFERENCE_STORE_DIR) -> Dict[str, object]:
+    """Convert one CSV; rows without coordinates are dropped (they cannot be looked up)."""
+    header = pd.read_csv(source, nrows=0).columns
+    columns = _kept_columns(header)
+    df = pd.read_csv(source, usecols=columns, low_memory=False)
+    df = df.dropna(subset=[c for c in ("decimalLatitude", "decimalLongitude") if c in df])
+    table = pa.table({name: _to_arrow(name, df[name]) for name in columns})
+
+    path = store_path(source, root)
+    os.makedirs(root, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+    try:
+        os.close(fd)
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return {
+        "source": os.path.abspath(source),
+        "file": os.path.basename(path),
+        "rows": table.num_rows,
+        "columns": columns,
+        "dropped_columns": len(header) - len(columns),
+        "bytes": os.path.getsize(path),
+        **_source_stamp(source),
+    }
+
+
+def _read_manifest(root: str) -> Dict[str, Dict[str, object]]:
+    try:
+        with open(os.path.join(root, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(root: str, manifest: Dict[str, Dict[str, object]]) -> None:
+    fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, os.path.join(root, MANIFEST))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+_tables: Dict[str, pa.Table] = {}
+# Stale stores already reported; open_table runs on the request path
+_warned: Set[str] = set()
+_lock = threading.Lock()
+
+
+def open_table(source: str, root: str = REFERENCE_STORE_DIR) -> Optional[pa.Table]:
+    """Memory-mapped table for a source CSV, or None if it was never ingested or is stale."""
+    path = store_path(source, root)
+    with _lock:
+        table = _tables.get(path)
+        if table is not None:
+            return table
+        entry = _read_manifest(root).get(os.path.basename(path))
+        if entry is None or not os.path.exists(path):
+            return None
+        try:
+            stamp = _source_stamp(source)
+        except OSError:
+            stamp = None  # CSV not shipped with this deployment; the store is all there is
+        if stamp is not None and (stamp["size"] != entry["size"] or stamp["mtime"] != entry["mtime"]):
+            if path not in _warned:
+                _warned.add(path)
+                print(f"Reference store {path} is stale; reading {source}")
+            return None
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        _tables[path] = table
+        return table
+
+
+def refresh(source: str, root: str = REFERENCE_STORE_DIR) -> bool:
+    """Re-ingest a source whose stored copy is stale. Returns True if the store was rewritten."""
+    name = os.path.basename(store_path(source, root))
+    manifest = _read_manifest(root)
+    if name not in manifest or not os.path.exists(source) or open_table(source, root) is not None:
+        return False
+    manifest[name] = ingest(source, root)
+    _write_manifest(root, manifest)
+    reset()
+    return True
+
+
+def reset() -> None:
+    """Forget mapped tables so the next open_table maps the files as they are now."""
+    with _lock:
+        _tables.clear()
+        _warned.clear()
+
+
+def load_columns(source: str, columns: Sequence[str], root: str = REFERENCE_STORE_DIR) -> Dict[str, np.ndarray]:
+    """
+    Columns of a reference CSV as NumPy arrays: zero-copy views on the mapped store when it
+    is current, otherwise parsed from the CSV.
+    """
+    table = open_table(source, root)
+    if table is not None and all(c in table.column_names for c in columns):
+        out = {}
+        for c in columns:
+            col = table.column(c)
+            chunk = col.chunk(0) if col.num_chunks == 1 else col.combine_chunks()
+            out[c] = chunk.to_numpy(zero_copy_only=chunk.null_count == 0 and pa.types.is_primitive(chunk.type))
+        return out
+    df = pd.read_csv(source, usecols=lambda c: c in columns)
+    return {c: df[c].to_numpy() for c in columns}
+
+
+def read_frame(source: str, columns: Sequence[str], root: str = REFERENCE_STORE_DIR) -> pd.DataFrame:
+    """DataFrame with the requested columns that exist in the source (store first, CSV fallback)."""
+    table = open_table(source, root)
+    if table is not None:
+        return table.select([c for c in columns if c in table.column_names]).to_pandas()
+    return pd.read_csv(source, usecols=lambda c: c in columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert reference CSVs into memory-mappable Arrow files")
+    parser.add_argument("--src", nargs="*", default=DEFAULT_SOURCES, help="CSV files to ingest")
+    parser.add_argument("--out", default=REFERENCE_STORE_DIR, help="store directory")
+    args = parser.parse_args()
+
+    manifest = _read_manifest(args.out)
+    for source in args.src:
+        if not os.path.exists(source):
+            print(f"Skipping missing {source}")
+            continue
+        start = time.perf_counter()
+        entry = ingest(source, args.out)
+        manifest[entry["file"]] = entry
+        print(f"{os.path.basename(source)}: {entry['rows']} rows, kept {len(entry['columns'])} columns "
+              f"(dropped {entry['dropped_columns']}), {entry['bytes'] / 1e6:.1f} MB "
+              f"in {time.perf_counter() - start:.2f}s -> {entry['file']}")
+    _write_manifest(args.out, manifest)
+
+
+if __name__ == '__main__':
+    main()
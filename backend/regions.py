@@ -0,0 +1,181 @@
+"""
+Habitat and behaviour statistics inside GeoJSON regions (MPAs, EEZs, drawn polygons).
+
+A region is any GeoJSON Polygon / MultiPolygon geometry, Feature or FeatureCollection
+(longitudes in -180..180; split shapes that cross the antimeridian, as GeoJSON requires).
+Its parts are unioned and prepared once. Grid cells are then selected in three steps, so
+polygons with thousands of vertices stay fast:
+
+  1. cells outside the region's bounding box are dropped with array comparisons,
+  2. the box is cut into about PREFILTER_BLOCKS x PREFILTER_BLOCKS blocks and every block
+     is tested against the prepared region at once: blocks inside it keep all their cells,
+     blocks that miss it drop theirs,
+  3. only cells in blocks crossing the boundary go through shapely's vectorized contains_xy.
+
+Statistics are area-weighted (cells shrink with cos(latitude)).
+"""
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+from habitat_grid import ACTIVITY_CLASSES
+from ocean_utils import KM_PER_DEG
+
+REGION_RESOLUTION = float(os.getenv("REGION_RESOLUTION", "0.5"))
+# Finest resolution a request may ask for: every month's surface is loaded at it
+REGION_MIN_RESOLUTION = float(os.getenv("REGION_MIN_RESOLUTION", "0.25"))
+PREFILTER_BLOCKS = 32
+# Presence probability above which a cell counts as habitat (the model's own label cut)
+HABITAT_THRESHOLD = 0.5
+
+
+def parse_region(geojson: Dict[str, Any]):
+    """Prepared (multi)polygon of a GeoJSON geometry, Feature or FeatureCollection."""
+    if not isinstance(geojson, dict) or "type" not in geojson:
+        raise ValueError("Expected a GeoJSON object")
+    if geojson["type"] == "FeatureCollection":
+        geometries = [f.get("geometry") for f in geojson.get("features") or []]
+    elif geojson["type"] == "Feature":
+        geometries = [geojson.get("geometry")]
+    else:
+        geometries = [geojson]
+    parts = []
+    for geometry in geometries:
+        try:
+            geom = shape(geometry)
+        except Exception as e:
+            raise ValueError(f"Invalid GeoJSON geometry: {e}")
+        if not geom.is_valid:
+            geom = shapely.make_valid(geom)
+        polygons = [g for g in shapely.get_parts(geom) if g.geom_type in ("Polygon", "MultiPolygon")]
+        if not polygons:
+            raise ValueError(f"Only Polygon and MultiPolygon regions are supported, got {geom.geom_type}")
+        parts.extend(polygons)
+    if not parts:
+        raise ValueError("The region has no polygons")
+    region = shapely.union_all(parts)
+    if region.is_empty:
+        raise ValueError("The region is empty")
+    minx, miny, maxx, maxy = region.bounds
+    if minx < -180 or maxx > 180 or miny < -90 or maxy > 90:
+        raise ValueError("Region coordinates must be lng in -180..180 and lat in -90..90")
+    shapely.prepare(region)
+    return region
+
+
+def region_mask(region, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Boolean mask of the points inside a prepared region."""
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    minx, miny, maxx, maxy = region.bounds
+    mask = np.zeros(lats.shape, dtype=bool)
+    candidates = np.nonzero((lats >= miny) & (lats <= maxy) & (lons >= minx) & (lons <= maxx))[0]
+    if not len(candidates):
+        return mask
+    x, y = lons[candidates], lats[candidates]
+
+    size = max(maxx - minx, maxy - miny) / PREFILTER_BLOCKS or 1.0
+    bx = np.floor((x - minx) / size).astype(np.int64)
+    by = np.floor((y - miny) / size).astype(np.int64)
+    blocks, block_of = np.unique(by * (PREFILTER_BLOCKS + 1) + bx, return_inverse=True)
+    x0 = minx + (blocks % (PREFILTER_BLOCKS + 1)) * size
+    y0 = miny + (blocks // (PREFILTER_BLOCKS + 1)) * size
+    boxes = shapely.box(x0, y0, x0 + size, y0 + size)
+    inside = shapely.contains(region, boxes)[block_of]
+    boundary = ~inside & shapely.intersects(region, boxes)[block_of]
+
+    hits = inside.copy()
+    hits[boundary] = shapely.contains_xy(region, x[boundary], y[boundary])
+    mask[candidates[hits]] = True
+    return mask
+
+
+def cell_area_km2(lats: np.ndarray, resolution: float) -> np.ndarray:
+    return (resolution * KM_PER_DEG) ** 2 * np.cos(np.radians(lats))
+
+
+def _mean(values: np.ndarray, weights: np.ndarray) -> Optional[float]:
+    ok = ~np.isnan(values)
+    if not ok.any():
+        return None
+    return float(np.average(values[ok], weights=weights[ok]))
+
+
+def region_summary(region, surfaces: Dict[int, pd.DataFrame], behaviour: Optional[pd.DataFrame],
+                   resolution: float, threshold: float = HABITAT_THRESHOLD, top: int = 10) -> Dict[str, Any]:
+    """
+    Habitat fraction and mean presence probability per month, the top cells by mean
+    probability over those months, and the behaviour class mix of the region's cells.
+    """
+    months: List[Dict[str, Any]] = []
+    inside_cells = []
+    cells, ocean_area = 0, 0.0
+    grid = None
+    for month, surface in sorted(surfaces.items()):
+        lats, lons = surface["lat"].to_numpy(dtype=float), surface["lng"].to_numpy(dtype=float)
+        # Months share the grid; only select the cells again if this one differs
+        if grid is None or not (np.array_equal(grid[0], lats) and np.array_equal(grid[1], lons)):
+            grid, mask = (lats, lons), region_mask(region, lats, lons)
+        probs = surface["probability"].to_numpy(dtype=float)[mask]
+        area = cell_area_km2(lats[mask], resolution)
+        cells, ocean_area = int(mask.sum()), float(area.sum())
+        habitat_area = float(area[probs >= threshold].sum())
+        months.append({
+            "month": month,
+            "mean_probability": _mean(probs, area),
+            "habitat_fraction": habitat_area / ocean_area if ocean_area else None,
+            "habitat_area_km2": round(habitat_area, 1),
+        })
+        inside_cells.append(pd.DataFrame({"lat": lats[mask], "lng": lons[mask], "probability": probs}))
+
+    top_cells: List[Dict[str, Any]] = []
+    if inside_cells and cells:
+        frame = pd.concat(inside_cells)
+        frame["months_suitable"] = frame["probability"] >= threshold
+        stats = frame.groupby(["lat", "lng"]).agg({"probability": "mean", "months_suitable": "sum"})
+        for (lat, lng), row in stats.nlargest(top, "probability").iterrows():
+            top_cells.append({"lat": float(lat), "lng": float(lng), "probability": round(float(row["probability"]), 4),
+                              "months_suitable": int(row["months_suitable"])})
+
+    result = {
+        "resolution": resolution,
+        "threshold": threshold,
+        "cells": cells,
+        "ocean_area_km2": round(ocean_area, 1),
+        "months": months,
+        "top_cells": top_cells,
+    }
+    if behaviour is not None:
+        result["behaviour"] = _behaviour_summary(region, behaviour, resolution)
+    return result
+
+
+def _behaviour_summary(region, layer: pd.DataFrame, resolution: float) -> Dict[str, Any]:
+    from behaviour import PROBABILITY_COLUMNS
+
+    mask = region_mask(region, layer["lat"].to_numpy(), layer["lng"].to_numpy())
+    probs = layer[PROBABILITY_COLUMNS].to_numpy(dtype=float)[mask]
+    area = cell_area_km2(layer["lat"].to_numpy(dtype=float)[mask], resolution)
+    if not mask.any():
+        return {"classes": ACTIVITY_CLASSES, "mean_probabilities": None, "dominant_fraction": None}
+    dominant = probs.argmax(axis=1)
+    return {
+        "classes": ACTIVITY_CLASSES,
+        "mean_probabilities": [round(float(p), 4) for p in np.average(probs, axis=0, weights=area)],
+        "dominant_fraction": {name: round(float(area[dominant == i].sum() / area.sum()), 4)
+                              for i, name in enumerate(ACTIVITY_CLASSES)},
+    }
+
+
+def summarize(geojson: Dict[str, Any], months: Iterable[int], resolution: float = REGION_RESOLUTION,
+              threshold: float = HABITAT_THRESHOLD, top: int = 10) -> Dict[str, Any]:
+    """Region summary from the habitat store and behaviour layer (computed and stored on first use)."""
+    from behaviour import get_layer
+    from precompute_habitats import load_month
+
+    region = parse_region(geojson)
+    surfaces = {month: load_month(resolution, month) for month in months}
+    return region_summary(region, surfaces, get_layer(resolution), resolution, threshold, top)
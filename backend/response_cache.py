@@ -0,0 +1,305 @@
+"""
+Response cache for the prediction endpoints.
+
+Keys are built from the endpoint name, its parameters, the content hash of every model
+it depends on, the month and that month's reference data version (lineage.py), so a
+retrained model, updated reference data or a new month never serves stale results. Bodies are stored as the exact JSON bytes sent to the client; their hash is the
+ETag, and a matching If-None-Match gets a 304. Concurrent misses for one key share a
+single computation. Serialization and disk backend I/O run on the inference pool (offload.py),
+not on the event loop.
+
+Endpoints with a point table also answer in the binary formats of wire.py when the Accept
+header asks for one. Those bodies are cached gzipped under their own key and sent with
+Content-Encoding: gzip, so a hit costs neither encoding nor compression. Clients that do
+not accept gzip get the decompressed body under its own ETag.
+
+Backends (RESPONSE_CACHE_BACKEND):
+    memory  per-process LRU with TTL (default)
+    disk    shared directory (RESPONSE_CACHE_DIR) so several uvicorn workers share results
+    off     no caching
+"""
+import asyncio
+import datetime
+import gzip
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from lineage import data_version
+from metrics import span
+from model_registry import registry
+from offload import ClientDisconnected, executor
+from wire import Table, encode, negotiate
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "256"))
+CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", os.path.join(BACKEND_DIR, "data", "response_cache"))
+# List items per json.dumps call when serializing a large payload
+DUMPS_CHUNK = 10000
+
+
+def _dumps(obj: Any) -> str:
+    """
+    json.dumps(obj) with FastAPI's JSONResponse options, encoding long lists a slice at a
+    time: one C-level json.dumps holds the GIL throughout, which stalls the event loop for
+    seconds on a global grid even from a pool thread.
+    """
+    if isinstance(obj, dict) and all(isinstance(k, str) for k in obj):
+        return "{" + ",".join(f"{_dumps(k)}:{_dumps(v)}" for k, v in obj.items()) + "}"
+    if isinstance(obj, list) and len(obj) > DUMPS_CHUNK:
+        return "[" + ",".join(_dumps(obj[i:i + DUMPS_CHUNK])[1:-1] for i in range(0, len(obj), DUMPS_CHUNK)) + "]"
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class MemoryBackend:
+    """LRU with per-entry TTL."""
+
+    def __init__(self, ttl_s: float = CACHE_TTL_S, max_items: int = CACHE_MAX_ITEMS):
+        self.ttl_s = ttl_s
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Tuple[float, bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, body, etag = item
+            if expires_at < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return body, etag
+
+    def set(self, key: str, body: bytes, etag: str) -> None:
+        with self._lock:
+            self._items[key] = (time.time() + self.ttl_s, body, etag)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class DiskBackend:
+    """One file per key in a shared directory; TTL from mtime, oldest files evicted past max_items."""
+
+    # Lookups and stores touch files, so they run on the pool (see ResponseCache)
+    blocking = True
+
+    def __init__(self, root: str = CACHE_DIR, ttl_s: float = CACHE_TTL_S, max_items: int = CACHE_MAX_ITEMS):
+        self.root = root
+        self.ttl_s = ttl_s
+        self.max_items = max_items
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl_s < time.time():
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        return body, _etag(body)
+
+    def set(self, key: str, body: bytes, etag: str) -> None:
+        path = self._path(key)
+        # Unique per writer: threads and workers storing the same key must not share it
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = [e for e in os.scandir(self.root) if e.name.endswith(".json")]
+        if len(entries) <= self.max_items:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for e in entries[:len(entries) - self.max_items]:
+            try:
+                os.remove(e.path)
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        for e in os.scandir(self.root):
+            if e.name.endswith(".json"):
+                os.remove(e.path)
+
+    def __len__(self) -> int:
+        return sum(1 for e in os.scandir(self.root) if e.name.endswith(".json"))
+
+
+def _make_backend(name: str):
+    if name == "disk":
+        return DiskBackend()
+    if name == "off":
+        return None
+    return MemoryBackend()
+
+
+class ResponseCache:
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.not_modified = 0
+        # Computations in flight per key, awaited by every concurrent miss
+        self._inflight: Dict[str, "asyncio.Task"] = {}
+
+    def make_key(self, endpoint: str, params: Dict[str, Any], models: Iterable[str] = (),
+                 month: Optional[int] = None) -> str:
+        if month is None:
+            month = datetime.datetime.now().month
+        material = {
+            "endpoint": endpoint,
+            "params": jsonable_encoder(params),
+            "models": {name: registry.version(name) for name in models},
+            "month": month,
+            "data": data_version(month),
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Union[Any, Awaitable[Any]]],
+                             encode_body: Optional[Callable[[Any], bytes]] = None,
+                             store: bool = True) -> Tuple[bytes, str]:
+        """
+        Cached (body, etag) for key, computing the body (JSON by default) on a miss. Misses
+        that arrive while the key is being computed wait for that result. store=False
+        computes a fresh body without reading or writing the cache.
+        """
+        if not store:
+            return await self._compute(key, compute, encode_body, store)
+        if self.backend is not None:
+            cached = await self._backend_call(self.backend.get, key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+        while True:
+            task = self._inflight.get(key)
+            leader = task is None
+            if leader:
+                self.misses += 1
+                # A task, so the computation outlives a leader whose request is cancelled
+                task = asyncio.ensure_future(self._compute(key, compute, encode_body, store))
+                self._inflight[key] = task
+                task.add_done_callback(lambda t: self._finished(key, t))
+            else:
+                self.coalesced += 1
+            try:
+                return await asyncio.shield(task)
+            except ClientDisconnected:
+                if leader:
+                    raise
+                # The leader's client left before its job started; compute for this one
+
+    def _finished(self, key: str, task: "asyncio.Task") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def _backend_call(self, fn: Callable[..., Any], *args) -> Any:
+        if getattr(self.backend, "blocking", False):
+            return await executor.call(fn, *args)
+        return fn(*args)
+
+    async def _compute(self, key: str, compute: Callable[[], Union[Any, Awaitable[Any]]],
+                       encode_body: Optional[Callable[[Any], bytes]], store: bool) -> Tuple[bytes, str]:
+        result = compute()
+        if inspect.isawaitable(result):
+            result = await result
+
+        def encode_and_store() -> Tuple[bytes, str]:
+            with span("serialize"):
+                if encode_body is not None:
+                    body = encode_body(result)
+                else:
+                    # Same encoding as FastAPI's default JSONResponse
+                    body = _dumps(jsonable_encoder(result)).encode("utf-8")
+            etag = _etag(body)
+            if store and self.backend is not None:
+                self.backend.set(key, body, etag)
+            return body, etag
+
+        # A large grid takes seconds to serialize; keep that off the event loop
+        return await executor.call(encode_and_store)
+
+    async def respond(self, request: Request, endpoint: str, params: Dict[str, Any],
+                      compute: Callable[[], Union[Any, Awaitable[Any]]], models: Iterable[str] = (),
+                      month: Optional[int] = None, table: Optional[Table] = None,
+                      compute_columns: Optional[Callable[[], Union[Any, Awaitable[Any]]]] = None,
+                      cache: bool = True) -> Response:
+        """
+        Response for an endpoint with ETag / If-None-Match handling: JSON, or with a table
+        and a binary Accept, that table as columns (compute_columns may build the payload
+        with the table already as a dict of arrays; it defaults to compute). cache=False is
+        for results that differ on every call, such as unseeded random sampling.
+        """
+        media_type = negotiate(request.headers.get("accept", "")) if table is not None else None
+        key = self.make_key(endpoint, params, models, month)
+        if media_type is None:
+            body, etag = await self.get_or_compute(key, compute, store=cache)
+        else:
+            body, etag = await self.get_or_compute(f"{key}-{media_type.rsplit('.', 1)[-1]}",
+                                                   compute_columns or compute,
+                                                   lambda result: encode(result, table, media_type), cache)
+        gzipped = media_type is not None and "gzip" in request.headers.get("accept-encoding", "")
+        if media_type is not None and not gzipped:
+            # The identity body is another representation and needs its own validator
+            etag = etag[:-1] + '-identity"'
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+        if table is not None:
+            headers["Vary"] = "Accept, Accept-Encoding"
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        if media_type is None:
+            return Response(content=body, media_type="application/json", headers=headers)
+        # Stored gzipped; only clients that do not take gzip pay for decompressing
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = await executor.call(gzip.decompress, body)
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "items": len(self.backend) if self.backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "not_modified": self.not_modified,
+        }
+
+
+response_cache = ResponseCache(_make_backend(CACHE_BACKEND))
@@ -0,0 +1,180 @@
+"""
+Multi-worker launcher that shares the loaded models and reference data between workers.
+
+    python serve.py --workers 4 --port 8000
+
+`uvicorn server:app --workers N` starts every worker as a fresh interpreter, so each one
+unpickles the models, builds the reference index and loads the 1 GB land mask again. This
+launcher loads all of that once in a parent process, binds the listening socket, then
+forks the workers: they inherit the parent's memory copy-on-write and only pay for what
+they write (request state, caches). The reference store and land raster are memory-mapped
+files, which the OS page cache shares anyway.
+
+The parent restarts workers that exit, first failing the background jobs they were running
+(see jobs.py), and logs each worker's memory (RSS, PSS, shared,
+private from /proc) every --report-interval seconds, also writing it to
+data/workers.json. PSS splits shared pages between the processes mapping them, so the
+sum of PSS is the host's real footprint. /metrics is not aggregated: a scrape reports the
+worker that served it. Requires fork (Linux/macOS); elsewhere it runs
+a single uvicorn process.
+"""
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKERS_REPORT_PATH = os.getenv("WORKERS_REPORT_PATH", os.path.join(BACKEND_DIR, "data", "workers.json"))
+
+
+def preload() -> None:
+    """Load everything read-only that the workers would otherwise load on their own."""
+    import feature_cube
+    import land_raster
+    import ocean_utils
+    from model_registry import registry
+
+    start = time.perf_counter()
+    registry.preload()
+    ocean_utils._load_reference_index()
+    land_raster.get_raster()
+    feature_cube.get_cube()
+    # Predictors are built lazily in the workers: their parity check runs inference, and
+    # XGBoost's OpenMP threads must not be started before fork.
+    print(f"Preloaded models and reference data in {time.perf_counter() - start:.1f}s")
+
+
+def bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, args) -> None:
+    import uvicorn
+
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def memory_report(pids: Dict[int, int]) -> List[Dict[str, int]]:
+    from metrics import process_memory
+
+    report = [{"worker": -1, "pid": os.getpid(), **process_memory()}]
+    report += [{"worker": worker, "pid": pid, **process_memory(pid)} for pid, worker in sorted(pids.items(), key=lambda p: p[1])]
+    return report
+
+
+def _write_report(report: List[Dict[str, int]]) -> None:
+    os.makedirs(os.path.dirname(WORKERS_REPORT_PATH), exist_ok=True)
+    tmp = f"{WORKERS_REPORT_PATH}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"timestamp": time.time(), "processes": report}, f, indent=2)
+    os.replace(tmp, WORKERS_REPORT_PATH)
+
+
+def _print_report(report: List[Dict[str, int]]) -> None:
+    mb = lambda value: f"{value / 2**20:8.1f}"  # noqa: E731
+    total_pss = 0
+    for p in report:
+        name = "parent" if p["worker"] < 0 else f"worker {p['worker']}"
+        total_pss += p.get("pss", 0)
+        print(f"{name:<10} pid {p['pid']:>7}  rss {mb(p.get('rss', 0))} MB  pss {mb(p.get('pss', 0))} MB  "
+              f"shared {mb(p.get('shared', 0))} MB  private {mb(p.get('private', 0))} MB")
+    print(f"total pss {total_pss / 2**20:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with N forked workers sharing preloaded data")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--report-interval", type=float, default=60.0, help="seconds between memory reports (0 = off)")
+    parser.add_argument("--keep-alive", type=int, default=5, help="HTTP keep-alive timeout in seconds")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    # Interrupted jobs are recovered once here rather than by every worker
+    os.environ["JOB_RECOVERY"] = "0"
+    import server
+    from jobs import jobs
+
+    preload()
+    jobs.recover()
+    jobs.close()
+    sock = bind(args.host, args.port)
+
+    if not hasattr(os, "fork"):
+        print("fork is not available; running a single worker")
+        run_worker(server.app, sock, args)
+        return
+
+    # Objects loaded so far are never collected; keep the collector from writing to their pages
+    gc.collect()
+    gc.freeze()
+
+    pids: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(worker: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(server.app, sock, args)
+            finally:
+                os._exit(0)
+        pids[pid] = worker
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in range(args.workers):
+        spawn(worker)
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers (parent pid {os.getpid()})")
+
+    next_report = time.monotonic() + min(args.report_interval, 10.0) if args.report_interval > 0 else None
+    while pids:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            worker = pids.pop(pid, None)
+            if worker is not None and not stopping:
+                print(f"Worker {worker} (pid {pid}) exited with status {status}; restarting")
+                # Its queued and running jobs died with it; the connection is closed before forking
+                jobs.recover(pid)
+                jobs.close()
+                spawn(worker)
+            continue
+        if next_report is not None and time.monotonic() >= next_report and not stopping:
+            report = memory_report(pids)
+            _print_report(report)
+            _write_report(report)
+            next_report = time.monotonic() + args.report_interval
+        time.sleep(0.5)
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -31,26 +31,47 @@ os.environ["COPERNICUSMARINE_SERVICE_PASSWORD"] = "qK6d~qDbsW)ases"
 
 
 
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Tuple
 import random
 import datetime
+import time
 import pandas as pd
-import joblib
 from presence import predict
+from model_registry import PRELOAD, get_model, registry
 
 import asyncio
-from geopy.distance import geodesic
-from geopy.point import Point
 import xarray as xr
 import numpy as np
-from shapely.geometry import Point as ShapelyPoint
-from shapely.geometry.polygon import Polygon
 
-from global_land_mask import globe
-from ocean_utils import get_nearest_csv_features, get_bathymetry
+from land_raster import is_land
+from habitat_grid import (
+    DEFAULT_RESOLUTION, GLOBAL_BANDED_MIN_RESOLUTION, GLOBAL_MIN_RESOLUTION, PRESENCE_FEATURES, band_count,
+    build_grid_features, grid_bands, predict_grid, score_presence, stream_bands, summarize_surface, surface_bands,
+    surface_frame, uncertainty_column,
+)
+from precompute_habitats import read_month, write_month
+from migration import MAX_SAMPLES_PER_BASE, best_candidates
+from behaviour import behaviour_payload, get_layer
+from regions import HABITAT_THRESHOLD, REGION_MIN_RESOLUTION, REGION_RESOLUTION, summarize as summarize_region
+from corridors import CORRIDOR_RESOLUTION, CORRIDOR_WEIGHT, corridors, site_pairs
+from sightings import sightings as sighting_clusters
+from response_cache import response_cache
+from wire import Table
+from batch_predict import (
+    ARROW_STREAM, NDJSON, BatchInputError, BatchTooLargeError, parse_points, score_chunks, stream_arrow, stream_ndjson,
+)
+from tiles import FORMATS, LAYERS, MAX_ZOOM, get_tile, tile_etag
+from offload import executor
+from jobs import JobError, jobs
+from fast_predict import feature_matrix, get_predictor
+from metrics import SERVER_TIMING, inc, metrics, process_memory, server_timing, span
+from tiles import tile_cache
+from uncertainty import UncertaintyError, add_uncertainty, check_method
 import numpy as np
 
 def _wrap_lon(lon: float) -> float:
@@ -72,47 +93,20 @@ def is_ocean_location(latitude, longitude):
     Returns:
         bool: True if the point is over the ocean, False if it's over land.
     """
-    # Normalize longitude for globe.is_land to avoid ValueError for > 180
+    # Normalize longitude to [-180, 180] (global_land_mask raises beyond it)
     lon_norm = _wrap_lon(float(longitude))
     lat_norm = float(latitude)
-    return not globe.is_land(lat_norm, lon_norm)
+    return not bool(is_land(lat_norm, lon_norm))
 
-async def generate_grid_points():
+async def generate_grid_points(resolution: float = DEFAULT_RESOLUTION):
     """
     Generate a grid of points between Arctic and Antarctic circles.
     Arctic Circle: 66.5°N
     Antarctic Circle: 66.5°S
     """
-    lat_step = 2  # 2 degree steps for latitude
-    lon_step = 2  # 2 degree steps for longitude
-    
-    # Generate points
-    lats = np.arange(-66.5, 66.5, lat_step)
-    lons = np.arange(-180, 180, lon_step)
-    
-    points = []
-    for lat in lats:
-        for lon in lons:
-            if is_ocean_location(lat, lon):
-                try:
-                    # Use nearest CSV features for model inputs
-                    feats = get_nearest_csv_features(lat, lon)
-                    # Bathymetry in model is expected negative; our helper returns positive meters
-                    bathy_pos_m = get_bathymetry(lat, lon)
-                    points.append({
-                        "decimalLatitude": lat,
-                        "decimalLongitude": lon,
-                        "month": datetime.datetime.now().month,
-                        "bathymetry": -abs(bathy_pos_m),
-                        "sst": feats.get("sst", np.nan),
-                        "sss": feats.get("sss", np.nan),
-                        "shoredistance": feats.get("shoredistance", np.nan)
-                    })
-                except Exception as e:
-                    print(f"Error getting CSV-derived data for {lat}, {lon}: {str(e)}")
-                    continue
-    
-    return points
+    # The whole mesh is built, land-masked and feature-joined as arrays
+    features = build_grid_features(resolution)
+    return features.to_dict(orient="records")
 
 
 # API Configuration
@@ -185,7 +179,66 @@ class TestCase2(BaseModel):
 # Initialize the predictor
 # LOADED_MODEL = SimulatedHabitatPredictor()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the model registry so the first request does not pay for unpickling
+    if PRELOAD:
+        registry.preload()
+    # With serve.py the parent process recovers jobs once, before forking workers
+    if os.getenv("JOB_RECOVERY", "1") != "0":
+        jobs.recover()
+    yield
+    executor.shutdown()
+    jobs.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def instrumentRequests(request: Request, call_next):
+    """Request count/latency per route, and the Server-Timing header when SERVER_TIMING=1."""
+    timings, token = metrics.begin_request()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.end_request(token)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    metrics.observe("sharkapi_request_duration_seconds", elapsed, route=path, method=request.method)
+    metrics.inc("sharkapi_requests_total", route=path, method=request.method, status=response.status_code)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(timings, elapsed)
+    return response
+
+def _component_stats():
+    """Cache, executor and model statistics for /metrics."""
+    for name, value in response_cache.stats().items():
+        if isinstance(value, (int, float)) and name != "items":
+            yield ("sharkapi_response_cache_events_total", "counter", "Response cache lookups by outcome.",
+                   {"event": name}, value)
+    yield ("sharkapi_response_cache_items", "gauge", "Entries in the response cache.", {},
+           response_cache.stats()["items"])
+    tiles = tile_cache.stats()
+    for event in ("hits", "disk_hits", "misses"):
+        yield ("sharkapi_tile_cache_events_total", "counter", "Tile cache lookups by outcome.",
+               {"event": event}, tiles[event])
+    for endpoint, stats in executor.stats()["endpoints"].items():
+        for state in ("running", "waiting"):
+            yield ("sharkapi_executor_jobs", "gauge", "Executor jobs per endpoint and state.",
+                   {"endpoint": endpoint, "state": state}, stats[state])
+        for outcome in ("completed", "rejected", "cancelled"):
+            yield ("sharkapi_executor_finished_total", "counter", "Executor jobs per endpoint and outcome.",
+                   {"endpoint": endpoint, "outcome": outcome}, stats[outcome])
+    for kind, value in process_memory().items():
+        yield ("sharkapi_process_memory_bytes", "gauge", "Memory of this worker process (rss, pss, shared, private).",
+               {"kind": kind, "pid": os.getpid()}, value)
+    for name, info in registry.metrics().items():
+        yield ("sharkapi_model_loads_total", "counter", "Model file loads.", {"model": name}, info["loads"])
+        yield ("sharkapi_model_load_seconds", "gauge", "Time of the last model load.", {"model": name},
+               info["load_time_s"])
+
+metrics.register_collector(_component_stats)
 
 # Configure CORS
 app.add_middleware(
@@ -302,6 +355,98 @@ def getData():
     
     return data
 
+@app.get("/sightings")
+def sightingClusters(west: float = -180.0, south: float = -90.0, east: float = 180.0, north: float = 90.0,
+                     zoom: int = 2, months: Optional[List[int]] = Query(None),
+                     start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Real occurrence records aggregated for a map viewport: one {lat, lng, count} cluster per
+    64 px bin at the zoom level (west > east for a viewport across the antimeridian).
+    months filters calendar months, start/end an eventDate range (YYYY, YYYY-MM or YYYY-MM-DD).
+    Queries touch only the viewport's rows of a precomputed pyramid (see sightings.py), so
+    they are not response-cached.
+    """
+    try:
+        return sighting_clusters((west, south, east, north), zoom, months, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/metrics")
+def prometheusMetrics():
+    """
+    Prometheus text-format metrics: request latency, stage timings, counters and cache stats.
+    Under serve.py these are the serving worker's own numbers, not the whole server's.
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/models")
+def modelStatus():
+    """Load-time, memory and version metrics for the cached models."""
+    return registry.metrics()
+
+@app.get("/tiles/{layer}/{z}/{x}/{y}")
+async def habitatTile(request: Request, layer: str, z: int, x: int, y: str, month: Optional[int] = None):
+    """
+    Habitat probability tile (slippy-map z/x/y) for the presence or activity model.
+    y may carry an extension: .png (default) or .f32 for a raw float32 grid.
+    Rendered on first request, then served from the tile cache.
+    """
+    y_str, _, fmt = y.partition(".")
+    fmt = fmt or "png"
+    if layer not in LAYERS:
+        raise HTTPException(status_code=404, detail=f"Unknown layer '{layer}'")
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported tile format '{fmt}'")
+    try:
+        y_idx = int(y_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Tile y must be an integer")
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y_idx < 2 ** z):
+        raise HTTPException(status_code=400, detail="Tile coordinates out of range")
+    if month is None:
+        month = datetime.datetime.now().month
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="month must be in 1..12")
+    # The URL has no version: clients revalidate, and a hot reload or lineage run changes the ETag
+    headers = {"ETag": tile_etag(layer, month), "Cache-Control": "public, no-cache"}
+    if headers["ETag"] in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    body = await executor.run("tiles", request, get_tile, layer, z, x, y_idx, month, fmt)
+    return Response(content=body, media_type=FORMATS[fmt], headers=headers)
+
+async def _batch_predict(layer: str, request: Request, month: Optional[int]):
+    if month is not None and not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="month must be in 1..12")
+    try:
+        df = await executor.run("batch", request, parse_points, await request.body(),
+                                request.headers.get("content-type", "application/json"))
+    except BatchTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BatchInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # month fills points that do not carry their own
+    chunks = score_chunks(layer, df, month)
+    slot = await executor.acquire("batch", request)
+    if ARROW_STREAM in request.headers.get("accept", ""):
+        return StreamingResponse(executor.stream("batch", request, stream_arrow(chunks), slot),
+                                 media_type=ARROW_STREAM)
+    return StreamingResponse(executor.stream("batch", request, stream_ndjson(chunks), slot), media_type=NDJSON)
+
+@app.post("/predict/presence/batch")
+async def presenceBatch(request: Request, month: Optional[int] = None):
+    """
+    Score arbitrary points with the presence model.
+    Body: JSON array of {lat, lng, [month, bathymetry, sst, sss, shoredistance, id]}, an Arrow
+    IPC stream or a Parquet file. Missing features are filled in. Streams NDJSON rows
+    (or Arrow record batches with Accept: application/vnd.apache.arrow.stream).
+    """
+    return await _batch_predict("presence", request, month)
+
+@app.post("/predict/activity/batch")
+async def activityBatch(request: Request, month: Optional[int] = None):
+    """Score arbitrary points with the activity model (per-class probabilities p_migrating, p_resting, p_eating). Same input as presence."""
+    return await _batch_predict("activity", request, month)
+
 class LocationData(BaseModel):
     lat: float
     lng: float
@@ -352,8 +497,7 @@ class LocationData(BaseModel):
 #     possible_habitat_count: int
 #     results: List[PredictionResult]
 
-@app.post("/predictionSighting")
-async def predictSighting2():
+def _predict_sightings():
     """
     Run whale shark habitat predictions on predefined test cases.
     Returns only the locations where whale sharks might be present.
@@ -496,32 +640,31 @@ async def predictSighting2():
 
     # Check is_ocean first, then predict only for those
     ocean_cases = []
-    for case in test_cases:
-        lon = _wrap_lon(case.decimalLongitude)
-        if is_ocean_location(case.decimalLatitude, lon):
-            ocean_cases.append((case, lon))
+    with span("land_mask"):
+        for case in test_cases:
+            lon = _wrap_lon(case.decimalLongitude)
+            if is_ocean_location(case.decimalLatitude, lon):
+                ocean_cases.append((case, lon))
+    inc("sharkapi_land_filtered_points_total", len(test_cases) - len(ocean_cases))
 
     # Early return if nothing to predict
     if not ocean_cases:
         return []
 
-    # Build DataFrame only for ocean points (keep column order expected by the model)
-    df_ocean = pd.DataFrame([
-        {
-            "decimalLatitude": case.decimalLatitude,
-            "decimalLongitude": lon,
-            "month": case.month,
-            "bathymetry": case.bathymetry,
-            "sst": case.sst,
-            "sss": case.sss,
-            "shoredistance": case.shoredistance,
-        }
-        for case, lon in ocean_cases
-    ])
-
-    # Load model and make predictions only for ocean points
-    model = joblib.load("./presence_model.pkl")
-    predictions = model.predict(df_ocean)
+    # Feature matrix only for ocean points, in the column order expected by the model
+    X = feature_matrix({
+        "decimalLatitude": [case.decimalLatitude for case, _ in ocean_cases],
+        "decimalLongitude": [lon for _, lon in ocean_cases],
+        "month": [case.month for case, _ in ocean_cases],
+        "bathymetry": [case.bathymetry for case, _ in ocean_cases],
+        "sst": [case.sst for case, _ in ocean_cases],
+        "sss": [case.sss for case, _ in ocean_cases],
+        "shoredistance": [case.shoredistance for case, _ in ocean_cases],
+    }, PRESENCE_FEATURES)
+
+    # Predictions only for ocean points, on the compiled fast path
+    with span("inference"):
+        predictions = get_predictor("presence").predict(X)
 
     # Collect only positive predictions
     possible_habitats = []
@@ -550,8 +693,16 @@ async def predictSighting2():
     # Return activity results along with availability demo data
     return {"activity": possible_habitats}
 
-@app.post("/sharkActivity")
-async def sharkAct():
+@app.post("/predictionSighting")
+async def predictSighting2(request: Request):
+    """Habitat predictions for the predefined test cases (cached per model version and month)."""
+    return await response_cache.respond(
+        request, "predictionSighting", {},
+        lambda: executor.run("predictionSighting", request, _predict_sightings), models=("presence",),
+        table=Table(["activity"]),
+    )
+
+def _shark_activity():
     """
     Run whale shark habitat predictions on predefined test cases.
     Returns only the locations where whale sharks might be present.
@@ -621,30 +772,25 @@ async def sharkAct():
 
     # Check is_ocean first, then predict only for those
     ocean_cases = []
-    for case in test_cases:
-        lon = _wrap_lon(case.decimalLongitude)
-        if is_ocean_location(case.decimalLatitude, lon):
-            ocean_cases.append((case, lon))
+    with span("land_mask"):
+        for case in test_cases:
+            lon = _wrap_lon(case.decimalLongitude)
+            if is_ocean_location(case.decimalLatitude, lon):
+                ocean_cases.append((case, lon))
+    inc("sharkapi_land_filtered_points_total", len(test_cases) - len(ocean_cases))
 
     if not ocean_cases:
         return []
 
     # Build data for activity model in the expected order: [depth, lat, lon, shore]
-    X = [
+    X = np.array([
         [case.bathymetry, case.decimalLatitude, lon, case.shoredistance]
         for case, lon in ocean_cases
-    ]
+    ], dtype=np.float32)
 
-    # Load model and make predictions (cache model for speed)
-    global ACTIVITY_MODEL
-    try:
-        ACTIVITY_MODEL
-    except NameError:
-        ACTIVITY_MODEL = None
-    if ACTIVITY_MODEL is None:
-        ACTIVITY_MODEL = joblib.load("./shark_activity.pkl")
-    model = ACTIVITY_MODEL
-    predictions = model.predict(X)
+    # Predictions on the compiled fast path (model cached by the registry)
+    with span("inference"):
+        predictions = get_predictor("activity").predict(X)
     # Return only positives (these are already ocean points)
     possible_habitats = []
     for (case, lon), pred in zip(ocean_cases, predictions):
@@ -673,124 +819,141 @@ async def sharkAct():
     # Return only the array of positive predictions
     return possible_habitats
 
-@app.post("/predictionSighting")
-async def predict_global_habitats():
+@app.post("/sharkActivity")
+async def sharkAct(request: Request):
+    """Activity predictions for the predefined test cases (cached per model version and month)."""
+    return await response_cache.respond(
+        request, "sharkActivity", {},
+        lambda: executor.run("sharkActivity", request, _shark_activity), models=("activity",),
+    )
+
+def _behaviour(resolution: float, threshold: Optional[float]):
+    return behaviour_payload(get_layer(resolution), resolution, threshold)
+
+@app.get("/behaviour")
+async def globalBehaviour(request: Request, resolution: float = DEFAULT_RESOLUTION, threshold: Optional[float] = None):
+    """
+    Activity model behaviour (migrating / resting / eating) for every ocean grid cell, with
+    per-class probabilities. Precomputed per activity model version (see behaviour.py) and cached.
+    """
+    if resolution <= 0:
+        raise HTTPException(status_code=400, detail="resolution must be positive")
+    if threshold is not None and not 0 <= threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold must be in 0..1")
+    return await response_cache.respond(
+        request, "behaviour", {"resolution": resolution, "threshold": threshold},
+        lambda: executor.run("behaviour", request, _behaviour, resolution, threshold),
+        models=("activity",),
+    )
+
+def _stored_surface(resolution: float, month: int, uncertainty: Optional[str]):
+    """
+    Stored surface for the current model, or None. A requested uncertainty column that is
+    not stored yet is computed once for every cell and written back next to the probabilities.
+    """
+    version = registry.version("presence")
+    stored = read_month(resolution, month, version)
+    if stored is not None and uncertainty is not None and uncertainty_column(uncertainty) not in stored:
+        stored = add_uncertainty(stored, month, uncertainty)
+        write_month(stored, resolution, month, version)
+    return stored
+
+def _global_habitats(resolution: float, month: int, threshold: Optional[float], uncertainty: Optional[str] = None,
+                     columnar: bool = False):
     """
     Predict whale shark habitats across the globe between Arctic and Antarctic circles.
     Only returns locations that are:
     1. In the ocean (not on land)
     2. Have suitable oceanographic conditions
-    3. Predicted as suitable by the model
+    3. Predicted as suitable by the model (or probability >= threshold when given)
+    Served from the precomputed monthly store (precompute_habitats.py) when available.
+    With an uncertainty method, each habitat also carries probability_std.
+    columnar returns possible_habitats as arrays, for the binary formats (see wire.py).
     """
     # Load model
-    model = joblib.load("./presence_model.pkl")
-    
-    # Generate grid points and get their ocean parameters
-    grid_points = await generate_grid_points()
-    
-    # Make predictions for all points
-    possible_habitats = []
-    for point in grid_points:
-        try:
-            prediction = model.predict([[
-                point["decimalLatitude"],
-                point["decimalLongitude"],
-                point["month"],
-                point["bathymetry"],
-                point["sst"],
-                point["sss"],
-                point["shoredistance"]
-            ]])[0]
-            
-            if prediction == 1:
-                possible_habitats.append({
-                    "lat": point["decimalLatitude"],
-                    "lng": point["decimalLongitude"],
-                    "bathymetry": point["bathymetry"],
-                    "temperature": point["sst"],
-                    "salinity": point["sss"],
-                    "shoredistance": point["shoredistance"]
-                })
-        except Exception as e:
-            print(f"Error making prediction for {point['decimalLatitude']}, {point['decimalLongitude']}: {str(e)}")
-            continue
-    
-    return {
-        "total_points_checked": len(grid_points),
-        "possible_habitats": possible_habitats,
-        "points_count": len(possible_habitats)
-    }
+    model = get_model("presence")
+
+    stored = _stored_surface(resolution, month, uncertainty)
+    if stored is not None:
+        return summarize_surface(stored, month, threshold, uncertainty, columnar)
+
+    if uncertainty is None:
+        # Build the ocean grid and score every cell in a single batch
+        return predict_grid(model, resolution=resolution, month=month, threshold=threshold, columnar=columnar)
+    features = build_grid_features(resolution, month)
+    _, probs = score_presence(model, features)
+    surface = add_uncertainty(surface_frame(features, probs), month, uncertainty)
+    return summarize_surface(surface, month, threshold, uncertainty, columnar)
+
+def _global_habitat_lines(resolution: float, month: int, threshold: Optional[float],
+                          uncertainty: Optional[str] = None):
+    """NDJSON lines for a streamed global grid; runs on the inference executor one band at a time."""
+    stored = _stored_surface(resolution, month, uncertainty)
+    if stored is not None:
+        bands = surface_bands(stored, resolution)
+    else:
+        bands = grid_bands(get_model("presence"), resolution, month)
+        if uncertainty is not None:
+            bands = ((band, add_uncertainty(surface, month, uncertainty)) for band, surface in bands)
+    yield from stream_bands(bands, month, threshold, uncertainty)
 
-@app.post("/getMigration")
-async def getMigrate():
-    model = joblib.load("./presence_model.pkl")
+# POST /predictionSighting is matched by predictSighting2 above; the global grid is served at /globalHabitats
+@app.get("/globalHabitats")
+@app.post("/predictionSighting")
+async def predict_global_habitats(
+    request: Request,
+    resolution: float = DEFAULT_RESOLUTION,
+    month: Optional[int] = None,
+    threshold: Optional[float] = None,
+    stream: bool = False,
+    uncertainty: Optional[str] = None,
+):
+    """
+    Global habitat grid for a month (see _global_habitats).
+    With stream=true or Accept: application/x-ndjson, results are streamed one latitude band at a time.
+    uncertainty=perturbation|bootstrap adds each habitat's probability_std (see uncertainty.py).
+    Accept: application/vnd.sharkapi.columns (or Arrow) sends possible_habitats as float32 columns (see wire.py).
+    """
+    if month is None:
+        month = datetime.datetime.now().month
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="month must be in 1..12")
+    streamed = stream or NDJSON in request.headers.get("accept", "")
+    if resolution < GLOBAL_BANDED_MIN_RESOLUTION:
+        raise HTTPException(status_code=400, detail=f"resolution must be at least {GLOBAL_BANDED_MIN_RESOLUTION}")
+    if resolution < GLOBAL_MIN_RESOLUTION and not streamed:
+        raise HTTPException(status_code=400, detail=f"resolution below {GLOBAL_MIN_RESOLUTION} is only served "
+                                                    "with stream=true or as a job (POST /jobs)")
+    if uncertainty is not None:
+        try:
+            check_method(uncertainty)
+        except UncertaintyError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if streamed:
+        lines = _global_habitat_lines(resolution, month, threshold, uncertainty)
+        slot = await executor.acquire("globalHabitats", request)
+        return StreamingResponse(executor.stream("globalHabitats", request, lines, slot), media_type=NDJSON)
+    return await response_cache.respond(
+        request, "globalHabitats", {"resolution": resolution, "threshold": threshold, "uncertainty": uncertainty},
+        lambda: executor.run("globalHabitats", request, _global_habitats, resolution, month, threshold, uncertainty),
+        models=("presence",), month=month, table=Table(["possible_habitats"]),
+        compute_columns=lambda: executor.run("globalHabitats", request, _global_habitats, resolution, month,
+                                             threshold, uncertainty, True),
+    )
+
+def _migration(samples_per_base: int, min_km: float, max_km: float, seed: Optional[int], month: int):
+    model = get_model("presence")
     # Build candidate points by using results from predictSighting2 as input sightings
-    base_points = await predictSighting2()
-    # Defaults for sampling
-    month = datetime.datetime.now().month
-    min_km = 30.0
-    max_km = 200.0
-    samples_per_base = 5  # exactly 5 points around each current location
-
-    best_points = []
+    sightings = _predict_sightings()
+    base_points = sightings.get("activity", []) if isinstance(sightings, dict) else sightings
+
     # Use up to 50 base points to keep it fast
-    for s in base_points[:50]:
-        src_lat = float(s.get("lat"))
-        src_lng = _wrap_lon(float(s.get("lng")))
-        src = Point(src_lat, src_lng)
-
-        # Collect up to 5 valid ocean candidates around this source
-        local_candidates = []
-        attempts = 0
-        # Cap attempts to avoid long loops if many land hits
-        while len(local_candidates) < samples_per_base and attempts < samples_per_base * 4:
-            attempts += 1
-            dist_km = random.uniform(min_km, max_km)
-            bearing = random.uniform(0, 360)
-            dest = geodesic(kilometers=dist_km).destination(src, bearing)
-            lat = float(dest.latitude)
-            lon = _wrap_lon(float(dest.longitude))
-
-            # Ocean-only filter
-            if not is_ocean_location(lat, lon):
-                continue
-
-            try:
-                feats = get_nearest_csv_features(lat, lon)
-                bathy_pos_m = get_bathymetry(lat, lon)
-                local_candidates.append({
-                    "decimalLatitude": lat,
-                    "decimalLongitude": lon,
-                    "month": month,
-                    "bathymetry": -abs(bathy_pos_m),
-                    "sst": feats.get("sst", np.nan),
-                    "sss": feats.get("sss", np.nan),
-                    "shoredistance": feats.get("shoredistance", np.nan)
-                })
-            except Exception:
-                continue
-
-        if not local_candidates:
-            continue
-
-        df = pd.DataFrame(local_candidates).dropna()
-        if df.empty:
-            continue
-
-        # Score these 5 (or fewer) points and pick the best
-        try:
-            probs = model.predict_proba(df)[:, 1]
-        except Exception:
-            preds = model.predict(df)
-            probs = np.array(preds, dtype=float)
-
-        idx = int(np.argmax(probs))
-        best_points.append({
-            "lat": float(df.iloc[idx]["decimalLatitude"]),
-            "lng": float(df.iloc[idx]["decimalLongitude"]),
-            "prob": float(probs[idx]),
-            "src": {"lat": src_lat, "lng": src_lng}
-        })
+    base_points = base_points[:50]
+    src_lats = [float(s.get("lat")) for s in base_points]
+    src_lngs = [_wrap_lon(float(s.get("lng"))) for s in base_points]
+
+    # All candidates for all base points are sampled, land-filtered and scored in one batch
+    best_points = best_candidates(model, src_lats, src_lngs, month, samples_per_base, min_km, max_km, seed)
 
     # Return the best candidate around each base point as a heatmap-compatible payload
     points = [
@@ -828,4 +991,204 @@ async def getMigrate():
         }
     }
 
-# Request body no longer needed; input is derived from predictSighting2
\ No newline at end of file
+# Request body no longer needed; input is derived from predictSighting2
+
+@app.post("/getMigration")
+async def getMigrate(
+    request: Request,
+    samples_per_base: int = 5,
+    min_km: float = 30.0,
+    max_km: float = 200.0,
+    seed: Optional[int] = None,
+    month: Optional[int] = None,
+):
+    """
+    Best migration candidate around each predicted hotspot as a heatmap payload (cached when seeded).
+    Accept: application/vnd.sharkapi.columns (or Arrow) sends thermal.points as lat/lng/weight columns.
+    """
+    if not 1 <= samples_per_base <= MAX_SAMPLES_PER_BASE or not 0 <= min_km <= max_km:
+        raise HTTPException(status_code=400, detail=f"Need samples_per_base in 1..{MAX_SAMPLES_PER_BASE} "
+                                                    "and 0 <= min_km <= max_km")
+    if month is None:
+        month = datetime.datetime.now().month
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="month must be in 1..12")
+    params = {"samples_per_base": samples_per_base, "min_km": min_km, "max_km": max_km, "seed": seed}
+    return await response_cache.respond(
+        request, "getMigration", params,
+        lambda: executor.run("getMigration", request, _migration, samples_per_base, min_km, max_km, seed, month),
+        models=("presence",), month=month, table=Table(["thermal", "points"], ["lat", "lng", "weight"]),
+        # Without a seed every call samples new candidates, so there is nothing to reuse
+        cache=seed is not None,
+    )
+
+class CorridorRequest(BaseModel):
+    """Corridor endpoints as [lat, lng]: explicit pairs, or every pair among sites"""
+    pairs: List[Tuple[Tuple[float, float], Tuple[float, float]]] = []
+    sites: List[Tuple[float, float]] = []
+
+@app.post("/corridors")
+async def getCorridors(
+    request: Request,
+    body: CorridorRequest,
+    month: Optional[int] = None,
+    resolution: float = CORRIDOR_RESOLUTION,
+    weight: float = CORRIDOR_WEIGHT,
+):
+    """
+    Least-cost migration corridors between aggregation sites over the month's presence
+    surface (see corridors.py), as /get-style "migration" paths plus per-corridor stats (cached).
+    """
+    if month is None:
+        month = datetime.datetime.now().month
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="month must be in 1..12")
+    pairs = [tuple(p) for p in body.pairs] + site_pairs(body.sites)
+    params = {"pairs": pairs, "resolution": resolution, "weight": weight}
+    try:
+        return await response_cache.respond(
+            request, "corridors", params,
+            lambda: executor.run("corridors", request, corridors, pairs, month, resolution, weight),
+            models=("presence",), month=month,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/region/summary")
+async def regionSummary(
+    request: Request,
+    region: dict = Body(...),
+    months: Optional[List[int]] = Query(None),
+    resolution: float = REGION_RESOLUTION,
+    threshold: float = HABITAT_THRESHOLD,
+    top: int = 10,
+):
+    """
+    Habitat and behaviour statistics inside a GeoJSON Polygon/MultiPolygon (geometry, Feature
+    or FeatureCollection): habitat area fraction and mean probability per month (all 12 by
+    default), the top cells and the behaviour class mix (see regions.py). Cached.
+    """
+    months = sorted(set(months or range(1, 13)))
+    if not all(1 <= m <= 12 for m in months):
+        raise HTTPException(status_code=400, detail="months must be in 1..12")
+    if resolution < REGION_MIN_RESOLUTION or not 0 <= threshold <= 1 or top < 0:
+        raise HTTPException(status_code=400,
+                            detail=f"Need resolution >= {REGION_MIN_RESOLUTION}, threshold in 0..1 and top >= 0")
+    params = {"region": region, "months": months, "resolution": resolution, "threshold": threshold, "top": top}
+    try:
+        return await response_cache.respond(
+            request, "regionSummary", params,
+            lambda: executor.run("regionSummary", request, summarize_region, region, months, resolution, threshold, top),
+            models=("presence", "activity"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _job_month(value) -> int:
+    month = int(value) if value is not None else datetime.datetime.now().month
+    if not 1 <= month <= 12:
+        raise ValueError("month must be in 1..12")
+    return month
+
+def _global_habitats_params(params: dict) -> dict:
+    resolution = float(params.get("resolution", DEFAULT_RESOLUTION))
+    if resolution < GLOBAL_BANDED_MIN_RESOLUTION:
+        raise ValueError(f"resolution must be at least {GLOBAL_BANDED_MIN_RESOLUTION}")
+    threshold = params.get("threshold")
+    uncertainty = params.get("uncertainty")
+    return {
+        "resolution": resolution,
+        "month": _job_month(params.get("month")),
+        "threshold": float(threshold) if threshold is not None else None,
+        "uncertainty": check_method(uncertainty) if uncertainty is not None else None,
+    }
+
+def _global_habitats_job(params: dict, progress) -> dict:
+    """
+    Global grid scored band by band with progress; the surface is also written to the
+    habitat store so /globalHabitats serves it directly afterwards.
+    """
+    resolution, month, uncertainty = params["resolution"], params["month"], params.get("uncertainty")
+    version = registry.version("presence")
+    surface = _stored_surface(resolution, month, uncertainty)
+    if surface is None:
+        n_bands = band_count(resolution)
+        surfaces = []
+        for i, (band, band_surface) in enumerate(grid_bands(get_model("presence"), resolution, month)):
+            if uncertainty is not None:
+                band_surface = add_uncertainty(band_surface.astype(np.float32), month, uncertainty)
+            surfaces.append(band_surface)
+            progress((i + 1) / n_bands, f"band {i + 1}/{n_bands} (lat {band[0]:g}..{band[-1]:g})")
+        surface = pd.concat(surfaces, ignore_index=True).astype(np.float32)
+        write_month(surface, resolution, month, version)
+    return summarize_surface(surface, month, params["threshold"], uncertainty)
+
+def _migration_params(params: dict) -> dict:
+    samples_per_base = int(params.get("samples_per_base", 5))
+    min_km = float(params.get("min_km", 30.0))
+    max_km = float(params.get("max_km", 200.0))
+    if not 1 <= samples_per_base <= MAX_SAMPLES_PER_BASE or not 0 <= min_km <= max_km:
+        raise ValueError(f"Need samples_per_base in 1..{MAX_SAMPLES_PER_BASE} and 0 <= min_km <= max_km")
+    seed = params.get("seed")
+    months = params.get("months") or [params.get("month")]
+    return {
+        "samples_per_base": samples_per_base,
+        "min_km": min_km,
+        "max_km": max_km,
+        "seed": int(seed) if seed is not None else None,
+        "months": sorted({_job_month(m) for m in months}),
+    }
+
+def _migration_job(params: dict, progress) -> dict:
+    """/getMigration payload for each requested month."""
+    months = params["months"]
+    results = {}
+    for i, month in enumerate(months):
+        results[str(month)] = _migration(params["samples_per_base"], params["min_km"], params["max_km"],
+                                         params["seed"], month)
+        progress((i + 1) / len(months), f"month {month:02d} ({i + 1}/{len(months)})")
+    return {"months": results}
+
+jobs.register("globalHabitats", _global_habitats_job, _global_habitats_params, models=("presence",))
+jobs.register("migration", _migration_job, _migration_params, models=("presence",))
+
+class JobRequest(BaseModel):
+    kind: str
+    params: dict = {}
+
+def _job_status(job: dict) -> dict:
+    return {**job, "result_url": f"/jobs/{job['id']}/result" if job["status"] == "done" else None}
+
+@app.post("/jobs", status_code=202)
+def submitJob(body: JobRequest):
+    """
+    Queue a long-running computation: kind "globalHabitats" (resolution, month, threshold)
+    or "migration" (samples_per_base, min_km, max_km, seed, months). An identical queued,
+    running or finished job is returned instead of starting a new one.
+    """
+    try:
+        job = jobs.submit(body.kind, body.params)
+    except JobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _job_status(job)
+
+@app.get("/jobs/{job_id}")
+def jobStatus(job_id: str):
+    """Status, progress (0..1) and current band/month of a job."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return _job_status(job)
+
+@app.get("/jobs/{job_id}/result")
+def jobResult(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Job failed: {job['error']}")
+    path = jobs.result_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return FileResponse(path, media_type="application/json")
+
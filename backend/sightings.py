@@ -0,0 +1,291 @@
+"""
+Sighting aggregation for map views: occurrence records binned per zoom level.
+
+    python sightings.py --zoom 3 --bbox -100 -10 -20 60 --months 6 7
+
+Occurrence records (the real presence CSVs by default, through the reference store) are
+projected to web mercator once and kept in a level-of-detail pyramid. Level L cuts the map
+into 2^L x 2^L square bins; with BIN_PX pixel bins, zoom z is served from level z + 2. Each
+level up to PYRAMID_LEVELS is pre-aggregated into rows of (bin, month of the year-month)
+with a count and the sum of the record coordinates, sorted by bin row. A query then:
+
+  1. picks the level (finer levels are skipped while the viewport would hold more than
+     MAX_BINS bins, so a world bbox at zoom 12 still returns a bounded answer),
+  2. slices the viewport's bin rows with a binary search and keeps its bin columns
+     (two ranges when the viewport crosses the antimeridian),
+  3. drops rows outside the month / eventDate filters and sums the rest per bin.
+
+Levels past the pyramid use the records themselves, which are also sorted by bin row. The
+work is bounded by the rows inside the viewport at one level, never by the full record
+count, so millions of records cost about the same as thousands. Clusters are reported at
+the centroid of their records, not the bin centre, so markers sit on the data.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from reference_store import DEFAULT_SOURCES
+
+SIGHTINGS_SOURCES = [s for s in os.getenv("SIGHTINGS_SOURCES", DEFAULT_SOURCES[0]).split(os.pathsep) if s]
+BIN_PX = 64
+ZOOM_OFFSET = int(np.log2(256 // BIN_PX))
+PYRAMID_LEVELS = int(os.getenv("SIGHTINGS_PYRAMID_LEVELS", "10"))
+MAX_ZOOM = 22
+MAX_BINS = int(os.getenv("SIGHTINGS_MAX_BINS", "4096"))
+# Web mercator stops at +-85.05 deg; records further north/south land in the edge bins
+MAX_MERCATOR_LAT = 85.05112878
+# Period code of records without a usable date: matches no month or date filter
+UNDATED = -1
+
+
+def mercator(lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Web mercator x, y in [0, 1) (y grows southwards, like tile rows)."""
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lons = np.asarray(lons, dtype=np.float64)
+    x = (lons + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lats) / 2)) / (2 * np.pi)
+    return np.clip(x, 0.0, np.nextafter(1.0, 0)), np.clip(y, 0.0, np.nextafter(1.0, 0))
+
+
+def period_code(year: int, month: int) -> int:
+    """Months since year 0, the time key of the index (year * 12 + month - 1)."""
+    return year * 12 + month - 1
+
+
+def parse_period(value: Optional[str], end: bool = False) -> Optional[int]:
+    """Period of a 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' bound (days are ignored: the index is per month)."""
+    if value is None or value == "":
+        return None
+    parts = str(value).split("-")
+    try:
+        year = int(parts[0])
+        month = int(parts[1]) if len(parts) > 1 else (12 if end else 1)
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected YYYY, YYYY-MM or YYYY-MM-DD")
+    if not 1 <= month <= 12:
+        raise ValueError(f"Invalid month in {value!r}")
+    return period_code(year, month)
+
+
+def _record_periods(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Period of every record from eventDate, else the month/date_year columns."""
+    n = len(columns["decimalLatitude"])
+    periods = np.full(n, UNDATED, dtype=np.int64)
+    if "eventDate" in columns:
+        dates = pd.to_datetime(pd.Series(columns["eventDate"]), errors="coerce", utc=True)
+        ok = dates.notna().to_numpy()
+        periods[ok] = dates[ok].dt.year.to_numpy() * 12 + dates[ok].dt.month.to_numpy() - 1
+    if "month" in columns and "date_year" in columns:
+        month = np.asarray(columns["month"], dtype=np.float64)
+        year = np.asarray(columns["date_year"], dtype=np.float64)
+        fill = (periods == UNDATED) & np.isfinite(month) & np.isfinite(year) & (month >= 1) & (month <= 12)
+        periods[fill] = year[fill].astype(np.int64) * 12 + month[fill].astype(np.int64) - 1
+    return periods
+
+
+def load_records(sources: Sequence[str] = SIGHTINGS_SOURCES) -> Dict[str, np.ndarray]:
+    """lat, lng and period of the presence records of every source."""
+    from reference_store import load_columns
+
+    lats, lngs, periods = [], [], []
+    for source in sources:
+        if not os.path.exists(source):
+            print(f"Warning: sightings source {source} not found")
+            continue
+        header = pd.read_csv(source, nrows=0).columns
+        wanted = [c for c in ("decimalLatitude", "decimalLongitude", "eventDate", "month", "date_year", "presence")
+                  if c in header]
+        columns = load_columns(source, wanted)
+        keep = np.isfinite(columns["decimalLatitude"].astype(np.float64)) & \
+            np.isfinite(columns["decimalLongitude"].astype(np.float64))
+        if "presence" in columns:
+            keep &= columns["presence"] == 1
+        lats.append(columns["decimalLatitude"][keep])
+        lngs.append(columns["decimalLongitude"][keep])
+        periods.append(_record_periods(columns)[keep])
+    if not lats:
+        return {"lat": np.empty(0), "lng": np.empty(0), "period": np.empty(0, dtype=np.int64)}
+    return {"lat": np.concatenate(lats).astype(np.float64), "lng": np.concatenate(lngs).astype(np.float64),
+            "period": np.concatenate(periods)}
+
+
+class _Level:
+    """Rows sorted by bin row: bin x/y at one level, period, count and coordinate sums."""
+
+    def __init__(self, level: int, bx: np.ndarray, by: np.ndarray, period: np.ndarray,
+                 count: np.ndarray, lat_sum: np.ndarray, lng_sum: np.ndarray):
+        self.level = level
+        self.bx, self.by, self.period = bx, by, period
+        self.count, self.lat_sum, self.lng_sum = count, lat_sum, lng_sum
+
+
+class SightingIndex:
+    """Level-of-detail pyramid over occurrence records."""
+
+    def __init__(self, lats: np.ndarray, lngs: np.ndarray, periods: np.ndarray, levels: int = PYRAMID_LEVELS):
+        x, y = mercator(lats, lngs)
+        order = np.argsort(y, kind="stable")
+        self.x, self.y = x[order], y[order]
+        self.total = len(order)
+        self.records = _Level(MAX_ZOOM + ZOOM_OFFSET, None, None, np.asarray(periods, dtype=np.int64)[order],
+                              np.ones(len(order), dtype=np.int64),
+                              np.asarray(lats, dtype=np.float64)[order], np.asarray(lngs, dtype=np.float64)[order])
+        # The finest level is aggregated from the records, every coarser one from the level below
+        side = 1 << levels
+        pyramid = [self._aggregate(levels, (self.x * side).astype(np.int64), (self.y * side).astype(np.int64),
+                                   self.records)]
+        for level in range(levels - 1, -1, -1):
+            finer = pyramid[0]
+            pyramid.insert(0, self._aggregate(level, finer.bx >> 1, finer.by >> 1, finer))
+        self.levels = pyramid
+        self.periods = periods[periods != UNDATED]
+
+    @staticmethod
+    def _aggregate(level: int, bx: np.ndarray, by: np.ndarray, rows: _Level) -> _Level:
+        side = 1 << level
+        period = rows.period
+        low = int(period.min()) if len(period) else 0
+        span = int(period.max()) - low + 1 if len(period) else 1
+        # Bin row first, so the unique keys come out sorted by bin row
+        keys, inverse = np.unique((by * side + bx) * span + (period - low), return_inverse=True)
+        bins = keys // span
+        return _Level(level, bins % side, bins // side, keys % span + low,
+                      np.bincount(inverse, rows.count, len(keys)).astype(np.int64),
+                      np.bincount(inverse, rows.lat_sum, len(keys)),
+                      np.bincount(inverse, rows.lng_sum, len(keys)))
+
+    def _rows(self, level: int) -> Tuple[_Level, np.ndarray, np.ndarray]:
+        """Table for a level with the bin column and row of every table row."""
+        if level < len(self.levels):
+            table = self.levels[level]
+            return table, table.bx, table.by
+        # Records: bins are computed on the fly for the rows a query touches
+        return self.records, None, None
+
+    def query(self, bbox: Optional[Sequence[float]] = None, zoom: int = 0, months: Optional[Iterable[int]] = None,
+              start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Clusters of the records inside bbox = (west, south, east, north) at a zoom level.
+        months keeps records of those calendar months, start/end (period codes) a date range.
+        """
+        west, south, east, north = bbox if bbox is not None else (-180.0, -90.0, 180.0, 90.0)
+        if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= north <= 90):
+            raise ValueError("bbox must be west,south,east,north with lng in -180..180 and south <= north")
+        # A viewport across the antimeridian has west > east
+        wraps = west > east
+        x0, y0 = mercator(north, west)
+        x1, y1 = mercator(south, east)
+
+        requested = min(max(int(zoom), 0), MAX_ZOOM) + ZOOM_OFFSET
+        level = requested
+        while level > 0 and _bins_in_view(level, x0, x1, y0, y1, wraps) > MAX_BINS:
+            level -= 1
+
+        side = 1 << level
+        row0, row1 = int(y0 * side), int(y1 * side)
+        col0, col1 = int(x0 * side), int(x1 * side)
+        table, bx, by = self._rows(level)
+        if bx is None:
+            lo, hi = np.searchsorted(self.y, [row0 / side, (row1 + 1) / side])
+            sl = slice(lo, hi)
+            bx = (self.x[sl] * side).astype(np.int64)
+            by = (self.y[sl] * side).astype(np.int64)
+        else:
+            lo, hi = np.searchsorted(by, [row0, row1 + 1])
+            sl = slice(lo, hi)
+            bx, by = bx[sl], by[sl]
+
+        keep = (bx >= col0) | (bx <= col1) if wraps else (bx >= col0) & (bx <= col1)
+        period = table.period[sl]
+        if months is not None:
+            months = sorted({int(m) for m in months})
+            if any(m < 1 or m > 12 for m in months):
+                raise ValueError("months must be in 1..12")
+            keep &= (period != UNDATED) & np.isin(period % 12 + 1, months)
+        if start is not None:
+            keep &= (period != UNDATED) & (period >= start)
+        if end is not None:
+            keep &= (period != UNDATED) & (period <= end)
+
+        idx = np.nonzero(keep)[0]
+        bins, inverse = np.unique(by[idx] * side + bx[idx], return_inverse=True)
+        count = np.bincount(inverse, table.count[sl][idx], len(bins))
+        lat = np.bincount(inverse, table.lat_sum[sl][idx], len(bins)) / np.maximum(count, 1)
+        lng = np.bincount(inverse, table.lng_sum[sl][idx], len(bins)) / np.maximum(count, 1)
+        order = np.argsort(-count, kind="stable")
+        clusters = [{"lat": round(float(a), 5), "lng": round(float(b), 5), "count": int(c)}
+                    for a, b, c in zip(lat[order], lng[order], count[order])]
+        return {
+            "zoom": int(zoom),
+            "level": level,
+            "bin_px": BIN_PX << (requested - level),
+            "count": int(count.sum()),
+            "total": self.total,
+            "clusters": clusters,
+        }
+
+    def time_range(self) -> Optional[Dict[str, str]]:
+        if not len(self.periods):
+            return None
+        low, high = int(self.periods.min()), int(self.periods.max())
+        return {"start": f"{low // 12:04d}-{low % 12 + 1:02d}", "end": f"{high // 12:04d}-{high % 12 + 1:02d}"}
+
+
+def _bins_in_view(level: int, x0: float, x1: float, y0: float, y1: float, wraps: bool) -> int:
+    side = 1 << level
+    cols = (side - int(x0 * side) + int(x1 * side) + 1) if wraps else int(x1 * side) - int(x0 * side) + 1
+    return min(cols, side) * (int(y1 * side) - int(y0 * side) + 1)
+
+
+_index: Dict[str, SightingIndex] = {}
+_lock = threading.Lock()
+
+
+def get_index() -> SightingIndex:
+    """Index of SIGHTINGS_SOURCES, rebuilt when the reference data version changes."""
+    from lineage import data_version
+
+    version = data_version()
+    with _lock:
+        if version not in _index:
+            records = load_records()
+            _index.clear()
+            _index[version] = SightingIndex(records["lat"], records["lng"], records["period"])
+        return _index[version]
+
+
+def sightings(bbox: Optional[Sequence[float]] = None, zoom: int = 0, months: Optional[Iterable[int]] = None,
+              start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, Any]:
+    """/sightings payload: clusters as {lat, lng, count} under "sightings", largest first."""
+    index = get_index()
+    result = index.query(bbox, zoom, months, parse_period(start), parse_period(end, end=True))
+    result["sightings"] = result.pop("clusters")
+    result["time_range"] = index.time_range()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate occurrence records for a map view")
+    parser.add_argument("--bbox", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    parser.add_argument("--zoom", type=int, default=0)
+    parser.add_argument("--months", type=int, nargs="*")
+    parser.add_argument("--start", help="YYYY, YYYY-MM or YYYY-MM-DD")
+    parser.add_argument("--end", help="YYYY, YYYY-MM or YYYY-MM-DD")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    get_index()
+    built = time.perf_counter()
+    result = sightings(args.bbox, args.zoom, args.months, args.start, args.end)
+    print(json.dumps({**result, "sightings": result["sightings"][:10]}, indent=2))
+    print(f"index {built - start:.2f}s, query {time.perf_counter() - built:.3f}s, "
+          f"{len(result['sightings'])} clusters")
+
+
+if __name__ == '__main__':
+    main()
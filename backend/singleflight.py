@@ -0,0 +1,48 @@
+"""
+Per-key single flight for the module-level caches that are filled from worker threads
+(behaviour layers, corridor graphs).
+
+A missing entry is built outside the cache lock, so hits and other keys never wait on a
+build, and only once: concurrent callers for the same key wait on that key's build lock
+and then find the stored result.
+"""
+import threading
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        # Guards the caller's cache (lookup / store run under it) and the build locks
+        self.lock = threading.Lock()
+        self._building: Dict[Hashable, threading.Lock] = {}
+
+    def get(self, key: Hashable, lookup: Callable[[Hashable], Optional[T]], build: Callable[[], T],
+            store: Callable[[Hashable, T], None]) -> T:
+        """
+        lookup(key) under the lock, else build() once across threads and store(key, value)
+        under the lock. lookup returns None for a missing entry.
+        """
+        with self.lock:
+            value = lookup(key)
+            if value is not None:
+                return value
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self.lock:
+                value = lookup(key)
+                if value is not None:
+                    return value
+            try:
+                value = build()
+            except BaseException:
+                with self.lock:
+                    del self._building[key]
+                raise
+            # Store before dropping the build lock: a caller arriving in between must find
+            # the value, not start a second build
+            with self.lock:
+                store(key, value)
+                del self._building[key]
+            return value
@@ -0,0 +1,75 @@
+"""Parity of the native XGBoost path (fast_predict.py) with the sklearn wrapper's predict_proba."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fast_predict import PARITY_TOLERANCE, Predictor, get_predictor, probe_sample
+from habitat_grid import PRESENCE_FEATURES, grid_features, grid_mesh, ocean_mask, score_presence
+from model_registry import registry
+from reference_store import MODELS_DIR
+
+REFERENCE_ROWS = 500
+# Fixed reference rows per model: the first rows of its training data with every feature set
+REFERENCE_CSV = {
+    "presence": os.path.join(MODELS_DIR, "Shark Presence", "shark_presence_absence_refined_v2.csv"),
+    "activity": os.path.join(MODELS_DIR, "Shark activity", "ready_to_run.csv"),
+}
+
+
+def reference_rows(name: str, features) -> np.ndarray:
+    df = pd.read_csv(REFERENCE_CSV[name], usecols=lambda c: c in features)
+    df = df[list(features)].apply(pd.to_numeric, errors="coerce").dropna().head(REFERENCE_ROWS)
+    assert len(df) == REFERENCE_ROWS
+    rows = df.to_numpy(dtype=float)
+    if "bathymetry" in features:
+        # The endpoints send depths with both signs (presence negative, activity positive)
+        flipped = rows.copy()
+        flipped[:, list(features).index("bathymetry")] *= -1
+        rows = np.vstack([rows, flipped])
+    return rows
+
+
+def wrapper_proba(model, X: np.ndarray, features) -> np.ndarray:
+    return np.asarray(model.predict_proba(pd.DataFrame(X, columns=list(features))))
+
+
+@pytest.mark.parametrize("name", ["presence", "activity"])
+def test_reference_rows_match_wrapper(name):
+    model = registry.get(name)
+    predictor = Predictor(model)
+    assert predictor.booster is not None, "the fast path should unwrap the native booster"
+    X = reference_rows(name, predictor.features)
+
+    fast = predictor.predict_proba(X)
+    expected = wrapper_proba(model, X, predictor.features)
+    assert fast.shape == expected.shape
+    assert np.max(np.abs(fast - expected)) <= PARITY_TOLERANCE
+    labels = np.asarray(model.predict(pd.DataFrame(X, columns=predictor.features)))
+    np.testing.assert_array_equal(predictor.predict(X), labels)
+
+
+@pytest.mark.parametrize("name", ["presence", "activity"])
+def test_probe_sample_matches_wrapper(name):
+    predictor = Predictor(registry.get(name))
+    assert predictor.parity(probe_sample(predictor.features, 2000, seed=1)) <= PARITY_TOLERANCE
+
+
+def test_registry_predictor_keeps_fast_path():
+    # predictor_for drops to the wrapper when its own probe check fails
+    for name in ("presence", "activity"):
+        assert get_predictor(name).booster is not None
+
+
+def test_grid_scores_match_wrapper():
+    """The scores /globalHabitats serves, against predict_proba on the same feature table."""
+    lats, lons = grid_mesh(5.0)
+    mask = ocean_mask(lats, lons)
+    features = grid_features(lats[mask], lons[mask], 6)
+    model = registry.get("presence")
+
+    _, probs = score_presence(model, features)
+    expected = model.predict_proba(features[PRESENCE_FEATURES])[:, 1]
+    assert len(probs) == len(features) > 0
+    assert np.max(np.abs(probs - expected)) <= PARITY_TOLERANCE
@@ -0,0 +1,278 @@
+"""
+Web-mercator habitat tiles for the presence and activity models.
+
+Tiles are rendered on first request and cached in memory (LRU) and on disk under
+backend/data/tiles/{layer}/{model_version}/{month}/{z}/{x}/{y}.{ext}, so repeated
+map interaction costs no inference. The activity model has no month input, so its tiles
+are rendered once from month 1 features (as behaviour.py does) and stored under month 01.
+The disk store is bounded by TILE_DISK_MAX_MB: past it, the least recently used tiles
+(by mtime, refreshed on every disk hit) are removed until it is 90% full.
+
+Tile URLs carry no version, so responses are validated by an ETag of the model and data
+versions (tile_etag) instead of being cached by clients for a fixed time.
+"""
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from habitat_grid import ACTIVITY_FEATURES, PRESENCE_FEATURES, ocean_mask
+from fast_predict import feature_matrix, get_predictor
+from lineage import data_version
+from metrics import span
+from model_registry import registry
+from ocean_utils import get_features_batch
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(BACKEND_DIR, "data", "tiles"))
+TILE_SIZE = 256
+# Model samples per tile edge; pixels are upscaled from this grid
+TILE_SAMPLES = int(os.getenv("TILE_SAMPLES", "64"))
+TILE_MEMORY_ITEMS = int(os.getenv("TILE_MEMORY_ITEMS", "2048"))
+TILE_DISK_MAX_BYTES = int(float(os.getenv("TILE_DISK_MAX_MB", "1024")) * 1024 * 1024)
+# Month of the activity layer's features and cache key
+ACTIVITY_MONTH = 1
+MAX_ZOOM = 12
+
+LAYERS = ("presence", "activity")
+FORMATS = {"png": "image/png", "f32": "application/octet-stream"}
+
+# Presence colour ramp (probability 0..1 -> RGB), same stops as the dashboard thermal gradient
+_RAMP_STOPS = np.array([0.0, 0.2, 0.4, 0.6, 0.8, 1.0])
+_RAMP_RGB = np.array([
+    [0, 0, 255], [0, 255, 255], [0, 255, 0], [255, 255, 0], [255, 165, 0], [255, 0, 0],
+], dtype=float)
+# Activity classes (habitat_grid.ACTIVITY_CLASSES): 0 migrating, 1 resting, 2 eating
+_ACTIVITY_RGB = np.array([[234, 179, 8], [59, 130, 246], [239, 68, 68]], dtype=float)
+
+
+def tile_lat_lon(z: int, x: int, y: int, samples: int = TILE_SAMPLES) -> Tuple[np.ndarray, np.ndarray]:
+    """Lat/lon of sample centres for a slippy-map tile, shape (samples, samples), row 0 = north."""
+    n = 2 ** z
+    frac = (np.arange(samples) + 0.5) / samples
+    lons = (x + frac) / n * 360.0 - 180.0
+    merc_y = np.pi * (1 - 2 * (y + frac) / n)
+    lats = np.degrees(np.arctan(np.sinh(merc_y)))
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing="ij")
+    return lat_grid, lon_grid
+
+
+def _score_cells(layer: str, lats: np.ndarray, lons: np.ndarray, month: int) -> np.ndarray:
+    """Per-cell probabilities, shape (n,) for presence or (n, 3) for activity; NaN on land."""
+    n_out = 1 if layer == "presence" else 3
+    out = np.full((lats.size, n_out), np.nan)
+    mask = ocean_mask(lats, lons)
+    if not mask.any():
+        return out[:, 0] if layer == "presence" else out
+    o_lats, o_lons = lats[mask], lons[mask]
+    feats = get_features_batch(o_lats, o_lons, month)
+    if layer == "presence":
+        X = feature_matrix({
+            "decimalLatitude": o_lats,
+            "decimalLongitude": o_lons,
+            "month": month,
+            "bathymetry": -np.abs(feats["bathymetry"]),
+            "sst": feats["sst"],
+            "sss": feats["sss"],
+            "shoredistance": feats["shoredistance"],
+        }, PRESENCE_FEATURES, o_lats.size)
+        with span("inference"):
+            out[mask, 0] = get_predictor("presence").predict_proba(X)[:, 1]
+        return out[:, 0]
+    X = feature_matrix({
+        "bathymetry": np.abs(feats["bathymetry"]),
+        "decimalLatitude": o_lats,
+        "decimalLongitude": o_lons,
+        "shoredistance": feats["shoredistance"],
+    }, ACTIVITY_FEATURES, o_lats.size)
+    with span("inference"):
+        out[mask] = get_predictor("activity").predict_proba(X)
+    return out
+
+
+def _colorize(layer: str, values: np.ndarray) -> np.ndarray:
+    """Probabilities to an RGBA uint8 image; land stays transparent."""
+    h, w = values.shape[:2]
+    rgba = np.zeros((h, w, 4), dtype=np.uint8)
+    if layer == "presence":
+        valid = ~np.isnan(values)
+        p = np.clip(np.nan_to_num(values), 0.0, 1.0)
+        for c in range(3):
+            rgba[..., c] = np.interp(p, _RAMP_STOPS, _RAMP_RGB[:, c]).astype(np.uint8)
+        rgba[..., 3] = np.where(valid, (60 + 160 * p).astype(np.uint8), 0)
+    else:
+        valid = ~np.isnan(values[..., 0])
+        cls = np.argmax(np.nan_to_num(values, nan=-1.0), axis=-1)
+        conf = np.nanmax(np.where(valid[..., None], values, 0.0), axis=-1)
+        rgba[..., :3] = _ACTIVITY_RGB[cls].astype(np.uint8)
+        rgba[..., 3] = np.where(valid, (60 + 160 * conf).astype(np.uint8), 0)
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Minimal RGBA8 PNG encoder (no imaging dependency)."""
+    h, w = rgba.shape[:2]
+    raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), rgba.reshape(h, w * 4)], axis=1).tobytes()
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def render_tile(layer: str, z: int, x: int, y: int, month: int, fmt: str = "png") -> bytes:
+    """
+    Render one tile. png: 256x256 RGBA image. f32: TILE_SAMPLES x TILE_SAMPLES little-endian
+    float32 grid (row 0 = north) of presence probability, or of the per-class probabilities
+    (samples, samples, 3) for the activity layer; NaN on land.
+    """
+    lats, lons = tile_lat_lon(z, x, y)
+    scores = _score_cells(layer, lats.ravel(), lons.ravel(), month)
+    grid = scores.reshape(TILE_SAMPLES, TILE_SAMPLES, *scores.shape[1:])
+    with span("serialize"):
+        if fmt == "f32":
+            return grid.astype("<f4").tobytes()
+        scale = max(1, TILE_SIZE // TILE_SAMPLES)
+        img = _colorize(layer, np.repeat(np.repeat(grid, scale, axis=0), scale, axis=1))
+        return encode_png(img)
+
+
+class TileCache:
+    """In-memory LRU in front of an on-disk tile store."""
+
+    def __init__(self, root: str = TILE_CACHE_DIR, max_items: int = TILE_MEMORY_ITEMS,
+                 max_disk_bytes: int = TILE_DISK_MAX_BYTES):
+        self.root = root
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bytes on disk; scanned on the first write, then kept up to date by put and _evict
+        self._disk_bytes: Optional[int] = None
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key: Tuple) -> str:
+        layer, version, month, z, x, y, fmt = key
+        return os.path.join(self.root, layer, version, f"{month:02d}", str(z), str(x), f"{y}.{fmt}")
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return body
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+            os.utime(path)
+        except OSError:
+            body = None
+        if body is not None:
+            self._remember(key, body)
+            self.disk_hits += 1
+            return body
+        self.misses += 1
+        return None
+
+    def put(self, key: Tuple, body: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per writer: concurrent first renders of a tile must not share a temp file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+        self._remember(key, body)
+        self._account(len(body) - replaced)
+
+    def _tiles(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".tmp"):
+                    yield os.path.join(dirpath, name)
+
+    def _account(self, added: int) -> None:
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(os.path.getsize(p) for p in self._tiles())
+            else:
+                self._disk_bytes += added
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Remove least recently used tiles until the disk store is 90% of its bound."""
+        entries = []
+        for path in self._tiles():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_disk_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._disk_bytes = total
+
+    def _remember(self, key: Tuple, body: bytes) -> None:
+        with self._lock:
+            self._memory[key] = body
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def clear_memory(self) -> None:
+        """Drop the in-memory tiles (disk tiles invalidated by lineage.py are already gone)."""
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"memory_items": len(self._memory), "disk_bytes": self._disk_bytes or 0, "hits": self.hits,
+                "disk_hits": self.disk_hits, "misses": self.misses}
+
+
+tile_cache = TileCache()
+
+
+def tile_etag(layer: str, month: int) -> str:
+    """Validator for every tile of a layer and month: changes with the model or reference data."""
+    if layer == "activity":
+        month = ACTIVITY_MONTH
+    return f'"{registry.version(layer)}-{data_version(month)}"'
+
+
+def get_tile(layer: str, z: int, x: int, y: int, month: int, fmt: str = "png") -> bytes:
+    """Cached tile bytes, keyed by layer, model version, month, tile and format."""
+    if layer == "activity":
+        month = ACTIVITY_MONTH
+    # Notices a lineage run and drops stale in-memory tiles
+    data_version(month)
+    key = (layer, registry.version(layer), month, z, x, y, fmt)
+    body = tile_cache.get(key)
+    if body is None:
+        body = render_tile(layer, z, x, y, month, fmt)
+        tile_cache.put(key, body)
+    return body
@@ -0,0 +1,215 @@
+"""
+Per-cell uncertainty for the presence model.
+
+Two methods, each scoring all members in large vectorized batches:
+
+    perturbation  the presence model re-run with SST/SSS shifted by their typical error
+                  (antithetic pairs of normal draws); measures sensitivity to the inputs
+    bootstrap     a small ensemble of boosters retrained on bootstrap resamples of the
+                  training CSV with the model's own parameters; measures model variance
+
+The result is the standard deviation of P(presence) across members, stored next to the
+point estimate in the habitat store (column probability_std_{method}). Build the bootstrap
+ensemble once per model version:
+
+    python uncertainty.py --members 8
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from fast_predict import feature_matrix, get_predictor
+from habitat_grid import PRESENCE_FEATURES, uncertainty_column
+from metrics import span
+from model_registry import registry
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ENSEMBLE_DIR = os.getenv("ENSEMBLE_DIR", os.path.join(BACKEND_DIR, "data", "ensemble", "presence"))
+TRAINING_CSV = os.getenv("PRESENCE_TRAINING_CSV", os.path.join(
+    BACKEND_DIR, "..", "models", "Shark Presence", "shark_presence_absence_refined_v2.csv"))
+
+METHODS = ("perturbation", "bootstrap")
+# Typical error of the SST (degC) and SSS (psu) inputs
+SST_SIGMA = float(os.getenv("UNCERTAINTY_SST_SIGMA", "0.5"))
+SSS_SIGMA = float(os.getenv("UNCERTAINTY_SSS_SIGMA", "0.2"))
+PERTURBATION_MEMBERS = 16
+# Rows per inference call (cells x members), bounds the memory of one batch
+BATCH_ROWS = 1_000_000
+
+# Booster parameters copied from the trained model for the bootstrap members
+_TRAIN_PARAMS = ("eta", "max_depth", "min_child_weight", "subsample", "colsample_bytree", "colsample_bylevel",
+                 "colsample_bynode", "lambda", "alpha", "gamma", "max_bin", "max_delta_step", "grow_policy")
+
+
+class UncertaintyError(ValueError):
+    """Raised for an unknown method or a bootstrap ensemble that has not been built."""
+
+
+def _offsets(members: int = PERTURBATION_MEMBERS, seed: int = 0) -> np.ndarray:
+    """(members, 2) SST/SSS shifts in antithetic pairs, so their mean is exactly zero."""
+    z = np.random.default_rng(seed).standard_normal((members // 2, 2))
+    return np.concatenate([z, -z]) * np.array([SST_SIGMA, SSS_SIGMA])
+
+
+def _perturbation_members(X: np.ndarray) -> np.ndarray:
+    predictor = get_predictor("presence")
+    offsets = _offsets().astype(np.float32)
+    sst, sss = PRESENCE_FEATURES.index("sst"), PRESENCE_FEATURES.index("sss")
+    out = np.empty((len(offsets), X.shape[0]), dtype=np.float32)
+    step = max(1, BATCH_ROWS // len(offsets))
+    for start in range(0, X.shape[0], step):
+        chunk = X[start:start + step]
+        # One (members * cells, features) matrix per batch
+        batch = np.repeat(chunk[None, :, :], len(offsets), axis=0)
+        batch[:, :, sst] += offsets[:, 0, None]
+        batch[:, :, sss] += offsets[:, 1, None]
+        probs = predictor.predict_proba(batch.reshape(-1, X.shape[1]))[:, 1]
+        out[:, start:start + step] = probs.reshape(len(offsets), -1)
+    return out
+
+
+def ensemble_path(version: Optional[str] = None) -> str:
+    return os.path.join(ENSEMBLE_DIR, version or registry.version("presence"))
+
+
+_ensembles: Dict[str, List] = {}
+_lock = threading.Lock()
+
+
+def load_ensemble(version: Optional[str] = None) -> Optional[List]:
+    """Bootstrap boosters for a presence model version, or None if not built."""
+    import xgboost as xgb
+
+    version = version or registry.version("presence")
+    with _lock:
+        if version not in _ensembles:
+            root = ensemble_path(version)
+            if not os.path.exists(os.path.join(root, "meta.json")):
+                return None
+            boosters = []
+            for name in sorted(f for f in os.listdir(root) if f.endswith(".ubj")):
+                booster = xgb.Booster()
+                booster.load_model(os.path.join(root, name))
+                boosters.append(booster)
+            _ensembles[version] = boosters
+        return _ensembles[version]
+
+
+def _bootstrap_members(X: np.ndarray) -> np.ndarray:
+    boosters = load_ensemble()
+    if not boosters:
+        raise UncertaintyError("No bootstrap ensemble for the current presence model; run uncertainty.py")
+    out = np.empty((len(boosters), X.shape[0]), dtype=np.float32)
+    for i, booster in enumerate(boosters):
+        for start in range(0, X.shape[0], BATCH_ROWS):
+            out[i, start:start + BATCH_ROWS] = booster.inplace_predict(X[start:start + BATCH_ROWS],
+                                                                       validate_features=False)
+    return out
+
+
+def available_methods() -> List[str]:
+    return [m for m in METHODS if m != "bootstrap" or load_ensemble()]
+
+
+def check_method(method: str) -> str:
+    if method not in METHODS:
+        raise UncertaintyError(f"Unknown uncertainty method '{method}'; expected one of {', '.join(METHODS)}")
+    if method == "bootstrap" and not load_ensemble():
+        raise UncertaintyError("No bootstrap ensemble for the current presence model; run uncertainty.py")
+    return method
+
+
+def presence_std(X: np.ndarray, method: str = "perturbation") -> np.ndarray:
+    """Standard deviation of P(presence) across members for rows of X (PRESENCE_FEATURES order)."""
+    check_method(method)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if X.shape[0] == 0:
+        return np.empty(0, dtype=np.float32)
+    with span("uncertainty"):
+        members = _perturbation_members(X) if method == "perturbation" else _bootstrap_members(X)
+        return members.std(axis=0)
+
+
+def add_uncertainty(surface: pd.DataFrame, month: int, method: str = "perturbation") -> pd.DataFrame:
+    """Surface with its probability_std_{method} column filled in (unchanged if already there)."""
+    column = uncertainty_column(method)
+    if column in surface and not surface[column].isna().any():
+        return surface
+    X = feature_matrix({
+        "decimalLatitude": surface["lat"].to_numpy(),
+        "decimalLongitude": surface["lng"].to_numpy(),
+        "month": month,
+        "bathymetry": surface["bathymetry"].to_numpy(),
+        "sst": surface["temperature"].to_numpy(),
+        "sss": surface["salinity"].to_numpy(),
+        "shoredistance": surface["shoredistance"].to_numpy(),
+    }, PRESENCE_FEATURES, len(surface))
+    surface = surface.copy()
+    surface[column] = presence_std(X, method)
+    return surface
+
+
+def _training_params(booster) -> Dict[str, object]:
+    config = json.loads(booster.save_config())
+    learner = config["learner"]
+    tree = learner["gradient_booster"].get("tree_train_param", {})
+    params = {key: tree[key] for key in _TRAIN_PARAMS if key in tree}
+    params["objective"] = learner["objective"]["name"]
+    params["tree_method"] = "hist"
+    return params
+
+
+def train_ensemble(members: int = 8, source: str = TRAINING_CSV, seed: int = 0) -> str:
+    """Fit bootstrap members for the current presence model; returns their directory."""
+    import xgboost as xgb
+
+    from reference_store import read_frame
+
+    predictor = get_predictor("presence")
+    if predictor.booster is None:
+        raise UncertaintyError("The presence model has no native booster to copy parameters from")
+    params = _training_params(predictor.booster)
+    rounds = predictor.iteration_range[1] or predictor.booster.num_boosted_rounds()
+
+    df = read_frame(source, PRESENCE_FEATURES + ["presence"])
+    df = df[df["presence"].isin([0, 1])]
+    X = feature_matrix(df, PRESENCE_FEATURES)
+    y = df["presence"].to_numpy(dtype=np.float32)
+
+    root = ensemble_path()
+    os.makedirs(root, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for i in range(members):
+        rows = rng.integers(0, len(y), len(y))
+        dtrain = xgb.DMatrix(X[rows], label=y[rows], feature_names=PRESENCE_FEATURES)
+        booster = xgb.train({**params, "seed": seed + i}, dtrain, num_boost_round=rounds)
+        booster.save_model(os.path.join(root, f"member_{i:02d}.ubj"))
+    with open(os.path.join(root, "meta.json"), "w") as f:
+        json.dump({"members": members, "rounds": rounds, "params": params, "seed": seed,
+                   "source": os.path.abspath(source), "rows": int(len(y)),
+                   "model_version": registry.version("presence")}, f, indent=2)
+    with _lock:
+        _ensembles.pop(registry.version("presence"), None)
+    return root
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the bootstrap ensemble used for presence uncertainty")
+    parser.add_argument("--members", type=int, default=8, help="bootstrap members")
+    parser.add_argument("--source", default=TRAINING_CSV, help="training CSV with a presence column")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    root = train_ensemble(args.members, args.source, args.seed)
+    print(f"Trained {args.members} bootstrap members in {time.perf_counter() - start:.1f}s -> {root}")
+
+
+if __name__ == '__main__':
+    main()
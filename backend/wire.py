@@ -0,0 +1,129 @@
+"""
+Binary columnar responses for point payloads, negotiated by the Accept header.
+
+JSON stays the default. A client that sends one of these media types gets the payload's
+point table (the /getMigration heatmap points, the possible_habitats list, ...) as float32
+columns instead of a list of objects:
+
+    application/vnd.sharkapi.columns      the layout below (frontend: decodeColumns in lib/utils.js)
+    application/vnd.apache.arrow.stream   one Arrow IPC record batch of float32 columns; the
+                                          header below is in the schema metadata under "sharkapi"
+
+Columns layout, version 1 (all integers and floats little-endian):
+
+    offset      size        content
+    0           4           magic b"SHKC"
+    4           4           uint32 layout version (1)
+    8           4           uint32 header length H (a multiple of 4)
+    12          H           UTF-8 JSON header, space padded to H bytes:
+                              rows     number of points
+                              columns  column names, in body order
+                              table    keys leading to the point table in the JSON payload
+                              meta     the rest of the JSON payload, without the table
+    12 + H      4 * rows    float32 values of the first column, then the next column, ...
+
+Columns start 4-byte aligned, so they map directly onto Float32Array views. Missing values
+are NaN. Other numbers (counts, options) stay in meta with full precision.
+"""
+import gzip
+import json
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+from fastapi.encoders import jsonable_encoder
+
+from batch_predict import ARROW_STREAM
+
+COLUMNS = "application/vnd.sharkapi.columns"
+MAGIC = b"SHKC"
+LAYOUT_VERSION = 1
+BINARY_FORMATS = (COLUMNS, ARROW_STREAM)
+# Binary bodies are cached gzipped once and sent as stored to clients that accept gzip
+GZIP_LEVEL = 6
+
+
+class Table:
+    """
+    Where the point table sits in a payload: path is the keys leading to it (empty for a
+    payload that is the list itself), names the column names of list-of-lists rows.
+    """
+
+    def __init__(self, path: Sequence[str] = (), names: Optional[Sequence[str]] = None):
+        self.path = tuple(path)
+        self.names = list(names) if names is not None else None
+
+
+def negotiate(accept: str) -> Optional[str]:
+    """Binary media type asked for in an Accept header, or None for JSON."""
+    accept = accept or ""
+    for media_type in BINARY_FORMATS:
+        if media_type in accept:
+            return media_type
+    return None
+
+
+def split_table(payload: Any, table: Table) -> Tuple[Any, Any]:
+    """(payload without the table, table). The payload itself is not modified."""
+    if not table.path or not isinstance(payload, dict):
+        return None, payload
+    meta = dict(payload)
+    node = meta
+    for key in table.path[:-1]:
+        node[key] = dict(node[key])
+        node = node[key]
+    return meta, node.pop(table.path[-1])
+
+
+def table_columns(rows: Any, names: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    float32 columns of a table given as a dict of arrays, a list of dicts (columns in
+    first-seen key order, missing keys and None as NaN) or a list of lists with names.
+    """
+    if isinstance(rows, dict):
+        return {name: np.asarray(values, dtype=np.float32) for name, values in rows.items()}
+    rows = list(rows)
+    if rows and isinstance(rows[0], dict):
+        keys: Dict[str, None] = {}
+        for row in rows:
+            keys.update(dict.fromkeys(row))
+        names = list(keys)
+        values = np.array([[row.get(name) for name in names] for row in rows], dtype=np.float32)
+    else:
+        if names is None:
+            raise ValueError("List rows need column names")
+        values = np.array(rows, dtype=np.float32).reshape(len(rows), len(names))
+    return {name: values[:, i] for i, name in enumerate(names)}
+
+
+def _header(meta: Any, table: Table, columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    rows = len(next(iter(columns.values()))) if columns else 0
+    return {"rows": rows, "columns": list(columns), "table": list(table.path), "meta": jsonable_encoder(meta)}
+
+
+def encode_columns(header: Dict[str, Any], columns: Dict[str, np.ndarray]) -> bytes:
+    text = json.dumps(header, separators=(",", ":"), allow_nan=False).encode("utf-8")
+    text += b" " * (-len(text) % 4)
+    parts: List[bytes] = [MAGIC, struct.pack("<II", LAYOUT_VERSION, len(text)), text]
+    parts.extend(np.ascontiguousarray(values, dtype="<f4").tobytes() for values in columns.values())
+    return b"".join(parts)
+
+
+def encode_arrow(header: Dict[str, Any], columns: Dict[str, np.ndarray]) -> bytes:
+    schema = pa.schema([(name, pa.float32()) for name in columns],
+                       metadata={"sharkapi": json.dumps(header, separators=(",", ":"))})
+    batch = pa.record_batch([pa.array(values, type=pa.float32()) for values in columns.values()], schema=schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(payload: Any, table: Table, media_type: str) -> bytes:
+    """Gzipped binary body of a payload in one of BINARY_FORMATS."""
+    meta, rows = split_table(payload, table)
+    columns = table_columns(rows, table.names)
+    header = _header(meta, table, columns)
+    body = encode_columns(header, columns) if media_type == COLUMNS else encode_arrow(header, columns)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
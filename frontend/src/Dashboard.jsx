@@ -7,6 +7,7 @@ import { Switch } from "@/components/ui/switch";
 import { Label } from "@/components/ui/label";
 import { Slider } from "@/components/ui/slider";
 import { ToggleGroup, ToggleGroupItem } from "./components/ui/toggle-group";
+import { COLUMNS_MEDIA_TYPE, decodeColumns, heatPoints } from "@/lib/utils";
 import {
   Anchor,
   Beaker,
@@ -739,10 +740,18 @@ function Dashboard() {
       try {
         const res = await fetch("http://localhost:8080/getMigration", {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: {
+            "Content-Type": "application/json",
+            Accept: `${COLUMNS_MEDIA_TYPE}, application/json`,
+          },
           body: JSON.stringify(PREY_THERMAL_PAYLOAD),
         });
         if (!res.ok) throw new Error(HTTP ${res.status});
+        if (res.headers.get("content-type")?.startsWith(COLUMNS_MEDIA_TYPE)) {
+          const points = heatPoints(decodeColumns(await res.arrayBuffer()));
+          if (!cancelled) setApiPreyThermal(points);
+          return;
+        }
         const data = await res.json();
         if (cancelled) return;
         console.log(data);
@@ -851,18 +860,13 @@ function Dashboard() {
     ];
   }, [apiMigration]);
 
-  // When Migration tab is selected, fetch shark activity predictions from backend
+  // When Migration tab is selected, fetch the precomputed global behaviour layer from backend
   useEffect(() => {
     let cancelled = false;
     (async () => {
       if (selected !== "d5") return;
       try {
-        const res = await fetch("http://localhost:8080/sharkActivity", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          // optionally send current map center/zoom to help backend
-          body: JSON.stringify({ center: mapCenter, zoom: mapZoom }),
-        });
+        const res = await fetch("http://localhost:8080/behaviour");
         if (!res.ok) throw new Error(HTTP ${res.status});
         const data = await res.json();
         if (cancelled) return;
@@ -875,16 +879,16 @@ function Dashboard() {
         } else if (Array.isArray(data?.activity)) {
           setApiSharkActivity(data.activity);
         } else {
-          console.warn("Unexpected /sharkActivity response", data);
+          console.warn("Unexpected /behaviour response", data);
         }
       } catch (err) {
-        console.warn("/sharkActivity fetch failed:", err?.message || err);
+        console.warn("/behaviour fetch failed:", err?.message || err);
       }
     })();
     return () => {
       cancelled = true;
     };
-  }, [selected, mapCenter?.[0], mapCenter?.[1], mapZoom]);
+  }, [selected]);
 
   // When Sighting Data tab is selected, POST to backend to get sighting points (server may accept center/zoom)
   useEffect(() => {
@@ -4,3 +4,51 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Binary columnar responses (backend/wire.py). Request them with this Accept type.
+export const COLUMNS_MEDIA_TYPE = "application/vnd.sharkapi.columns";
+
+const LITTLE_ENDIAN = new Uint8Array(new Uint32Array([1]).buffer)[0] === 1;
+
+/**
+ * Decode an ArrayBuffer in the columns layout:
+ * "SHKC", uint32 version, uint32 header length, JSON header, then float32 columns (little-endian).
+ * Returns { rows, columns: { name: Float32Array }, table, meta }.
+ */
+export function decodeColumns(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== "SHKC") throw new Error("Not a columns response");
+  const version = view.getUint32(4, true);
+  if (version !== 1) throw new Error(`Unsupported columns layout version ${version}`);
+  const headerLength = view.getUint32(8, true);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(buffer, 12, headerLength))
+  );
+  const columns = {};
+  let offset = 12 + headerLength;
+  for (const name of header.columns) {
+    if (LITTLE_ENDIAN) {
+      columns[name] = new Float32Array(buffer, offset, header.rows);
+    } else {
+      const values = new Float32Array(header.rows);
+      for (let i = 0; i < header.rows; i++) {
+        values[i] = view.getFloat32(offset + 4 * i, true);
+      }
+      columns[name] = values;
+    }
+    offset += 4 * header.rows;
+  }
+  return { rows: header.rows, columns, table: header.table, meta: header.meta };
+}
+
+/** [[lat, lng, weight], ...] for leaflet.heat from decoded columns (weight 1 when absent). */
+export function heatPoints(decoded, weight = "weight") {
+  const { lat, lng } = decoded.columns;
+  const w = decoded.columns[weight];
+  const points = new Array(decoded.rows);
+  for (let i = 0; i < decoded.rows; i++) {
+    points[i] = [lat[i], lng[i], w ? w[i] : 1];
+  }
+  return points;
+}